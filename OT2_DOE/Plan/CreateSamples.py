@@ -3,31 +3,107 @@ import pandas as pd
 import os
 import csv
 import ast
+import copy
 import datetime
+import hashlib
+import io
+from collections import namedtuple
+from scipy.stats import qmc
 from pytz import timezone
 
-mass_dictionary = {'g':1} # should build a dictionary of units people can add to such that not restricted to hardcoded ones
+##### Unit registry: the units the amount and stock volume calculations know how to handle. To support a new unit either add an entry to one of these dictionaries or use register_unit() #####
+##### Base units are g for mass and mL for volume, all component information (density and molecular weight) pulled from the chemical database is assumed to be in these. #####
+
+# Units of a total sample amount or of a calculated amount. Scale converts a value in the unit to the base unit.
+amount_units = {'g': {'quantity': 'mass', 'scale': 1},
+                'mL': {'quantity': 'volume', 'scale': 1},
+                'uL': {'quantity': 'volume', 'scale': 1/1000}}
+
+# Component concentration units. The total sample amount must be the sample quantity, the component amount comes out as amount in base units given by 
+# total sample amount (base units) * concentration value * factor(component_info)
+concentration_units = {'wtf': {'sample quantity': 'mass', 'amount': 'mass', 'factor': lambda component_info: 1},
+                       'mgpermL': {'sample quantity': 'volume', 'amount': 'mass', 'factor': lambda component_info: 1/1000},
+                       'molarity': {'sample quantity': 'volume', 'amount': 'mass', 'factor': lambda component_info: component_info['Molecular Weight (g/mol)']/1000},
+                       'volf': {'sample quantity': 'volume', 'amount': 'volume', 'factor': lambda component_info: 1}}
+
+# Stock concentration units. Content gives the amount of a component (base units of amount) held in 1 mL of stock,
+# content(stock_concentration, stock_density, component_info), the stock volume in mL is then the component amount/content.
+stock_units = {'wtf': {'amount': 'mass', 'content': lambda stock_concentration, stock_density, component_info: stock_concentration*stock_density},
+               'molarity': {'amount': 'mass', 'content': lambda stock_concentration, stock_density, component_info: stock_concentration*component_info['Molecular Weight (g/mol)']/1000},
+               'mgpermL': {'amount': 'mass', 'content': lambda stock_concentration, stock_density, component_info: stock_concentration/1000},
+               'volf': {'amount': 'volume', 'content': lambda stock_concentration, stock_density, component_info: stock_concentration}}
+
+# Units which are only ever identified in names and never converted
+property_units = ['molf', 'g/mL', 'g/mol']
+
+def register_unit(unit, unit_type, **unit_info):
+    """Adds a unit to the registry so it can be identified in column names and used in the amount and stock volume calculations. The unit_type is one of 'amount' (needs quantity and scale), 
+    'concentration' (needs sample quantity, amount and factor) or 'stock' (needs amount and content), see the registry dictionaries for what each entry means. i.e 
+    register_unit('mgperg', 'concentration', **{'sample quantity': 'mass', 'amount': 'mass', 'factor': lambda component_info: 1/1000})"""
+    registries = {'amount': (amount_units, ('quantity', 'scale')),
+                  'concentration': (concentration_units, ('sample quantity', 'amount', 'factor')),
+                  'stock': (stock_units, ('amount', 'content'))}
+    assert unit_type in registries, 'Unit type must be one of ' + str(list(registries))
+    registry, required_keys = registries[unit_type]
+    missing_keys = [key for key in required_keys if key not in unit_info]
+    assert not missing_keys, 'Unit information is missing the following entries: ' + str(missing_keys)
+    registry[unit] = unit_info
+
+def supported_units():
+    """Returns all registered units in the order they are searched for when identifying the unit of a string."""
+    units = list(concentration_units) + [unit for unit in stock_units if unit not in concentration_units]
+    units = units + property_units[:1] + list(amount_units) + property_units[1:]
+    return units
 
 
 ##### Set up the experiment plan dictionary to be referenced for useful information throughout a design of experiments. This is not necessary if loading in volumes directly#####
 
+parsed_file_cache = {} # (absolute path, parser name) : file modified time, size, content hash and parsed value
+
 def get_experiment_plan(filepath, chemical_database_path):
     """
-    Parse a .csv file to create a dictionary of instructions.
+    Parse a .csv file to create a dictionary of instructions. Both the plan and chemical database are only parsed again when their contents change (see cached_file_parse()),
+    a fresh copy is returned each call so the dictionary can be modified freely. For typed and indexed access to the plan use Plan.ExperimentPlan.
     """
-    with open(filepath, newline='') as csvfile:
-        reader = csv.reader(csvfile)
-        plan_dict = {}
-        for i, row in enumerate(reader):
-            assert len(row) == 2
-            plan_dict[row[0]] = ast.literal_eval(row[1])
-    
-    chem_data = pd.read_csv(chemical_database_path)
+    plan_dict = copy.deepcopy(cached_file_parse(filepath, parse_plan_csv))
+    plan_dict['Chemical Database'] = copy.deepcopy(cached_file_parse(chemical_database_path, parse_chemical_database))
+    return plan_dict
+
+def parse_plan_csv(content):
+    """Parses the bytes of a plan .csv, two entries per row of key and python literal value."""
+    reader = csv.reader(io.StringIO(content.decode(), newline=''))
+    plan_dict = {}
+    for i, row in enumerate(reader):
+        assert len(row) == 2
+        plan_dict[row[0]] = ast.literal_eval(row[1])
+    return plan_dict
+
+def parse_chemical_database(content):
+    """Parses the bytes of the chemical database .csv into a dictionary of component abbreviation : component information."""
+    chem_data = pd.read_csv(io.BytesIO(content))
     chem_data_names = chem_data['Component Abbreviation']
     chem_data.index = chem_data_names
-    plan_dict['Chemical Database'] = chem_data.T.to_dict()
-    
-    return plan_dict
+    return chem_data.T.to_dict()
+
+def cached_file_parse(filepath, parser):
+    """Returns parser(file bytes) reusing the previous result while the file is unchanged. A file whose modified time and size match the cache is not read at all, 
+    otherwise it is read and hashed and only parsed again if the content hash changed. The cached value is shared, copy it before modifying."""
+    path = os.path.abspath(filepath)
+    file_stat = os.stat(path)
+    cache_key = (path, parser.__name__)
+    cached = parsed_file_cache.get(cache_key)
+    if cached is not None and cached['mtime'] == file_stat.st_mtime_ns and cached['size'] == file_stat.st_size:
+        return cached['value']
+
+    with open(path, 'rb') as file:
+        content = file.read()
+    content_hash = hashlib.sha1(content).hexdigest()
+    if cached is None or cached['hash'] != content_hash:
+        cached = {'hash': content_hash, 'value': parser(content)}
+    cached['mtime'] = file_stat.st_mtime_ns
+    cached['size'] = file_stat.st_size
+    parsed_file_cache[cache_key] = cached
+    return cached['value']
 
 def component_order_dictionary(plan):
     """Would hold a nested dictionary for each component for the case of maintaining the order and not having to repeat the calling 
@@ -61,57 +137,208 @@ def concentration_from_excel(excel_path):
     concentration_df = concentration_df.astype(float)
     return concentration_df
 
-def concentration_from_linspace(component_names, component_linspaces, component_units, unity_filter = False, component_spacing_type='linear'):
+def concentration_from_linspace(component_names, component_linspaces, component_units, unity_filter = False, component_spacing_type='linear', chunk_size = None, chunk_filters = None):
     """ Uses linspaces to create a mesh of component concentrations. The linspaces are pulled from a csv plan where all arguments are in parellel (i.e position 1 of arugment 1 refers to position 1 of argument 2). 
     Hence linspaces pulled from plan are requried to match with component names and component unit arguments. The only exception is that you may leave the last linspace unspecified if you looking to complete the argument 
     using a unity filter. The application of the unity filter looks at the last position in the component names list and uses the other calculated component concentration values to find the difference of 1 to complete a sample concentration values. 
+    The mesh is built in chunks of chunk_size samples (all at once if None) and only the samples surviving the unity filter and chunk_filters are kept, see concentration_chunks_from_linspace().
     """
+    chunks = concentration_chunks_from_linspace(component_names, component_linspaces, component_units, unity_filter=unity_filter, 
+                                                component_spacing_type=component_spacing_type, chunk_size=chunk_size, chunk_filters=chunk_filters)
+    return concat_concentration_chunks(chunks, unity_filter)
 
+def concentration_from_list_componentwise_grid(component_names, component_concentrations_sublist, component_units, unity_filter = False, component_spacing_type='linear', chunk_size = None, chunk_filters = None):
+    """ Given the component names, units and concentrations in parallel will create a concentration dataframe. The concentration values are to formatted where each sublist contains all the information for a single SAMPLE
+    matching the order of component names and units. Each concentration from each component is used in combination with each other component concentration to create a combination of samples. For example component names = [comp1, comp2, comp3] then concentration_sublists = [[comp1_sample1, comp2_sample1, comp3_sample1], [comp1_sample2, comp2_sample2, comp3_sample2]]
+    """
+    chunks = concentration_chunks_from_grid(component_names, component_concentrations_sublist, component_units, unity_filter=unity_filter, 
+                                            chunk_size=chunk_size, chunk_filters=chunk_filters)
+    return concat_concentration_chunks(chunks, unity_filter)
+
+def concentration_chunks_from_linspace(component_names, component_linspaces, component_units, unity_filter = False, component_spacing_type='linear', chunk_size = 100000, chunk_filters = None):
+    """Generator version of concentration_from_linspace(). Rather than building the entire np.meshgrid in memory, yields concentration dataframes of at most chunk_size samples 
+    in the same order as the full mesh. Each chunk has the unity filter (if selected) followed by each function in chunk_filters applied before being yielded, so only surviving samples are ever held. 
+    A chunk filter is any function taking and returning a dataframe (i.e. lambda df: filter_total_volume_restriction(volume_function(df), 1000, allow_empty=True)), chunks with no survivors are skipped."""
     conc_range_list = [] 
     for conc_linspace in component_linspaces:
         if component_spacing_type == "linear": 
             conc_range_list.append(np.linspace(*conc_linspace))
         elif component_spacing_type == "log": 
             conc_range_list.append(np.logspace(*conc_linspace))
-    conc_grid = np.meshgrid(*conc_range_list)
-
-    component_conc_dict = {} 
-    for i in range(len(conc_grid)): 
-        component_name = component_names[i]
-        component_unit = component_units[i]
-        component_values = conc_grid[i].ravel()
-        component_conc_dict[component_name + " " + 'concentration' + " " + component_unit] = conc_grid[i].ravel()
-    concentration_df = pd.DataFrame.from_dict(component_conc_dict)
+    return concentration_chunks_from_grid(component_names, conc_range_list, component_units, unity_filter=unity_filter, chunk_size=chunk_size, chunk_filters=chunk_filters)
+
+def concentration_chunks_from_grid(component_names, component_concentrations_sublist, component_units, unity_filter = False, chunk_size = 100000, chunk_filters = None):
+    """Generator yielding chunks of the grid made from every combination of the component concentration sublists, see concentration_chunks_from_linspace()."""
+    column_names = [component_names[i] + " " + 'concentration' + " " + component_units[i] for i in range(len(component_concentrations_sublist))]
+    for conc_columns in grid_chunks(component_concentrations_sublist, chunk_size):
+        concentration_df = pd.DataFrame(dict(zip(column_names, conc_columns)))
+        if unity_filter == True: # POTENTIAL ISSUE IF LEFT ON AS TRUE EVEN IF NOT USING COMPLETING FORMULATION CAN OVERWRITE
+            concentration_df = unity_filter_df(concentration_df, component_names, component_units, allow_empty=True)
+        if chunk_filters is not None:
+            for chunk_filter in chunk_filters:
+                if concentration_df.empty:
+                    break
+                concentration_df = chunk_filter(concentration_df)
+        if not concentration_df.empty:
+            yield concentration_df
+
+def grid_chunks(value_lists, chunk_size = None):
+    """Yields the combinations of the value lists in chunks of chunk_size, each chunk a list of arrays (one per value list). The combinations are found from the 
+    flat sample index so nothing but the current chunk is held, the order is the same as np.meshgrid(*value_lists) raveled (i.e the first two lists swapped in nesting)."""
+    value_arrays = [np.asarray(values) for values in value_lists]
+    axis_order = list(range(len(value_arrays)))
+    if len(axis_order) > 1: # meshgrid default of xy indexing nests the second axis outside the first 
+        axis_order[0], axis_order[1] = 1, 0
+    shape = [len(value_arrays[axis]) for axis in axis_order]
+    n_total = int(np.prod(shape))
+    if chunk_size is None:
+        chunk_size = max(n_total, 1)
+
+    for start in range(0, n_total, chunk_size):
+        flat_index = np.arange(start, min(start + chunk_size, n_total))
+        axis_indexes = np.unravel_index(flat_index, shape)
+        chunk = [None]*len(value_arrays)
+        for axis, axis_index in zip(axis_order, axis_indexes):
+            chunk[axis] = value_arrays[axis][axis_index]
+        yield chunk
+
+def concentration_from_linspace_simplex(component_names, component_linspaces, component_units, component_spacing_type='linear', chunk_filters = None):
+    """ Unity filtered version of concentration_from_linspace() which only ever creates the feasible samples. Rather than building the whole hypercube and removing 
+    every sample where the completing (last) component is <= 0, the lattice is enumerated one component at a time and any partial sample which can no longer sum to below 1 
+    (using the minimum of each remaining linspace) is pruned. Returns the same samples in the same order as concentration_from_linspace(..., unity_filter=True).
+    """
+    chunks = concentration_chunks_from_simplex(component_names, component_linspaces, component_units, 
+                                               component_spacing_type=component_spacing_type, chunk_filters=chunk_filters)
+    return concat_concentration_chunks(chunks, unity_filter=True)
 
-    # this is only here for linspaces as why? it should just be an option for all of them
-    if unity_filter == True: # POTENTIAL ISSUE IF LEFT ON AS TRUE EVEN IF NOT USING COMPLETING FORMULATION CAN OVERWRITE
-        unity_filter_df(concentration_df, component_names, component_units)
+def concentration_chunks_from_simplex(component_names, component_linspaces, component_units, component_spacing_type='linear', chunk_filters = None):
+    """Generator version of concentration_from_linspace_simplex(), yields one unity filtered dataframe per value of the outermost mesh component."""
+    conc_range_list = [] 
+    for conc_linspace in component_linspaces:
+        if component_spacing_type == "linear": 
+            conc_range_list.append(np.linspace(*conc_linspace))
+        elif component_spacing_type == "log": 
+            conc_range_list.append(np.logspace(*conc_linspace))
 
+    column_names = [component_names[i] + " " + 'concentration' + " " + component_units[i] for i in range(len(conc_range_list))]
+    for conc_columns in simplex_grid_chunks(conc_range_list):
+        concentration_df = pd.DataFrame(dict(zip(column_names, conc_columns)))
+        # exact same check as the full grid, pruning only removed samples which could never pass it 
+        concentration_df = unity_filter_df(concentration_df, component_names, component_units, allow_empty=True)
+        if chunk_filters is not None:
+            for chunk_filter in chunk_filters:
+                if concentration_df.empty:
+                    break
+                concentration_df = chunk_filter(concentration_df)
+        if not concentration_df.empty:
+            yield concentration_df
+
+def simplex_grid_chunks(value_lists, total = 1, tolerance = 1e-9):
+    """Yields the combinations of the value lists whose sum is below total, one chunk (list of arrays, one per value list) for each value of the outermost nested list. 
+    Combinations are grown one list at a time keeping only partial sums which can still end below total given the smallest value of every list not yet added. 
+    Ordering is the same as grid_chunks() so results line up with the full grid after filtering."""
+    value_arrays = [np.asarray(values, dtype=float) for values in value_lists]
+    axis_order = list(range(len(value_arrays)))
+    if len(axis_order) > 1: # same nesting as np.meshgrid xy indexing
+        axis_order[0], axis_order[1] = 1, 0
+    remaining_mins = [sum(value_arrays[axis].min() for axis in axis_order[i+1:]) for i in range(len(axis_order))]
+    limit = total + tolerance
+
+    outer_axis = axis_order[0]
+    for outer_value in value_arrays[outer_axis]:
+        if outer_value + remaining_mins[0] >= limit:
+            continue
+        partial_sums = np.array([outer_value])
+        chosen = [np.zeros(1, dtype=int)]
+        for depth, axis in enumerate(axis_order[1:], start=1):
+            values = value_arrays[axis]
+            feasible = (partial_sums[:, None] + values[None, :] + remaining_mins[depth]) < limit
+            parent_index, value_index = np.nonzero(feasible) # row major so lexicographic order is kept
+            chosen = [previous[parent_index] for previous in chosen] + [value_index]
+            partial_sums = partial_sums[parent_index] + values[value_index]
+            if len(partial_sums) == 0:
+                break
+        if len(partial_sums) == 0:
+            continue
+        chunk = [None]*len(value_arrays)
+        for axis, axis_index in zip(axis_order, chosen):
+            chunk[axis] = np.full(len(partial_sums), outer_value) if axis == outer_axis else value_arrays[axis][axis_index]
+        yield chunk
+
+def concat_concentration_chunks(chunks, unity_filter = False):
+    """Combines the chunks yielded by the concentration chunk generators into one dataframe with a fresh index."""
+    chunk_list = list(chunks)
+    if not chunk_list:
+        if unity_filter == True:
+            raise AssertionError('No suitable samples were found, please change your concentration space. Most likely this means you have your linspaces set too close together at all high concentrations (close to 1) resulting in impossible samples (wtf/volf>1).')
+        raise AssertionError('No suitable samples were found, all samples were removed by the chunk filters.')
+    concentration_df = pd.concat(chunk_list, ignore_index=True)
     return concentration_df
 
-def concentration_from_list_componentwise_grid(component_names, component_concentrations_sublist, component_units, unity_filter = False, component_spacing_type='linear'):
-    """ Given the component names, units and concentrations in parallel will create a concentration dataframe. The concentration values are to formatted where each sublist contains all the information for a single SAMPLE
-    matching the order of component names and units. Each concentration from each component is used in combination with each other component concentration to create a combination of samples. For example component names = [comp1, comp2, comp3] then concentration_sublists = [[comp1_sample1, comp2_sample1, comp3_sample1], [comp1_sample2, comp2_sample2, comp3_sample2]]
+def concentration_from_sampler(component_names, component_bounds, component_units, n_samples, method = 'lhs', unity_filter = False, seed = None, maximin_candidates = 20, max_draws = 100):
+    """ Space filling alternative to the full grid of concentration_from_linspace(), returns n_samples in the same dataframe format. The bounds are pulled from the plan linspaces 
+    ([min, max] or [min, max, n] where n is ignored) and are parallel to the component names and units, as with linspaces the last component can be left unspecified if completing with the unity filter.
+    Methods: 'lhs' (Latin hypercube), 'sobol' and 'halton' (scrambled low discrepancy sequences) and 'maximin' (greedy maximin selection out of a Latin hypercube pool of maximin_candidates*n_samples).
+    With the unity filter, samples whose specified components sum to 1 or more are rejected and the sequence is continued until n_samples are found (up to max_draws rounds).
     """
+    bounds = np.asarray([component_bound[:2] for component_bound in component_bounds], dtype=float)
+    lower_bounds, upper_bounds = bounds[:, 0], bounds[:, 1]
+    n_dimensions = len(bounds)
+
+    if method == 'maximin':
+        pool = sample_concentration_space(lower_bounds, upper_bounds, n_samples*maximin_candidates, 'lhs', unity_filter, seed, max_draws)
+        spans = np.where(upper_bounds > lower_bounds, upper_bounds - lower_bounds, 1)
+        samples = pool[maximin_selection((pool - lower_bounds)/spans, n_samples)]
+    else:
+        samples = sample_concentration_space(lower_bounds, upper_bounds, n_samples, method, unity_filter, seed, max_draws)
 
-    conc_range_list = [] 
-    for conc_space in component_concentrations_sublist:
-        conc_range_list.append(conc_space)
-    conc_grid = np.meshgrid(*conc_range_list)
-
-    component_conc_dict = {} 
-    for i in range(len(conc_grid)): 
-        component_name = component_names[i]
-        component_unit = component_units[i]
-        component_values = conc_grid[i].ravel()
-        component_conc_dict[component_name + " " + 'concentration' + " " + component_unit] = conc_grid[i].ravel()
-    concentration_df = pd.DataFrame.from_dict(component_conc_dict)
-
+    column_names = [component_names[i] + " " + 'concentration' + " " + component_units[i] for i in range(n_dimensions)]
+    concentration_df = pd.DataFrame(samples, columns=column_names)
     if unity_filter == True:
-        unity_filter_df(concentration_df, component_names, component_units)
-
+        concentration_df = unity_filter_df(concentration_df, component_names, component_units)
     return concentration_df
 
+def sample_concentration_space(lower_bounds, upper_bounds, n_samples, method = 'lhs', unity_filter = False, seed = None, max_draws = 100):
+    """Draws n_samples points within the bounds from a scipy.stats.qmc sampler ('lhs', 'sobol' or 'halton'). With the unity filter points summing to 1 or more are rejected, 
+    the sampler is drawn from again (continuing the same sequence) until enough points are found. Sobol points are drawn so the total drawn is always a power of two, 
+    keeping the balance properties of the sequence."""
+    n_dimensions = len(lower_bounds)
+    samplers = {'lhs': lambda: qmc.LatinHypercube(d=n_dimensions, rng=seed),
+                'sobol': lambda: qmc.Sobol(d=n_dimensions, scramble=True, rng=seed),
+                'halton': lambda: qmc.Halton(d=n_dimensions, scramble=True, rng=seed)}
+    assert method in samplers, 'Sampling method must be one of ' + str(list(samplers) + ['maximin'])
+    sampler = samplers[method]()
+
+    found = []
+    n_found = 0
+    for draw in range(max_draws):
+        n_to_draw = max(n_samples - n_found, 1)
+        if method == 'sobol': # sobol is only balanced for powers of two
+            n_drawn = sampler.num_generated
+            n_to_draw = int(2**np.ceil(np.log2(n_drawn + n_to_draw))) - n_drawn
+        points = lower_bounds + sampler.random(n_to_draw)*(upper_bounds - lower_bounds) # fixed components (min = max) are allowed
+        if unity_filter == True:
+            points = points[points.sum(axis=1) < 1]
+        found.append(points)
+        n_found = n_found + len(points)
+        if n_found >= n_samples:
+            break
+    else:
+        raise AssertionError('Only ' + str(n_found) + ' of ' + str(n_samples) + ' samples were found within the unity constraint, please change your concentration bounds.')
+    return np.concatenate(found)[:n_samples]
+
+def maximin_selection(points, n_select):
+    """Greedily selects n_select of the points (scaled so each dimension is comparable) which maximize the minimum distance between selected points, 
+    starting from the point closest to the center. Returns the indexes of the selected points in order of selection."""
+    assert len(points) >= n_select, 'Not enough candidate points to select from'
+    selected = [int(np.argmin(((points - points.mean(axis=0))**2).sum(axis=1)))]
+    min_distances = ((points - points[selected[0]])**2).sum(axis=1)
+    for i in range(1, n_select):
+        next_index = int(np.argmax(min_distances))
+        selected.append(next_index)
+        min_distances = np.minimum(min_distances, ((points - points[next_index])**2).sum(axis=1))
+    return np.asarray(selected)
+
 def concentration_from_list_samplewise(component_names, concentration_sublists, component_units):
     """ Given the component names, units and concentrations in parallel will create a concentration dataframe. The concentration values are to formatted where each sublist contains all the information for a single SAMPLE
     matching the order of component names and units. For example component names = [comp1, comp2, comp3] then concentration_sublists = [[comp1_sample1, comp2_sample1, comp3_sample1], [comp1_sample2, comp2_sample2, comp3_sample2]]
@@ -140,10 +367,10 @@ def concentration_from_list_componentwise(component_names, concentration_sublist
 
     return concentration_df
 
-def unity_filter_df(concentration_df, component_names, component_units):
+def unity_filter_df(concentration_df, component_names, component_units, allow_empty = False):
     """For units which sum to one, will create an additional column to represent the final component. This will require 
     that the input information such as sample names have this completing component as the last entry. Currently no general way 
-    to verify if sample is under of overspecified, must verify yourself.
+    to verify if sample is under of overspecified, must verify yourself. Set allow_empty to True when filtering a chunk of a larger space.
     """
 
     completing_index = len(component_names)-1
@@ -157,7 +384,7 @@ def unity_filter_df(concentration_df, component_names, component_units):
     concentration_df = concentration_df[concentration_df[completing_entry_name] > 0]
     concentration_df.reset_index(drop=True, inplace=True)
 
-    assert not concentration_df.empty, 'No suitable samples were found, please change your concentration space. Most likely this means you have your linspaces set too close together at all high concentrations (close to 1) resulting in impossible samples (wtf/volf>1). Turn on expose_df to return unfiltered dataframe'
+    assert allow_empty or not concentration_df.empty, 'No suitable samples were found, please change your concentration space. Most likely this means you have your linspaces set too close together at all high concentrations (close to 1) resulting in impossible samples (wtf/volf>1). Turn on expose_df to return unfiltered dataframe'
     return concentration_df
 
 
@@ -167,69 +394,115 @@ def unity_filter_df(concentration_df, component_names, component_units):
 def determine_component_mass(total_sample_amount, total_sample_amount_unit, component_values, component_unit, component_info):
     """Determines the mass of a component (series or single value) based on the total sample unit and the component unit. 
     Hence there are a finate number of unit combinations which will work, the easiest way to think about this look the numerator 
-    and denominator of the component unit and determine how to remove the denominator."""
-    
-    if total_sample_amount_unit == 'g' and component_unit == 'wtf':
-        component_masses = total_sample_amount*component_values
-
-    elif total_sample_amount_unit == 'mL' and component_unit == 'mgpermL':
-        component_masses = total_sample_amount*component_values/1000 # for now default mass = g, volume = mL
-
-    elif total_sample_amount_unit == 'mL' and component_unit == 'molarity':
-        molecular_weight = component_info['Molecular Weight (g/mol)']
-        component_masses = total_sample_amount*component_values*molecular_weight/1000
-    
-    else: 
+    and denominator of the component unit and determine how to remove the denominator. Supported combinations come from the unit registry."""
+    amount_factor = component_amount_factor(total_sample_amount_unit, component_unit, component_info, 'mass')
+    if amount_factor is None:
         raise AssertionError(total_sample_amount_unit, 'and', component_unit, 'units are not supported to calculate for mass')
-    print('You calculated for component masses given the provided units')
+    component_masses = total_sample_amount*component_values*amount_factor
     return component_masses
 
 def determine_component_volumes(total_sample_amount, total_sample_amount_unit, component_values, component_unit, component_info):
     """Determines the volume of a component (series or single value) based on the total sample unit and the component unit. 
     Hence there are a finate number of unit combinations which will work, the easiest way to think about this look the numerator 
-    and denominator of the component unit and determine how to remove the denominator."""
-    
-    if total_sample_amount_unit == 'mL' and component_unit == 'volf':
-        component_volume = total_sample_amount*component_values
-        print('You calculated for component volumes given the provided units')
-        return component_volume
+    and denominator of the component unit and determine how to remove the denominator. Supported combinations come from the unit registry."""
+    amount_factor = component_amount_factor(total_sample_amount_unit, component_unit, component_info, 'volume')
+    if amount_factor is None:
+        raise AssertionError(total_sample_amount_unit, 'and', component_unit, 'units are not supported to calculate for volume')
+    component_volume = total_sample_amount*component_values*amount_factor
+    return component_volume
+
+def component_amount_factor(total_sample_amount_unit, component_unit, component_info, quantity):
+    """Looks up in the unit registry the factor which converts total sample amount*component value into the component amount (g or mL). 
+    Returns None if the combination of sample unit and component unit does not lead to the quantity ('mass' or 'volume') asked for."""
+    sample_unit_info = amount_units.get(total_sample_amount_unit)
+    component_unit_info = concentration_units.get(component_unit)
+    if sample_unit_info is None or component_unit_info is None:
+        return None
+    if sample_unit_info['quantity'] != component_unit_info['sample quantity'] or component_unit_info['amount'] != quantity:
+        return None
+    return sample_unit_info['scale']*component_unit_info['factor'](component_info)
 
 def determine_component_amounts(plan, concentration_df, nan_fill_value = None):
     """Based on plan information (Component Names and total sample unit) will determine the amount of each component (mass and volume) 
     required for each sample. Currently only supports mL and g as default units as this is the density unit basis pulled from a the chemical database.
-    It is recommended you keep plan lists in order i.e component[2] refers to the third column of components. Ensure you do not modify the column names."""
+    It is recommended you keep plan lists in order i.e component[2] refers to the third column of components. Ensure you do not modify the column names.
+    The unit conversions are compiled once for all columns (see compile_unit_conversions()) and applied to every sample at once."""
     concentration_df = concentration_df.copy()
+    conversions = compile_unit_conversions(plan, concentration_df.columns)
+    component_masses, component_volumes = calculate_component_amounts(conversions, concentration_df)
+
+    amount_columns = {}
+    for i, component_name in enumerate(conversions['Component Names']):
+        mass_column = (component_name + ' amount mass ' + 'g', component_masses[:, i])
+        volume_column = (component_name + ' amount volume ' + 'mL', component_volumes[:, i])
+        if conversions['Amount Quantities'][i] == 'mass': # these are the unit that lead to mass outcomes
+            amount_columns.update([mass_column, volume_column])
+        else: # these are the unit that lead to volume outcomes
+            amount_columns.update([volume_column, mass_column])
+    amounts_df = pd.DataFrame(amount_columns, index=concentration_df.index)
+    concentration_df = pd.concat([concentration_df.drop(columns=[col for col in amounts_df if col in concentration_df]), amounts_df], axis=1)
+
+    if nan_fill_value is not None:
+        concentration_df = concentration_df.fillna(nan_fill_value)
+
+    return concentration_df
+
+def compile_unit_conversions(plan, concentration_columns):
+    """Parses the component name and unit of each concentration column once and pulls the matching information from the plan (total sample amount and chemical database) to build 
+    per component coefficients, such that component masses = concentrations*mass coefficients and component volumes = concentrations*volume coefficients for all samples. 
+    Columns whose unit is not a registered concentration unit are skipped. Returns a dictionary of the compiled information."""
     component_info_dict = plan['Chemical Database']
     total_sample_amount_unit = plan['Sample Unit']
     total_sample_amount = plan['Sample Amount']
-    
-    for column_name in concentration_df: 
+
+    columns = []
+    component_names = []
+    amount_quantities = []
+    mass_coefficients = []
+    volume_coefficients = []
+    for column_name in concentration_columns:
+        component_unit = identify_unit(column_name, required=False)
+        if component_unit not in concentration_units:
+            continue
         component_name = identify_component_name(column_name)
-        component_unit = identify_unit(column_name)
-        component_values = concentration_df[column_name]
+        assert component_name in component_info_dict, component_name + ' is not in the chemical database'
         component_info = component_info_dict[component_name]
         component_density = component_info['Density (g/mL)']
-        if component_unit == 'wtf' or 'mgpermL' or 'molarity': # these are the unit that lead to mass outcomes
-            component_masses = determine_component_mass(total_sample_amount, total_sample_amount_unit, component_values, component_unit, component_info)  
-            component_volumes = component_masses/component_density
-            concentration_df[component_name + ' amount mass ' + 'g']  = component_masses
-            concentration_df[component_name + ' amount volume ' + 'mL']  = component_volumes
-        if component_unit == 'volf': # these are the unit that lead to volume outcomes
-            component_volumes = determine_component_volumes(total_sample_amount, total_sample_amount_unit, component_values, component_unit, component_info)  
-            component_masses = component_volumes*component_density
-            concentration_df[component_name + ' amount volume ' + 'mL']  = component_volumes
-            concentration_df[component_name + ' amount mass ' + 'g']  = component_masses
-    
-    if nan_fill_value is not None:
-        concentration_df = concentration_df.fillna(nan_fill_value)
-
-    return concentration_df
+        amount_quantity = concentration_units[component_unit]['amount']
+        amount_factor = component_amount_factor(total_sample_amount_unit, component_unit, component_info, amount_quantity)
+        if amount_factor is None:
+            raise AssertionError(total_sample_amount_unit, 'and', component_unit, 'units are not supported to calculate for component amounts')
+        amount_coefficient = total_sample_amount*amount_factor
+        if amount_quantity == 'mass':
+            mass_coefficients.append(amount_coefficient)
+            volume_coefficients.append(amount_coefficient/component_density)
+        else:
+            volume_coefficients.append(amount_coefficient)
+            mass_coefficients.append(amount_coefficient*component_density)
+        columns.append(column_name)
+        component_names.append(component_name)
+        amount_quantities.append(amount_quantity)
+
+    conversions = {'Columns': columns,
+                   'Component Names': component_names,
+                   'Amount Quantities': amount_quantities,
+                   'Mass Coefficients': np.asarray(mass_coefficients, dtype=float),
+                   'Volume Coefficients': np.asarray(volume_coefficients, dtype=float)}
+    return conversions
+
+def calculate_component_amounts(conversions, concentration_df):
+    """Using compiled conversions (compile_unit_conversions()) returns two arrays (samples x components) of component masses in g and component volumes in mL."""
+    concentrations = concentration_df[conversions['Columns']].to_numpy(dtype=float)
+    component_masses = concentrations*conversions['Mass Coefficients']
+    component_volumes = concentrations*conversions['Volume Coefficients']
+    return component_masses, component_volumes
 
 def stock_dictionary(stock_names, stock_units, stock_values, stock_densities = None):
     """Creating a dictionary which will contain information tied to a stocks name. The arugments provides must be in list form with positions being in parallel. 
     The stock name is required to be in the form 'solute1...-soluten-solvent-stock' where the entry prior to the keyword stock are solvent and anything prior to that is assumed a solute.
     Stock density is an optional argument as it is only necessary for one pathway (when using stock wtf), if only some stocks are known ensure the unknown are placed as nan. In the case of a stock 
-    being purely one component with known density do this [nan, known density, nan] ... etc"""
+    being purely one component with known density do this [nan, known density, nan] ... etc
+    For stocks with several solutes the stock value can be a list of concentrations in the same order as the solutes in the name (stock volumes are then solved by solve_stock_volumes())."""
 
     if stock_densities == None:
         stock_densities = len(stock_names)*[float('nan')]
@@ -242,6 +515,8 @@ def stock_dictionary(stock_names, stock_units, stock_values, stock_densities = N
         stock_components = stock_name.split('-')
         stock_solutes = stock_components[:-2] # will always be a list
         stock_solvent = stock_components[-2]
+        if isinstance(stock_value, (list, tuple, np.ndarray)):
+            assert len(stock_value) == len(stock_solutes), stock_name + ' needs one concentration per solute'
         stock_dict[stock_name] = {'solutes': stock_solutes, 'solvents':stock_solvent, 'unit': stock_unit, 'concentration': stock_value, 'Density (g/mL)': stock_density}
     
     stock_dict = identify_common_solvents(stock_dict)
@@ -277,73 +552,32 @@ def calculate_stock_volumes_mass_units(component_mass, component_unit, stock_con
     - Component mass and unit
     - Stock concentration anf unit 
     - Optional stock and component info
-    will calculate and return the volume of stock needed to achieve the provided mass of component. Currently hardcoded units are only supported, grams is the only mass. 
+    will calculate and return the volume of stock needed to achieve the provided mass of component. Supported units come from the unit registry.
     """
 
     # hmm maybe add something to catch if someone forgets or has density or mw as nan. 
-    if component_unit == 'g' and stock_unit == 'wtf': # we need to specify g as it is the only thing working
-        stock_mass = component_mass/stock_concentration # in g
-        stock_volume = stock_mass/stock_density
-    elif component_unit == 'g' and stock_unit == 'molarity':
-         stock_volume = 1000*component_mass/(stock_concentration*component_mw) # in mL
-    elif component_unit == 'g' and stock_unit == 'mgpermL':
-         stock_volume = component_mass/(stock_concentration/1000)
+    if amount_units.get(component_unit, {}).get('quantity') == 'mass' and stock_units.get(stock_unit, {}).get('amount') == 'mass':
+        stock_content = stock_units[stock_unit]['content'](stock_concentration, stock_density, {'Molecular Weight (g/mol)': component_mw})
+        stock_volume = component_mass*amount_units[component_unit]['scale']/stock_content # in mL
     else:
         raise AssertionError("Units provided are not currently supported for component mass to stock volume calculations")
     return stock_volume
 
 def calculate_stock_volumes_vol_units(component_volume, component_unit, stock_concentration, stock_unit, stock_density = None, stock_mw = None):
-    # mL could really be anything
-    if component_unit == 'mL' and stock_unit == 'volf': # we need to specify g as it is the only thing working
-        stock_volume = component_volume/stock_concentration
-
+    if amount_units.get(component_unit, {}).get('quantity') == 'volume' and stock_units.get(stock_unit, {}).get('amount') == 'volume':
+        stock_content = stock_units[stock_unit]['content'](stock_concentration, stock_density, {'Molecular Weight (g/mol)': stock_mw})
+        stock_volume = component_volume*amount_units[component_unit]['scale']/stock_content # in mL
     else: 
         raise AssertionError("Units provided are not currently supported for component volume to stock volume calculations")
     return stock_volume
 
 
 def calculate_stock_volumes_from_component_concs(plan, complete_component_df, stock_dict): # this is working to be more automatic
-
-    component_dict = plan['Chemical Database']
-
-
-    component_concentrations = isolate_common_column(complete_component_df, 'concentration')
-    component_masses = isolate_common_column(complete_component_df, 'mass')
-    component_volumes = isolate_common_column(complete_component_df, 'volume')
-    for stock_name, stock_info in stock_dict.items():
-        stock_unit = stock_info['unit']
-        stock_concentration = stock_info['concentration']
-        stock_density = stock_info['Density (g/mL)']
-        
-        if len(stock_info['solutes']) != 0:
-            component_name = stock_info['solutes'][0]
-        else:
-            component_name = stock_info['solvents']
-        
-        
-        concentration_column = find_component_column(component_name, component_concentrations)
-        component_conc_unit = identify_unit(concentration_column[0])
-#         component_concs = component_concentrations[concentration_column]
-        # ok using the concentraiton you determined the path to take and which information to pull
-        
-        if component_conc_unit in ('wtf', 'molarity', 'mgpermL') and stock_unit in ('wtf', 'molarity', 'mgpermL'):
-            component_mass_column = find_component_column(component_name, component_masses)
-            component_unit = identify_unit(component_mass_column[0])
-            component_mass = component_masses[component_mass_column]
-            component_mw = component_dict[component_name]['Molecular Weight (g/mol)']
-            stock_volumes = calculate_stock_volumes_mass_units(component_mass, component_unit, stock_concentration, stock_unit, stock_density, component_mw)
-            
-        if component_conc_unit in ('volf', 'molarity', 'mgpermL') and stock_unit in ('volf'): # hmm this is odd, but essentially if you see volf with it is just easier to use volumes as the basis over mass, but be careful since you can calualte
-            #so leave both the option to use all masses or if everything has defined density then okay to use, this was more made for pure liquids
-            component_volume_column = find_component_column(component_name, component_volumes)
-            component_unit = identify_unit(component_volume_column[0])
-            component_volume = component_volumes[component_volume_column]
-            
-            stock_volumes = calculate_stock_volumes_vol_units(component_volume, component_unit, stock_concentration, stock_unit)
-        
-        complete_component_df[stock_name + ' amount volume mL'] = stock_volumes
-    return complete_component_df
-
+    """Calculates the volume of each stock needed for each sample from the component amount columns made by determine_component_amounts(), solving all stocks and samples at once 
+    through solve_stock_volumes(). The solvents of stocks holding solutes are not tracked, so as before each stock is set by its solutes (or its solvent if a pure stock) and common 
+    solvents are accounted for afterwards (see calculate_common_solvent_residual_volumes()), to account for them directly use solve_stock_volumes()."""
+    stock_volume_df = solve_stock_volumes(plan, complete_component_df, stock_dict, track_solvents=False)
+    return stock_volume_df.drop(columns=['Negative Stock Volume', 'Stock Solve Residual'])
 
 def calculate_stock_volumes_from_component_masses(plan, complete_component_df, stock_dict): # this can be trouble some since it restirct you from ever mixing volf and the other units, it makes all basis of mass, what instead should be done is basedon the unit of both the stock and component it should direct to appropiate function
     """Used to calculate stock volume from component volumes. This pathway is only appropiate when dealing with component masses and stock units of wtf, molarity, and mgpermL.
@@ -357,6 +591,7 @@ def calculate_stock_volumes_from_component_masses(plan, complete_component_df, s
         stock_concentration = stock_info['concentration']
         stock_density = stock_info['Density (g/mL)']
         
+        assert len(stock_info['solutes']) <= 1 and not isinstance(stock_concentration, (list, tuple, np.ndarray)), stock_name + ' has several solutes, use solve_stock_volumes()'
         if len(stock_info['solutes']) != 0:
             component_name = stock_info['solutes'][0]
         else:
@@ -372,6 +607,102 @@ def calculate_stock_volumes_from_component_masses(plan, complete_component_df, s
     return complete_component_df
 
 
+#### Linear algebra pathway: rather than matching one component to one stock and correcting common solvents afterwards, the stock compositions are written as a matrix 
+#### (amount of each component in 1 mL of each stock) and the stock volumes of every sample are solved for at once. Supports stocks with several solutes and common solvents.
+
+def solve_stock_volumes(plan, concentration_df, stock_dict, negative_tolerance = 1e-12, track_solvents = True):
+    """Calculates the stock volumes (mL) for every sample by solving composition matrix @ stock volumes = component amounts for all samples in one batched solve. The component amounts come 
+    from the amount columns made by determine_component_amounts() when present (so a nan_fill_value given there is kept), otherwise from the concentration columns 
+    (see compile_unit_conversions()), and the composition matrix from stock_composition_matrix(), track_solvents = False leaves out the solvent of stocks holding solutes. An exact solve is used when the matrix is square and invertible, 
+    otherwise least squares. Returned is a copy of the dataframe with a '<stock name> amount volume mL' column per stock plus 'Negative Stock Volume' (True when a sample would need a negative 
+    volume of any stock, i.e. not makeable with these stocks) and 'Stock Solve Residual' (relative mismatch between the requested and achievable component amounts)."""
+    concentration_df = concentration_df.copy()
+    conversions = compile_unit_conversions(plan, concentration_df.columns)
+    component_quantities = conversions['Amount Quantities']
+    amount_columns = [component_name + (' amount mass g' if quantity == 'mass' else ' amount volume mL')
+                      for component_name, quantity in zip(conversions['Component Names'], component_quantities)]
+    if all(column in concentration_df for column in amount_columns):
+        component_amounts = concentration_df[amount_columns].to_numpy(dtype=float)
+    else:
+        component_masses, component_volumes = calculate_component_amounts(conversions, concentration_df)
+        is_mass = np.asarray([quantity == 'mass' for quantity in component_quantities])
+        component_amounts = np.where(is_mass, component_masses, component_volumes)
+
+    stock_names = list(stock_dict)
+    composition_matrix = stock_composition_matrix(plan, stock_dict, conversions['Component Names'], component_quantities, track_solvents)
+
+    if composition_matrix.shape[0] == composition_matrix.shape[1] and np.linalg.matrix_rank(composition_matrix) == composition_matrix.shape[0]:
+        stock_volumes = np.linalg.solve(composition_matrix, component_amounts.T).T
+    else:
+        stock_volumes = np.linalg.lstsq(composition_matrix, component_amounts.T, rcond=None)[0].T
+
+    residuals = component_amounts - stock_volumes @ composition_matrix.T
+    amount_norms = np.linalg.norm(component_amounts, axis=1)
+    relative_residuals = np.linalg.norm(residuals, axis=1)/np.where(amount_norms > 0, amount_norms, 1)
+
+    stock_volume_df = pd.DataFrame(stock_volumes, index=concentration_df.index, columns=[stock_name + ' amount volume mL' for stock_name in stock_names])
+    stock_volume_df['Negative Stock Volume'] = (stock_volumes < -negative_tolerance).any(axis=1)
+    stock_volume_df['Stock Solve Residual'] = relative_residuals
+    concentration_df = pd.concat([concentration_df.drop(columns=[col for col in stock_volume_df if col in concentration_df]), stock_volume_df], axis=1)
+    return concentration_df
+
+def stock_composition_matrix(plan, stock_dict, component_names, component_quantities, track_solvents = True):
+    """Builds the (components x stocks) matrix of the amount of each component held in 1 mL of each stock, in the quantity (mass g or volume mL) given for each component. 
+    Solute contents come from the stock unit in the unit registry. The solvent is whatever is left: if the stock density is known the solvent mass is the stock density minus the solute masses, 
+    otherwise the solvent volume is 1 mL minus the solute volumes (solutes of unknown density are taken as having no volume). Components not in a stock are zero, as is the solvent 
+    of stocks holding solutes when track_solvents is False."""
+    component_info_dict = plan['Chemical Database']
+    component_index = {component_name: i for i, component_name in enumerate(component_names)}
+    composition_matrix = np.zeros((len(component_names), len(stock_dict)))
+
+    def convert(amount, from_quantity, to_quantity, density):
+        if from_quantity == to_quantity:
+            return amount
+        converted = amount/density if to_quantity == 'volume' else amount*density
+        return converted if np.isfinite(converted) else 0.0
+
+    for stock_index, (stock_name, stock_info) in enumerate(stock_dict.items()):
+        stock_unit = stock_info['unit']
+        assert stock_unit in stock_units, stock_unit + ' is not a supported stock unit, the following units are supported: ' + str(list(stock_units))
+        stock_quantity = stock_units[stock_unit]['amount']
+        stock_density = stock_info['Density (g/mL)']
+        solutes = stock_info['solutes']
+        solvent = stock_info['solvents']
+        stock_concentrations = stock_info['concentration']
+        if not isinstance(stock_concentrations, (list, tuple, np.ndarray)):
+            stock_concentrations = [stock_concentrations]*max(len(solutes), 1)
+        assert len(solutes) == 0 or len(stock_concentrations) == len(solutes), stock_name + ' needs one concentration per solute'
+
+        stock_contents = {}
+        solute_mass = 0.0
+        solute_volume = 0.0
+        for solute, stock_concentration in zip(solutes, stock_concentrations):
+            solute_info = component_info_dict.get(solute, {})
+            solute_density = solute_info.get('Density (g/mL)', float('nan'))
+            content = stock_units[stock_unit]['content'](stock_concentration, stock_density, solute_info)
+            stock_contents[solute] = (content, stock_quantity)
+            solute_mass = solute_mass + convert(content, stock_quantity, 'mass', solute_density)
+            solute_volume = solute_volume + convert(content, stock_quantity, 'volume', solute_density)
+
+        if len(solutes) == 0:
+            stock_contents[solvent] = (stock_units[stock_unit]['content'](stock_concentrations[0], stock_density, component_info_dict.get(solvent, {})), stock_quantity)
+        elif not track_solvents:
+            pass
+        elif stock_density is not None and np.isfinite(stock_density):
+            stock_contents[solvent] = (stock_density - solute_mass, 'mass')
+        else:
+            stock_contents[solvent] = (1 - solute_volume, 'volume')
+
+        for component_name, (content, content_quantity) in stock_contents.items():
+            if component_name not in component_index:
+                continue
+            i = component_index[component_name]
+            component_density = component_info_dict.get(component_name, {}).get('Density (g/mL)', float('nan'))
+            composition_matrix[i, stock_index] = convert(content, content_quantity, component_quantities[i], component_density)
+
+    return composition_matrix
+
+
 #### If common solvents are present then use these functions to account for them. Each has its specific use case so understand the information you need
 
 def missing_volume(total_sample_volume, complete_df):
@@ -388,7 +719,7 @@ def complete_missing_volume_with_commmon_solvent(complete_volume, complete_df, s
     or more than two common solvents then it is required to manually enter it as an argument."""
     complete_df = complete_df.copy()
     stock_volumes = isolate_common_column(complete_df, 'stock')
-    stock_names = [identify_component_name(col) for col in stock_volumes if 'stock' in col] # this is seperate from the dict since your dict can have more stocks just need ot have the same name
+    stock_names = [column_schema(stock_volumes).roles[col].component for col in stock_volumes] # this is seperate from the dict since your dict can have more stocks just need ot have the same name
     pure_common_solvent_stocks = [stock_name for stock_name in stock_names if stock_dict[stock_name]['Common Solvent'] == 'Pure']
     mixture_common_solvent_stocks = [stock_name for stock_name in stock_names if stock_dict[stock_name]['Common Solvent'] == 'Mixture']
 
@@ -406,31 +737,32 @@ def complete_missing_volume_with_commmon_solvent(complete_volume, complete_df, s
 
 def calculate_common_solvent_residual_volumes(complete_df, stock_dict):
     """ By looking at common solvent arguments previously established in the stock_dict, will take into account stock volumes which contain a common solvent and if the commmon solvent is 
-    present as a stock it will subtract the volume of common solvent from it leaving you the appropiate common solvent volume. 
+    present as a stock it will subtract the volume of common solvent from it leaving you the appropiate common solvent volume. The solvent a stock carries is its volume minus the volumes 
+    of all its solutes, subtracted for every sample at once. For volumes from solve_stock_volumes() (solvents tracked) common solvents are already accounted for, do not use this.
 
     Need to modify or make own function as if there is common solvents but no common solvent stock that it will make one to complete the volume if needed. 
     """
-    complete_df = complete_df.copy() # why is this necessary
-    stock_volumes = isolate_common_column(complete_df, 'stock')
-    
-    stock_names = [identify_component_name(col) for col in stock_volumes if 'stock' in col] # this is seperate from the dict since your dict can have more stocks than present in the df
-    
-    pure_common_solvent_stocks = [stock_name for stock_name in stock_names if stock_dict[stock_name]['Common Solvent'] == 'Pure']
-    mixture_common_solvent_stocks = [stock_name for stock_name in stock_names if stock_dict[stock_name]['Common Solvent'] == 'Mixture']
+    complete_df = complete_df.copy()
+    stock_volume_columns = {column_schema(complete_df).roles[col].component: col for col in select_columns(complete_df, role='stock', quantity='volume')} # your dict can have more stocks than present in the df
+    stock_names = list(stock_volume_columns)
+
+    pure_common_solvent_stocks = [stock_name for stock_name in stock_names if stock_dict[stock_name].get('Common Solvent') == 'Pure']
+    mixture_common_solvent_stocks = [stock_name for stock_name in stock_names if stock_dict[stock_name].get('Common Solvent') == 'Mixture']
 
     for pure_common_solvent in pure_common_solvent_stocks:
-        for stock_name in mixture_common_solvent_stocks:
-            stock_info = stock_dict[stock_name]
-            solutes = stock_info['solutes']
-            if pure_common_solvent in stock_name:
-                stock_volumes_to_subtract = find_best_df_match(complete_df, stock_name + ' amount volume') 
-                component_volumes = find_best_df_match(complete_df, solutes[0] + ' amount volume') 
-                stock_volumes_to_subtracted_solvent = stock_volumes_to_subtract-component_volumes.values
-                # need to somehow get rid of the mL dependence, the easiest way is to make the stock_info prior hold its volume headers as to call easier
-                common_stock_volume_to_track_name = [pure_common_solvent + ' amount volume mL']
-                common_stock_volume_to_track = complete_df[common_stock_volume_to_track_name] 
-                common_stock_volume_removed_stocks = common_stock_volume_to_track - stock_volumes_to_subtracted_solvent.values
-                complete_df[common_stock_volume_to_track_name] = common_stock_volume_removed_stocks
+        solvent = stock_dict[pure_common_solvent]['solvents']
+        carrying_stocks = [stock_name for stock_name in mixture_common_solvent_stocks if stock_dict[stock_name]['solvents'] == solvent]
+        if len(carrying_stocks) == 0:
+            continue
+        solute_volume_columns = []
+        for stock_name in carrying_stocks:
+            for solute in stock_dict[stock_name]['solutes']:
+                solute_columns = select_columns(complete_df, role='component', quantity='volume', component=solute)
+                assert len(solute_columns) == 1, 'No single amount volume column found for ' + solute + ' to account for the ' + solvent + ' in ' + stock_name
+                solute_volume_columns.append(solute_columns[0])
+        carried_solvent_volumes = complete_df[[stock_volume_columns[stock_name] for stock_name in carrying_stocks]].to_numpy(dtype=float).sum(axis=1) - \
+            complete_df[solute_volume_columns].to_numpy(dtype=float).sum(axis=1)
+        complete_df[stock_volume_columns[pure_common_solvent]] = complete_df[stock_volume_columns[pure_common_solvent]] - carried_solvent_volumes
     
     return complete_df 
 
@@ -439,18 +771,44 @@ def calculate_common_solvent_missing():
    
     pass
 
-def add_final_location(directions, complete_df, unique_identifier= None, date_MM_DD_YY=None):    
+def add_final_location(directions, complete_df, unique_identifier= None, date_MM_DD_YY=None, custom_labware=None):
+    """Inserts the UID, Labware, Slot and Well of each sample's destination at the front of complete_df. directions is either a Prepare.TransferPlan (locations are read from
+    its labware manifest, custom_labware being the custom labware definitions or their folder) or the nested directions dictionary of OT2Commands.create_sample_making_directions."""
     complete_df = complete_df.copy()
+
+    if date_MM_DD_YY is not None:
+        time = date_MM_DD_YY
+    else:
+        time = datetime.datetime.today().strftime('%m-%d-%Y') # str(datetime.datetime.now(timezone('US/Pacific')).date()) # should be embaded once you run
+
+    if hasattr(directions, 'sample_locations'): # TransferPlan, no well objects to parse
+        locations = directions.sample_locations(custom_labware)
+        wells = locations['Well'].tolist()
+        labwares = locations['Labware'].tolist()
+        slots = locations['Slot'].tolist()
+    else:
+        wells, labwares, slots = well_locations_from_directions(directions)
+
+    UIDs = []
+    for slot, labware, well in zip(slots, labwares, wells):
+        UID = "S" + slot + "_" + well + "_" + time  # add name of interest here to make it easier to identify
+        if unique_identifier is not None: 
+            UID = UID + "_" + str(unique_identifier)
+        UIDs.append(UID)
+
+    complete_df.insert(0, 'UID', UIDs)
+    complete_df.insert(1, 'Labware', labwares)
+    complete_df.insert(2, 'Slot', slots)
+    complete_df.insert(3, 'Well', wells)
+    return complete_df
+
+def well_locations_from_directions(directions):
+    """Recovers the well, labware and slot of each sample's destination well from the nested directions dictionary by parsing str(well)."""
     info = []
     for i, sample_info in directions.items():
         for stock, variable in sample_info.items():
             final_well_destination = variable['Destination Well Position']
         info.append(final_well_destination)    
-    
-    if date_MM_DD_YY is not None:
-        time = date_MM_DD_YY
-    else:
-        time = datetime.datetime.today().strftime('%m-%d-%Y') # str(datetime.datetime.now(timezone('US/Pacific')).date()) # should be embaded once you run
 
     wells = []
     labwares = []
@@ -471,19 +829,7 @@ def add_final_location(directions, complete_df, unique_identifier= None, date_MM
         wells.append(well)
         labwares.append(labware)
         slots.append(slot)
-
-    UIDs = []
-    for slot, labware, well in zip(slots, labwares, wells):
-        UID = "S" + slot + "_" + well + "_" + time  # add name of interest here to make it easier to identify
-        if unique_identifier is not None: 
-            UID = UID + "_" + str(unique_identifier)
-        UIDs.append(UID)
-
-    complete_df.insert(0, 'UID', UIDs)
-    complete_df.insert(1, 'Labware', labwares)
-    complete_df.insert(2, 'Slot', slots)
-    complete_df.insert(3, 'Well', wells)
-    return complete_df
+    return wells, labwares, slots
 
 def create_labels_for_plate():
     pass
@@ -493,13 +839,19 @@ def create_labels_for_wells():
 
 #### These are utility function no single use 
 
-def identify_unit(string):
-    """Based on a provided string will identify if a unit within a list verified working units"""
-    supported_units = ['wtf','volf','molf','mgpermL','molarity', 'g', 'mL', 'g/mL', 'g/mol']
-    for unit in supported_units:
+def identify_unit(string, required = True):
+    """Based on a provided string will identify if a unit within a list verified working units (see the unit registry). The last word of the string is checked first 
+    as columns are named with the unit last, otherwise the first registered unit found within the string is used. If required is False returns None instead of raising."""
+    units = supported_units()
+    last_word = string.rsplit(' ', 1)[-1]
+    if last_word in units:
+        return last_word
+    for unit in units:
         if unit in string:            
             return unit
-    raise AssertionError('Unit in ' + string + ' not currently supported, the following units are supported: ', supported_units)
+    if not required:
+        return None
+    raise AssertionError('Unit in ' + string + ' not currently supported, the following units are supported: ', units)
 
 def identify_component_name(string):
     """Will pull the first word from the string and return it to be used as the name to look up in a chemical database.
@@ -508,6 +860,70 @@ def identify_component_name(string):
     component = string.split(' ', 1)[0]
     return component
 
+##### Column roles: column names are in the form 'name concentration unit', 'name amount mass unit' or 'solute-solvent-stock amount volume unit'. Rather than searching names for #####
+##### substrings on every call, the component, role (component, stock or other), quantity and unit of each column is parsed once and kept with the dataframe (see column_schema()). #####
+
+ColumnRole = namedtuple('ColumnRole', ['component', 'role', 'quantity', 'unit'])
+
+def parse_column_role(column_name):
+    """Parses a column name into its ColumnRole. Role is 'stock' if the name refers to a stock, 'component' if it holds a component concentration or amount and 'other' otherwise. 
+    Quantity is one of concentration, mass or volume found in the name (case sensitive, so 'Total Volume mL' has none), None if unknown. The unit is the last word of the name 
+    when it is a registered unit, None otherwise."""
+    column_name = str(column_name)
+    component = identify_component_name(column_name)
+    last_word = column_name.rsplit(' ', 1)[-1]
+    unit = last_word if last_word in supported_units() else None
+
+    if 'concentration' in column_name:
+        quantity = 'concentration'
+    elif 'mass' in column_name:
+        quantity = 'mass'
+    elif 'volume' in column_name:
+        quantity = 'volume'
+    else:
+        quantity = None
+
+    if 'stock' in column_name:
+        role = 'stock'
+    elif quantity is not None and unit is not None:
+        role = 'component'
+    else:
+        role = 'other'
+    return ColumnRole(component=component, role=role, quantity=quantity, unit=unit)
+
+class ColumnSchema:
+    """Holds the ColumnRole of every column of a dataframe and answers column lookups from a cache. It is attached to the dataframe through df.attrs by column_schema() 
+    and remembers the columns Index it was built from, any change to the columns (adding, dropping or renaming) gives a new Index and hence a new schema."""
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.roles = {column_name: parse_column_role(column_name) for column_name in columns}
+        self.lookups = {}
+
+    def select(self, role=None, quantity=None, component=None, unit=None):
+        """Returns the list of column names matching every given field of the ColumnRole, in column order."""
+        key = (role, quantity, component, unit)
+        if key not in self.lookups:
+            self.lookups[key] = [column_name for column_name, column_role in self.roles.items()
+                                 if (role is None or column_role.role == role) and (quantity is None or column_role.quantity == quantity)
+                                 and (component is None or column_role.component == component) and (unit is None or column_role.unit == unit)]
+        return self.lookups[key]
+
+    def __deepcopy__(self, memo): # pandas copies attrs along with the frame, the schema never changes so share it
+        return self
+
+def column_schema(df):
+    """Returns the ColumnSchema of a dataframe, only parsing the column names if the columns changed since the schema was last made."""
+    schema = df.attrs.get('Column Schema')
+    if not isinstance(schema, ColumnSchema) or schema.columns is not df.columns:
+        schema = ColumnSchema(df.columns)
+        df.attrs['Column Schema'] = schema
+    return schema
+
+def select_columns(df, role=None, quantity=None, component=None, unit=None):
+    """Returns the names of the columns of df with the given role ('component', 'stock', 'other'), quantity ('concentration', 'mass', 'volume'), component name and/or unit."""
+    return column_schema(df).select(role=role, quantity=quantity, component=component, unit=unit)
+
 def same_len(iterable_2d):
     """Checks if all nested iterables are the same length."""
     it = iter(iterable_2d)
@@ -522,19 +938,27 @@ def replace_nan_amounts(amounts_df, value):
     amounts_df_zeroed = amounts_df.fillna(value)
     return amounts_df_zeroed
 
+# common strings which are looked up through the column schema rather than a substring search
+common_string_roles = {'stock': {'role': 'stock'},
+                       'concentration': {'quantity': 'concentration'},
+                       'mass': {'quantity': 'mass'},
+                       'volume': {'quantity': 'volume'}}
+
 def isolate_common_column(df, common_string):
     """Returns dataframe with only the columns which contain the common string provided. 
-    This is useful when calling for only a certain group of common information such as stocks or component masses"""
-    cols = df.columns
-    common_string_cols = [col for col in cols if common_string in col]
-    final_df = df.copy()[common_string_cols]
+    This is useful when calling for only a certain group of common information such as stocks or component masses. 
+    The strings stock, concentration, mass and volume are answered from the column schema (see select_columns()), anything else by searching the names."""
+    if common_string in common_string_roles:
+        common_string_cols = select_columns(df, **common_string_roles[common_string])
+    else:
+        common_string_cols = [col for col in df.columns if common_string in col]
+    final_df = df[common_string_cols]
     return final_df
 
 def find_best_df_match(df, string):
     """Returns the dataframe with only the columns which contain the string provided. 
     It is identical to isolate_common_column(), so need to consolidate and phase one out."""
-    match = df[[col for col in df if string in col]]
-    return match
+    return isolate_common_column(df, string)
 
 def stock_dict_from_plan(plan):
     stock_names = plan['Stock Names']
@@ -546,8 +970,7 @@ def stock_dict_from_plan(plan):
     return stock_dict
 
 def find_component_column(component_name, df):
-    df_columns = df.columns
-    df_col_match = [col for col in df_columns if component_name == identify_component_name(col)]
+    df_col_match = select_columns(df, component=component_name)
     # add assertion if fail 
     return df_col_match
 
@@ -556,59 +979,156 @@ def calculate_total_stock_volumes(complete_df):
     complete_df['Total Volume mL'] = stock_volumes.sum(axis=1)
     return complete_df
 
-def convert_mL_to_uL(volumes_df): # switch this to be the dictionary using https://stackoverflow.com/questions/45468630/change-column-names-in-pandas-dataframe-from-a-list
-    volumes_df = volumes_df.copy()
-    columns_mL = [col for col in volumes_df if 'mL' in col]
-    columns_uL = [col_mL.replace('mL', 'uL') for col_mL in columns_mL]
+def convert_mL_to_uL(volumes_df):
+    """Converts every column with a unit of mL (not other units containing mL such as mgpermL) to uL, renaming the unit at the end of the column name."""
+    columns_mL = select_columns(volumes_df, unit='mL')
+    replace_dict = {col_mL: col_mL[:col_mL.rindex('mL')] + 'uL' + col_mL[col_mL.rindex('mL') + 2:] for col_mL in columns_mL}
     volumes_uL = volumes_df[columns_mL]*1000
-
-    volumes_df[columns_mL] = volumes_uL
-    replace_dict = {mL:uL for uL, mL in zip(columns_uL, columns_mL)}
-    volumes_df_uL = volumes_df.rename(columns=replace_dict)
-
-    volumes_df_uL
+    volumes_df_uL = volumes_df.assign(**{col_mL: volumes_uL[col_mL] for col_mL in columns_mL}).rename(columns=replace_dict)
 
     return volumes_df_uL
 
-def remove_duplicates(df, sigfigs):
+def remove_duplicates(df, sigfigs, tolerance = None, columns = None):
+    """Removes duplicate samples after rounding every column to sigfigs decimals. If a tolerance is given instead only the composition columns are compared 
+    (see deduplicate_compositions()) and the values are kept unrounded."""
+    if tolerance is not None:
+        df = deduplicate_compositions(df, tolerance, columns=columns)
+        return df.reset_index(drop=True)
     df = df.round(sigfigs)
     df.drop_duplicates(inplace=True)
     df.reset_index(inplace=True, drop=True)
     return df
 
-def filter_total_volume_restriction(df, max_total_volume):
-    column_names = df.columns
-    stock_column_names = [column_name for column_name in column_names if "stock" in column_name]
+def deduplicate_compositions(df, tolerance = 1e-9, columns = None, return_groups = False):
+    """Removes samples whose compositions fall on the same point of a grid of spacing tolerance, keeping the first sample of each group with its original (unrounded) values and index. 
+    Only the composition columns are compared, by default the concentration columns (see select_columns()), tolerance is in the native unit of each column and can be a single value 
+    or a dictionary of column name : tolerance. Each value is rounded to the nearest multiple of the tolerance (see quantize_compositions()), so values less than a tolerance apart 
+    are merged only when they round to the same multiple: 0.1499 and 0.1501 with a tolerance of 0.1 are kept apart while 0.151 and 0.249 are merged. The quantized compositions 
+    are packed into a single integer key so grouping is one hash/sort pass. If return_groups is True also returns a dictionary of kept index : list of every index collapsed into it 
+    (only groups of more than one sample)."""
+    if columns is None:
+        columns = select_columns(df, quantity='concentration')
+    assert len(columns) > 0, 'No composition columns found to compare, provide the columns argument'
+    if isinstance(tolerance, dict):
+        tolerances = np.asarray([tolerance[column] for column in columns], dtype=float)
+    else:
+        tolerances = np.full(len(columns), float(tolerance))
+
+    quantized = quantize_compositions(df[columns].to_numpy(dtype=float), tolerances)
+    radices = quantized.max(axis=0, initial=0) + 1
+
+    if np.sum(np.log2(radices.astype(float))) < 62: # packed key fits in an int64
+        multipliers = np.cumprod(np.concatenate([[1], radices[:0:-1]]))[::-1].astype(np.int64)
+        keys = quantized @ multipliers
+        unique_keys, first_index, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    else:
+        unique_keys, first_index, inverse = np.unique(quantized, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+
+    kept_positions = np.sort(first_index)
+    deduplicated_df = df.iloc[kept_positions]
+    if not return_groups:
+        return deduplicated_df
+
+    group_sizes = np.bincount(inverse)
+    grouped_positions = np.split(np.argsort(inverse, kind='stable'), np.cumsum(group_sizes)[:-1])
+    groups = {df.index[positions[0]]: list(df.index[positions]) for positions in grouped_positions if len(positions) > 1}
+    return deduplicated_df, groups
+
+def quantize_compositions(values, tolerances):
+    """Rounds each value to the nearest multiple of the tolerance of its column and returns the multiples counted from the smallest one in the column (starting at 1), 
+    nan values are 0. Counting from the column minimum keeps the codes, and hence the packed keys of deduplicate_compositions(), as small as the spread of the values allows."""
+    is_nan = np.isnan(values)
+    quantized = np.floor(np.where(is_nan, 0, values)/tolerances + 0.5).astype(np.int64)
+    no_value = np.iinfo(np.int64).max
+    column_minimums = np.where(is_nan, no_value, quantized).min(axis=0, initial=no_value)
+    column_minimums[column_minimums == no_value] = 0 # columns of only nan
+    quantized = quantized - column_minimums + 1
+    quantized[is_nan] = 0
+    return quantized
+
+def filter_total_volume_restriction(df, max_total_volume, allow_empty = False):
+    stock_column_names = select_columns(df, role='stock')
     stocks = df[stock_column_names]
     df['Total Volume'] = stocks.sum(axis=1)
     df = df[df['Total Volume']  <= max_total_volume]
-    if df.empty is True:
+    if df.empty is True and not allow_empty:
         raise AssertionError("No suitable samples available to create due to TOTAL SAMPLE VOLUME being too high, reconsider labware or total sample mass/volume")
     return df
  
-def filter_general_max_restriction(df, max_value, column_name):
-    df_unfiltered = df.copy()
+def filter_general_max_restriction(df, max_value, column_name, allow_empty = False):
     df = df[df[column_name] <= max_value]
-    if df.empty is True:
+    if df.empty is True and not allow_empty:
         raise AssertionError("No suitable samples available to create due to general filter being to low")
     return df
 
-def filter_general_min_pipette_restriction(df, min_pipette_volume):
-    column_names = df.columns
-    stock_column_names = [column_name for column_name in column_names if "stock" in column_name]
-    df_unfiltered = df.copy()
+def filter_general_min_pipette_restriction(df, min_pipette_volume, allow_empty = False):
+    stock_column_names = select_columns(df, role='stock')
+    stock_volumes = df[stock_column_names].to_numpy(dtype=float)
+    keep = np.ones(len(df), dtype=bool)
     
     for i, stock_column in enumerate(stock_column_names):
-        df = df[df[stock_column] >= 0] # filtering all samples less than 0 
-        if df.empty is True:
-                raise AssertionError(stock_column + ' volumes contains only negative volumes. df series printed below', df_unfiltered[stock_column])
-
-        df = df[(df[stock_column] >= min_pipette_volume) | (df[stock_column] == 0)] # filtering all samples that are less than miniumum pipette value and are NOT zero
-        if df.empty is True:
-            raise AssertionError(stock_column + ' volumes are below the pipette minimum of' + str(min_pipette_volume) + 'df series printed below', df_unfiltered[stock_column])
-
-     
-    return df 
+        keep = keep & (stock_volumes[:, i] >= 0) # filtering all samples less than 0 
+        if not keep.any() and not allow_empty:
+                raise AssertionError(stock_column + ' volumes contains only negative volumes. df series printed below', df[stock_column])
+
+        keep = keep & ((stock_volumes[:, i] >= min_pipette_volume) | (stock_volumes[:, i] == 0)) # filtering all samples that are less than miniumum pipette value and are NOT zero
+        if not keep.any() and not allow_empty:
+            raise AssertionError(stock_column + ' volumes are below the pipette minimum of' + str(min_pipette_volume) + 'df series printed below', df[stock_column])
+
+    return df[keep]
+
+#### Fused filtering: each constraint is a (name, function) pair where the function is given the dataframe and the array of stock volumes (samples x stocks) and returns a boolean 
+#### array of the samples which pass. filter_candidates() evaluates every constraint in one pass and keeps count of why samples were removed (the "catchers").
+
+def total_volume_constraint(max_total_volume):
+    """Constraint equivalent to filter_total_volume_restriction(), the sum of stock volumes must be <= max_total_volume."""
+    return ('total volume', lambda df, stock_volumes: stock_volumes.sum(axis=1) <= max_total_volume)
+
+def column_max_constraint(column_name, max_value):
+    """Constraint equivalent to filter_general_max_restriction(), the column must be <= max_value."""
+    return (column_name + ' max', lambda df, stock_volumes: df[column_name].to_numpy() <= max_value)
+
+def negative_volume_constraint():
+    """Constraint removing samples which need a negative volume of any stock."""
+    return ('negative stock volume', lambda df, stock_volumes: (stock_volumes >= 0).all(axis=1))
+
+def min_pipette_constraint(min_pipette_volume):
+    """Constraint equivalent to the minimum check of filter_general_min_pipette_restriction(), every stock volume must be zero or >= min_pipette_volume. 
+    Use alongside negative_volume_constraint() to also remove negative volumes."""
+    return ('below pipette minimum', lambda df, stock_volumes: ((stock_volumes >= min_pipette_volume) | (stock_volumes == 0) | (stock_volumes < 0)).all(axis=1))
+
+def unity_constraint(completing_column_name):
+    """Constraint equivalent to unity_filter_df() once the completing column exists, the completing component must be > 0."""
+    return ('unity', lambda df, stock_volumes: df[completing_column_name].to_numpy() > 0)
+
+def filter_candidates(df, constraints, allow_empty = False, return_rejected = False, rejection_column = 'Rejection Bitmask'):
+    """Applies all constraints (see total_volume_constraint() and the others above) to the samples in a single vectorized pass. Stock volume columns are found once and 
+    no intermediate dataframes are made. Returns the samples passing every constraint and a dictionary of how many samples failed each constraint (a sample failing several is 
+    counted under each). If return_rejected is True all samples are returned instead with a rejection column holding a bitmask, bit i set meaning constraint i was failed (0 = kept)."""
+    stock_column_names = select_columns(df, role='stock')
+    stock_volumes = df[stock_column_names].to_numpy(dtype=float)
+
+    rejection_bitmask = np.zeros(len(df), dtype=np.int64)
+    rejection_counts = {}
+    for bit, (constraint_name, constraint) in enumerate(constraints):
+        passed = np.asarray(constraint(df, stock_volumes), dtype=bool)
+        rejection_bitmask |= (~passed).astype(np.int64) << bit
+        rejection_counts[constraint_name] = int((~passed).sum())
+
+    keep = rejection_bitmask == 0
+    if not keep.any() and not allow_empty:
+        raise AssertionError('No suitable samples available to create, samples removed by each constraint: ' + str(rejection_counts))
+
+    if return_rejected:
+        df = df.copy()
+        df[rejection_column] = rejection_bitmask
+        return df, rejection_counts
+    return df[keep], rejection_counts
+
+def rejection_reasons(rejection_bitmask, constraints):
+    """Translates a rejection bitmask (from filter_candidates()) into the list of constraint names failed."""
+    return [constraint_name for bit, (constraint_name, constraint) in enumerate(constraints) if int(rejection_bitmask) >> bit & 1]
 
 ##################### In progress ##############################
 
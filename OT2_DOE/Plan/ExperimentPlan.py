@@ -0,0 +1,95 @@
+from collections import namedtuple
+
+from Plan.CreateSamples import get_experiment_plan, stock_dictionary
+
+##### Typed view of an experiment plan. The plan csv and chemical database are parsed once (and again only when the files change, see CreateSamples.cached_file_parse()). #####
+##### ExperimentPlan is still a dictionary of the plan entries so it can be passed to any function expecting the output of get_experiment_plan(). #####
+
+Component = namedtuple('Component', ['name', 'index', 'unit', 'linspace', 'molecular_weight', 'density', 'info'])
+Labware = namedtuple('Labware', ['name', 'slot', 'role', 'index', 'offset'])
+
+# role : (labware names key, labware slots key, labware offset key) as found in the plan csv
+labware_plan_keys = {'Destination': ('OT2 Destination Labwares', 'OT2 Destination Labware Slots', 'OT2 Destination Labware Offset'),
+                     'Stock': ('OT2 Stock Labwares', 'OT2 Stock Labware Slots', 'OT2 Stock Labware Offset'),
+                     'Left Tiprack': ('OT2 Left Tipracks', 'OT2 Left Tiprack Slots', 'OT2 Left Tiprack Offset'),
+                     'Right Tiprack': ('OT2 Right Tipracks', 'OT2 Right Tiprack Slots', 'OT2 Right Tiprack Offset'),
+                     'Cleaning': ('OT2 Cleaning Labwares', 'OT2 Cleaning Labware Slots', None),
+                     'Final Transfer': ('OT2 Single Transfer From Dest Labwares', 'OT2 Single Transfer From Dest Slots', None)}
+
+stock_density_plan_keys = ['Stock Density (g/mL) (only for wtf)', 'Stock Densities (g/mL)']
+
+
+def load_experiment_plan(filepath, chemical_database_path):
+    """Loads the plan csv and chemical database into an ExperimentPlan, both files are only parsed again if their contents changed since the last load."""
+    return ExperimentPlan(get_experiment_plan(filepath, chemical_database_path))
+
+
+class ExperimentPlan(dict):
+    """Dictionary of plan entries with the components, stocks and labware indexed once into attributes:
+    - components: component name : Component (name, index, unit, linspace, molecular weight, density and chemical database entry), in plan order
+    - stocks: stock name : stock information as made by CreateSamples.stock_dictionary(), in plan order
+    - labware: role (Destination, Stock, Left/Right Tiprack, Cleaning, Final Transfer) : list of Labware (name, slot, role, index, offset)
+    - slots: deck slot : Labware loaded on it
+    """
+
+    def __init__(self, plan_dict):
+        super().__init__(plan_dict)
+        self.components = self._index_components()
+        self.stocks = self._index_stocks()
+        self.labware = self._index_labware()
+        self.slots = {labware.slot: labware for labware_list in self.labware.values() for labware in labware_list}
+
+    def _index_components(self):
+        chemical_database = self.get('Chemical Database', {})
+        component_names = self.get('Component Shorthand Names', [])
+        component_units = self.get('Component Concentration Units', [])
+        component_linspaces = self.get('Component Concentration Linspaces [min, max, n]', [])
+
+        components = {}
+        for i, component_name in enumerate(component_names):
+            component_info = chemical_database.get(component_name, {})
+            components[component_name] = Component(name=component_name,
+                                                    index=i,
+                                                    unit=component_units[i] if i < len(component_units) else None,
+                                                    linspace=component_linspaces[i] if i < len(component_linspaces) else None, # completing component has none
+                                                    molecular_weight=component_info.get('Molecular Weight (g/mol)'),
+                                                    density=component_info.get('Density (g/mL)'),
+                                                    info=component_info)
+        return components
+
+    def _index_stocks(self):
+        if 'Stock Names' not in self:
+            return {}
+        stock_densities = next((self[key] for key in stock_density_plan_keys if key in self), None)
+        return stock_dictionary(self['Stock Names'], self['Stock Concentration Units'],
+                                self['Stock Concentrations'], stock_densities)
+
+    def _index_labware(self):
+        labware = {}
+        for role, (names_key, slots_key, offset_key) in labware_plan_keys.items():
+            if names_key not in self or slots_key not in self:
+                continue
+            offsets = self.get(offset_key) or [None]*len(self[names_key])
+            labware[role] = [Labware(name=name, slot=str(slot), role=role, index=i, offset=offset)
+                             for i, (name, slot, offset) in enumerate(zip(self[names_key], self[slots_key], offsets))]
+        return labware
+
+    def component(self, name):
+        """Returns the Component of the given name."""
+        assert name in self.components, name + ' is not a component of the plan'
+        return self.components[name]
+
+    def stock(self, name):
+        """Returns the stock information of the given stock name."""
+        assert name in self.stocks, name + ' is not a stock of the plan'
+        return self.stocks[name]
+
+    def chemical(self, name):
+        """Returns the chemical database entry of the given component abbreviation."""
+        assert name in self['Chemical Database'], name + ' is not in the chemical database'
+        return self['Chemical Database'][name]
+
+    def labware_at(self, slot):
+        """Returns the Labware loaded on a deck slot."""
+        assert str(slot) in self.slots, 'No labware is planned for slot ' + str(slot)
+        return self.slots[str(slot)]
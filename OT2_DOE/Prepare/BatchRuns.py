@@ -0,0 +1,260 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from Plan.CreateSamples import isolate_common_column
+from Prepare.DeckPath import schedule_rows
+from Prepare.DryRun import pipette_settings
+from Prepare.LabwareRegistry import well_capacity
+from Prepare.TransferPlan import TransferPlan, labware_manifest
+from Prepare.TransferTables import NotEnoughStockWells
+
+# Splits designs that do not fit on a single deck into a sequence of robot
+# runs. Every run fits the destination wells, tips and stock wells of the plan
+# labware and the samples are spread so each run draws about the same volume
+# of every stock. Each run comes with its TransferPlan and the stock volumes
+# to prepare (refill) before starting it.
+
+
+def tip_usage(transfer_plan, small_pipette_volumes, large_pipette_volumes,
+              new_tip='never'):
+    """
+    Tips used by each pipette to execute a transfer plan.
+
+    Parameters
+    -----------
+
+    transfer_plan: TransferPlan
+    small_pipette_volumes: tuple
+        (min volume, max volume) of the small pipette
+    large_pipette_volumes: tuple
+        (min volume, max volume) of the large pipette
+    new_tip: 'never' or 'always'
+        'never' one tip per stock and pipette (component wise execution),
+        'always' one tip per transfer.
+
+    Returns
+    --------
+
+    tips: dict
+        {'Small': tips, 'Large': tips}
+    """
+    schedule = schedule_rows(transfer_plan, small_pipette_volumes,
+                             large_pipette_volumes, batch=False)
+    if new_tip == 'always':
+        pipettes = schedule['Pipette']
+    elif new_tip == 'never':
+        pipettes = schedule.drop_duplicates(['Pipette', 'Tip'])['Pipette']
+    else:
+        raise AssertionError("new_tip must be either 'never' or 'always'")
+    return {'Small': int((pipettes == 'Small').sum()),
+            'Large': int((pipettes == 'Large').sum())}
+
+
+def run_stock_volumes(transfer_plan, volume_buffer_pct=10,
+                      custom_labware=None):
+    """
+    Stock volumes to load in each stock well before a run: the volume pulled
+    from the well plus the buffer left in it.
+
+    Returns
+    --------
+
+    refill_df: pd.DataFrame
+        One row per stock well used with 'Stock', 'Labware', 'Slot', 'Well
+        Index' (within the labware), 'Volume (uL)' and 'Preparation Volume
+        (uL)'.
+    """
+    transfers = transfer_plan.transfers
+    refill_df = transfers.groupby(['Stock', 'Source Labware', 'Source Well'],
+                                  sort=False)['Volume (uL)'].sum().reset_index()
+    manifest = transfer_plan.manifest
+    capacities = np.array([float(well_capacity(name, custom_labware))
+                           for name in manifest['Labware'].values[
+                               refill_df['Source Labware'].values]])
+    return pd.DataFrame({
+        'Stock': np.asarray(transfer_plan.stock_names, dtype=object)[
+            refill_df['Stock'].values],
+        'Labware': manifest['Labware'].values[
+            refill_df['Source Labware'].values],
+        'Slot': manifest['Slot'].values[refill_df['Source Labware'].values],
+        'Well Index': refill_df['Source Well'].values,
+        'Volume (uL)': refill_df['Volume (uL)'].values,
+        'Preparation Volume (uL)': refill_df['Volume (uL)'].values +
+        capacities*volume_buffer_pct/100})
+
+
+def balanced_run_assignment(volumes, n_runs, samples_per_run):
+    """
+    Assigns samples to runs so every run draws about the same share of each
+    stock. Samples are placed by decreasing volume into the run with the
+    lowest resulting stock load (relative to the stock total) that still has
+    free destination wells.
+
+    Parameters
+    -----------
+
+    volumes: np.ndarray
+        Array (n samples, n stocks) of stock volumes
+    n_runs: int
+        Number of runs
+    samples_per_run: int
+        Destination wells of a run
+
+    Returns
+    --------
+
+    runs: np.ndarray
+        Run of each sample
+    """
+    volumes = np.asarray(volumes, dtype=float)
+    stock_totals = volumes.sum(axis=0)
+    stock_totals[stock_totals == 0] = 1
+    shares = volumes/stock_totals
+    order = np.argsort(-shares.sum(axis=1), kind='stable')
+
+    loads = np.zeros((n_runs, volumes.shape[1]))
+    counts = np.zeros(n_runs, dtype=int)
+    runs = np.empty(len(volumes), dtype=int)
+    for sample in order:
+        new_loads = (loads + shares[sample]).max(axis=1)
+        new_loads[counts >= samples_per_run] = np.inf
+        # ties go to the run with the fewest samples
+        run = int(np.lexsort((counts, new_loads))[0])
+        loads[run] += shares[sample]
+        counts[run] += 1
+        runs[sample] = run
+    return runs
+
+
+def split_into_runs(volume_df, experiment_dict, custom_labware=None,
+                    new_tip='never', well_order='row', volume_buffer_pct=10,
+                    stock_allocation='bin packing', stock_order=None,
+                    pipette_volumes=None, max_runs=100):
+    """
+    Splits the samples of a volume dataframe into the fewest robot runs that
+    fit the labware of the plan, balancing the stock draw across runs.
+
+    Parameters
+    -----------
+
+    volume_df: pd.DataFrame
+        Dataframe containing the stock volumes (uL) of each sample, stock
+        columns are identified by the term stock in their name.
+    experiment_dict: dict
+        Dictionary containig all the experimental parameters
+    custom_labware: dict or str
+        Dictionary of custom labware definitions or path to their folder.
+    new_tip: 'never' or 'always'
+        Tip use of the execution, see tip_usage.
+    well_order: 'row' or 'column'
+        String indicating the order in which the wells will be accessed by
+        the robot
+    volume_buffer_pct: int
+        Percentage of the stock well volume kept as buffer.
+    stock_allocation: 'ranges' or 'bin packing'
+        See TransferPlan.from_volumes
+    stock_order: list
+        Position of each stock when allocating the stock wells, flat or
+        nested per stock labware as 'OT2 Stock Labware Stock Order', see
+        TransferPlan.from_volumes
+    pipette_volumes: dict
+        (min volume, max volume) by pipette model, see DryRun.pipette_settings
+    max_runs: int
+        Number of runs after which the split is abandoned.
+
+    Returns
+    --------
+
+    runs: list
+        One dictionary per run with 'Samples' (index labels of volume_df),
+        'Volumes' (volume_df of the run), 'Transfer Plan', 'Tips' (see
+        tip_usage) and 'Stock Volumes' (see run_stock_volumes).
+    """
+    volume_df = pd.DataFrame(volume_df)
+    stock_df = isolate_common_column(volume_df, 'stock')
+    volumes = stock_df.values.astype(float)
+    n_samples = len(volume_df)
+
+    manifest = labware_manifest(experiment_dict, custom_labware)
+    pipettes = pipette_settings(experiment_dict, pipette_volumes)
+    pipette_ranges = {name: (pipette['Min Volume'], pipette['Max Volume'])
+                      for name, pipette in pipettes.items()}
+    tip_budget = {name: int(manifest.loc[manifest['Role'] == pipette['Mount'] +
+                                         ' Tiprack', 'Wells'].sum())
+                  for name, pipette in pipettes.items()}
+    destination_wells = int(manifest.loc[manifest['Role'] == 'Destination',
+                                         'Wells'].sum())
+    assert destination_wells > 0, 'The plan has no destination labware'
+
+    n_runs = max(1, int(np.ceil(n_samples/destination_wells)))
+    while n_runs <= max_runs:
+        sample_runs = balanced_run_assignment(volumes, n_runs,
+                                              destination_wells)
+        runs = []
+        for run in range(n_runs):
+            run_rows = np.flatnonzero(sample_runs == run)
+            run_volume_df = volume_df.iloc[run_rows]
+            try:
+                transfer_plan = TransferPlan.from_volumes(
+                    run_volume_df, experiment_dict, custom_labware,
+                    well_order=well_order,
+                    volume_buffer_pct=volume_buffer_pct,
+                    stock_allocation=stock_allocation,
+                    stock_order=stock_order)
+            except NotEnoughStockWells:
+                break
+            tips = tip_usage(transfer_plan, pipette_ranges['Small'],
+                             pipette_ranges['Large'], new_tip=new_tip)
+            if tips['Small'] > tip_budget['Small'] or \
+                    tips['Large'] > tip_budget['Large']:
+                break
+            runs.append({'Samples': volume_df.index[run_rows],
+                         'Volumes': run_volume_df,
+                         'Transfer Plan': transfer_plan,
+                         'Tips': tips,
+                         'Stock Volumes': run_stock_volumes(
+                             transfer_plan, volume_buffer_pct,
+                             custom_labware)})
+        if len(runs) == n_runs:
+            return runs
+        n_runs += 1
+
+    raise AssertionError('The samples do not fit in ' + str(max_runs) +
+                         ' runs, a single sample may exceed the labware')
+
+
+def runs_summary(runs):
+    """
+    One row per run with the number of samples, tips per pipette and the
+    volume (uL) drawn from each stock (one column per stock name).
+    """
+    rows = []
+    for run in runs:
+        row = {'Samples': len(run['Samples']),
+               'Small Tips': run['Tips']['Small'],
+               'Large Tips': run['Tips']['Large']}
+        stock_draw = run['Stock Volumes'].groupby(
+            'Stock', sort=False)['Volume (uL)'].sum()
+        for stock_name, volume in stock_draw.items():
+            row[stock_name] = volume
+        rows.append(row)
+    summary_df = pd.DataFrame(rows)
+    summary_df.index.name = 'Run'
+    return summary_df
+
+
+def save_runs(runs, folder_path, file_format='csv'):
+    """
+    Saves the transfer plan (see TransferPlan.save), sample index labels and
+    stock volumes of every run in folder_path as run_<n>.
+    """
+    os.makedirs(folder_path, exist_ok=True)
+    for i, run in enumerate(runs):
+        run_path = os.path.join(folder_path, 'run_' + str(i))
+        run['Transfer Plan'].save(run_path + '.' + file_format)
+        pd.Series(run['Samples'], name='Sample').to_csv(
+            run_path + '_samples.csv', index=False)
+        run['Stock Volumes'].to_csv(run_path + '_stock_volumes.csv',
+                                    index=False)
@@ -0,0 +1,301 @@
+import numpy as np
+import pandas as pd
+
+from Prepare.LabwareRegistry import labware_info
+from Prepare.TransferTables import pipette_assignment, \
+    schedule_component_wise_transfers
+from Prepare.TransferPlan import TransferPlan
+
+# Orders the transfers of a TransferPlan to shorten the travel of the gantry.
+# Positions are the well top centers on the deck: slot origin plus the well
+# position of the labware definition (from the labware registry). Only the
+# order of transfers sharing a tip (same stock, stock well and pipette, as
+# grouped by TransferTables.schedule_component_wise_transfers) is changed, so
+# the number of tips and the contamination behaviour are unchanged.
+
+# x, y (mm) of the front left corner of each OT-2 deck slot
+deck_slot_origins = {'1': (0.0, 0.0), '2': (132.5, 0.0), '3': (265.0, 0.0),
+                     '4': (0.0, 90.5), '5': (132.5, 90.5),
+                     '6': (265.0, 90.5), '7': (0.0, 181.0),
+                     '8': (132.5, 181.0), '9': (265.0, 181.0),
+                     '10': (0.0, 271.5), '11': (132.5, 271.5),
+                     '12': (265.0, 271.5)}
+
+default_gantry_speed = 400  # mm/sec, OT-2 default x/y speed
+
+
+def well_coordinates(transfer_plan, labware, well, custom_labware=None):
+    """
+    Deck x, y coordinates (mm) of (manifest row, well within labware) pairs
+    of a transfer plan.
+
+    Parameters
+    -----------
+
+    transfer_plan: TransferPlan
+    labware: np.ndarray
+        Manifest rows of the labware
+    well: np.ndarray
+        Well indices within the labware (in the plan well order)
+    custom_labware: dict or str
+        Dictionary of custom labware definitions or path to their folder.
+
+    Returns
+    --------
+
+    coordinates: np.ndarray
+        Array of shape (n, 2)
+    """
+    labware = np.asarray(labware, dtype=int)
+    well = np.asarray(well, dtype=int)
+    coordinates = np.empty((len(well), 2))
+    for labware_row in np.unique(labware):
+        manifest_entry = transfer_plan.manifest.loc[labware_row]
+        slot = str(manifest_entry['Slot'])
+        assert slot in deck_slot_origins, 'Unknown deck slot ' + slot
+        info = labware_info(manifest_entry['Labware'], custom_labware)
+        if transfer_plan.well_order == 'row':
+            ordered_wells = info.wells_row_order
+        else:
+            ordered_wells = info.wells_column_order
+        labware_coordinates = np.array(
+            [info.well_positions[well_name][:2]
+             for well_name in ordered_wells]) + deck_slot_origins[slot]
+        mask = labware == labware_row
+        coordinates[mask] = labware_coordinates[well[mask]]
+    return coordinates
+
+
+def path_length(points):
+    """Length (mm) of the path visiting the points in order."""
+    points = np.asarray(points, dtype=float)
+    if len(points) < 2:
+        return 0.0
+    return float(np.linalg.norm(np.diff(points, axis=0), axis=1).sum())
+
+
+def schedule_rows(transfer_plan, small_pipette_volumes,
+                  large_pipette_volumes, batch=True, disposal_volume=None):
+    """
+    TransferTables.schedule_component_wise_transfers of a transfer plan without
+    well objects: 'Stock Position' and 'Destination Wells' hold row numbers
+    of transfer_plan.transfers.
+    """
+    transfers = transfer_plan.transfers
+    # the schedule only needs comparable positions, row numbers stand in for
+    # the well objects
+    rows = np.arange(len(transfers))
+    directions_df = pd.DataFrame({
+        'Stock Name': np.asarray(transfer_plan.stock_names, dtype=object)[
+            transfers['Stock'].values],
+        'Stock Well Index': transfer_plan.labware_well_indices(
+            transfers['Source Labware'].values,
+            transfers['Source Well'].values, 'Stock'),
+        'Stock Position': rows,
+        'Destination Well Position': rows,
+        'Stock Volume': transfers['Volume (uL)'].values})
+    return schedule_component_wise_transfers(
+        directions_df, small_pipette_volumes, large_pipette_volumes,
+        batch=batch, disposal_volume=disposal_volume,
+        stock_order=transfer_plan.stock_names)
+
+
+def transfer_path(transfer_plan, small_pipette_volumes,
+                  large_pipette_volumes, custom_labware=None, batch=True,
+                  disposal_volume=None):
+    """
+    Points visited when the plan is executed component wise: for every
+    scheduled operation the stock well followed by the destination wells it
+    dispenses into.
+
+    Parameters
+    -----------
+
+    transfer_plan: TransferPlan
+    small_pipette_volumes: tuple
+        (min volume, max volume) of the small pipette
+    large_pipette_volumes: tuple
+        (min volume, max volume) of the large pipette
+    custom_labware: dict or str
+        Dictionary of custom labware definitions or path to their folder.
+    batch, disposal_volume:
+        See TransferTables.schedule_component_wise_transfers
+
+    Returns
+    --------
+
+    points: np.ndarray
+        Array of shape (n, 2) of the visited coordinates.
+    """
+    transfers = transfer_plan.transfers
+    source_coordinates = well_coordinates(
+        transfer_plan, transfers['Source Labware'].values,
+        transfers['Source Well'].values, custom_labware)
+    destination_coordinates = well_coordinates(
+        transfer_plan, transfers['Destination Labware'].values,
+        transfers['Destination Well'].values, custom_labware)
+
+    schedule = schedule_rows(transfer_plan, small_pipette_volumes,
+                             large_pipette_volumes, batch=batch,
+                             disposal_volume=disposal_volume)
+
+    points = []
+    for source_row, destination_rows in zip(
+            schedule['Stock Position'].tolist(),
+            schedule['Destination Wells'].tolist()):
+        points.append(source_coordinates[source_row])
+        points.extend(destination_coordinates[destination_rows])
+    return np.asarray(points).reshape(-1, 2)
+
+
+def nearest_neighbour_order(points, start):
+    """
+    Order visiting all points, always going to the closest point not yet
+    visited, starting from the start coordinate.
+    """
+    points = np.asarray(points, dtype=float)
+    unvisited = np.ones(len(points), dtype=bool)
+    order = np.empty(len(points), dtype=int)
+    position = np.asarray(start, dtype=float)
+    for i in range(len(points)):
+        distances = np.linalg.norm(points - position, axis=1)
+        distances[~unvisited] = np.inf
+        closest = int(np.argmin(distances))
+        order[i] = closest
+        unvisited[closest] = False
+        position = points[closest]
+    return order
+
+
+def two_opt_order(points, order, start, max_passes=50):
+    """
+    Improves an open path (fixed start coordinate, free end) by reversing
+    segments while it shortens the path (2-opt).
+    """
+    points = np.asarray(points, dtype=float)
+    order = np.array(order, dtype=int)
+    n = len(order)
+    if n < 3:
+        return order
+    for _ in range(max_passes):
+        improved = False
+        for i in range(n - 1):
+            path = np.vstack([start, points[order]])
+            # reversing order[i:j+1] replaces the edges (i-1, i) and (j, j+1)
+            # of the path (offset by the start point) with (i-1, j), (i, j+1)
+            a = path[i]
+            b = path[i+1]
+            c = path[i+2:]
+            removed = np.linalg.norm(a - b)
+            added = np.linalg.norm(c - a, axis=1)
+            removed_after = np.zeros(len(c))
+            added_after = np.zeros(len(c))
+            removed_after[:-1] = np.linalg.norm(c[1:] - c[:-1], axis=1)
+            added_after[:-1] = np.linalg.norm(c[1:] - b, axis=1)
+            gains = removed + removed_after - added - added_after
+            best = int(np.argmax(gains))
+            if gains[best] > 1e-9:
+                j = i + 1 + best
+                order[i:j+1] = order[i:j+1][::-1]
+                improved = True
+        if not improved:
+            break
+    return order
+
+
+def optimize_transfer_order(transfer_plan, small_pipette_volumes,
+                            large_pipette_volumes, custom_labware=None,
+                            batch=True, disposal_volume=None, two_opt=True,
+                            gantry_speed=default_gantry_speed):
+    """
+    Reorders the transfers of a plan to shorten the gantry travel of a
+    component wise execution. Within every group of transfers sharing a tip
+    (stock, stock well and pipette) the destinations are ordered by a nearest
+    neighbour path from the stock well, refined by 2-opt. The order of the
+    groups is unchanged. The travel is estimated from the well coordinates
+    only (no z moves and no tip pick ups) at a constant gantry speed.
+
+    Parameters
+    -----------
+
+    transfer_plan: TransferPlan
+    small_pipette_volumes: tuple
+        (min volume, max volume) of the small pipette
+    large_pipette_volumes: tuple
+        (min volume, max volume) of the large pipette
+    custom_labware: dict or str
+        Dictionary of custom labware definitions or path to their folder.
+    batch, disposal_volume:
+        See TransferTables.schedule_component_wise_transfers
+    two_opt: Bool
+        True, the nearest neighbour order is refined with 2-opt
+    gantry_speed: float
+        Speed (mm/sec) used to convert the distances to times.
+
+    Returns
+    --------
+
+    optimized_plan: TransferPlan
+        Plan with the reordered transfers, the original plan is returned if
+        the reordering does not shorten the travel.
+    report: dict
+        'Distance Before (mm)', 'Distance After (mm)', 'Time Before (sec)' and
+        'Time After (sec)'.
+    """
+    transfers = transfer_plan.transfers
+    volumes = transfers['Volume (uL)'].values
+    pipettes = np.full(len(transfers), '', dtype=object)
+    nonzero = volumes > 0
+    pipettes[nonzero] = pipette_assignment(
+        volumes[nonzero], small_pipette_volumes, large_pipette_volumes)
+
+    source_coordinates = well_coordinates(
+        transfer_plan, transfers['Source Labware'].values,
+        transfers['Source Well'].values, custom_labware)
+    destination_coordinates = well_coordinates(
+        transfer_plan, transfers['Destination Labware'].values,
+        transfers['Destination Well'].values, custom_labware)
+
+    group_keys = pd.DataFrame({'Stock': transfers['Stock'].values,
+                               'Source Labware':
+                                   transfers['Source Labware'].values,
+                               'Source Well': transfers['Source Well'].values,
+                               'Pipette': pipettes})
+    group_ids = group_keys.groupby(list(group_keys.columns), sort=False,
+                                   dropna=False).ngroup().values
+
+    new_order = []
+    for group_id in pd.unique(group_ids):
+        rows = np.flatnonzero((group_ids == group_id) & nonzero)
+        zero_rows = np.flatnonzero((group_ids == group_id) & ~nonzero)
+        if len(rows) > 2:
+            start = source_coordinates[rows[0]]
+            points = destination_coordinates[rows]
+            order = nearest_neighbour_order(points, start)
+            if two_opt:
+                order = two_opt_order(points, order, start)
+            rows = rows[order]
+        new_order.extend(rows)
+        new_order.extend(zero_rows)
+    new_order = np.asarray(new_order, dtype=int)
+
+    optimized_plan = TransferPlan(transfers.iloc[new_order],
+                                  transfer_plan.manifest,
+                                  transfer_plan.stock_names,
+                                  well_order=transfer_plan.well_order)
+
+    distance_before = path_length(transfer_path(
+        transfer_plan, small_pipette_volumes, large_pipette_volumes,
+        custom_labware, batch, disposal_volume))
+    distance_after = path_length(transfer_path(
+        optimized_plan, small_pipette_volumes, large_pipette_volumes,
+        custom_labware, batch, disposal_volume))
+    if distance_after > distance_before:
+        optimized_plan = transfer_plan
+        distance_after = distance_before
+
+    report = {'Distance Before (mm)': distance_before,
+              'Distance After (mm)': distance_after,
+              'Time Before (sec)': distance_before/gantry_speed,
+              'Time After (sec)': distance_after/gantry_speed}
+    return optimized_plan, report
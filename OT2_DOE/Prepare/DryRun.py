@@ -0,0 +1,333 @@
+import numpy as np
+import pandas as pd
+
+from Prepare.DeckPath import deck_slot_origins, default_gantry_speed, \
+    schedule_rows, well_coordinates
+from Prepare.TransferPlan import split_well_indices
+
+# Simulator free estimate of how long the robot takes to run a TransferPlan.
+# Every pipette action is given a duration from the plan flow rates
+# (OT2 Left/Right Pipette Aspiration/Dispense Rate (uL/sec)), the gantry
+# travel between the visited wells (DeckPath coordinates) and fixed action
+# times, so alternative protocols and deck layouts can be compared without
+# creating an opentrons protocol context.
+
+# (min volume, max volume) in uL of the opentrons pipette models
+pipette_volume_ranges = {'p10_single': (1, 10), 'p20_single_gen2': (1, 20),
+                         'p50_single': (5, 50), 'p300_single': (30, 300),
+                         'p300_single_gen2': (20, 300),
+                         'p1000_single': (100, 1000),
+                         'p1000_single_gen2': (100, 1000)}
+
+# seconds for the actions without a volume or a distance
+default_action_times = {'Home': 10.0, 'Pick Up Tip': 4.0, 'Drop Tip': 3.0,
+                        'Return Tip': 4.0, 'Move Overhead': 0.8,
+                        'Blow Out': 1.0}
+
+# trash (slot 12) position used for dropped tips
+trash_coordinates = np.array(deck_slot_origins['12']) + (64.0, 43.0)
+
+run_phases = ['Homing', 'Tip Handling', 'Travel', 'Aspirate', 'Dispense',
+              'Mixing', 'Delays', 'Cleaning', 'Final Transfer']
+
+
+def pipette_settings(experiment_dict, pipette_volumes=None):
+    """
+    Volume range and flow rates of the left and right pipettes of the plan,
+    classified as small and large like OT2Commands.determine_pipette_resolution.
+
+    Parameters
+    -----------
+
+    experiment_dict: dict
+        Dictionary containig all the experimental parameters
+    pipette_volumes: dict
+        (min volume, max volume) by pipette model, overriding
+        pipette_volume_ranges
+
+    Returns
+    --------
+
+    settings: dict
+        {'Small': {...}, 'Large': {...}} each with 'Mount', 'Model', 'Min
+        Volume', 'Max Volume', 'Aspiration Rate' and 'Dispense Rate'.
+    """
+    volume_ranges = dict(pipette_volume_ranges)
+    volume_ranges.update(pipette_volumes or {})
+    mounts = {}
+    for mount in ['Left', 'Right']:
+        model = experiment_dict['OT2 ' + mount + ' Pipette']
+        assert model in volume_ranges, 'Volume range of ' + model + \
+            ' is unknown, provide it with pipette_volumes'
+        mounts[mount] = {
+            'Mount': mount, 'Model': model,
+            'Min Volume': volume_ranges[model][0],
+            'Max Volume': volume_ranges[model][1],
+            'Aspiration Rate': float(experiment_dict[
+                'OT2 ' + mount + ' Pipette Aspiration Rate (uL/sec)']),
+            'Dispense Rate': float(experiment_dict[
+                'OT2 ' + mount + ' Pipette Dispense Rate (uL/sec)'])}
+    if mounts['Left']['Max Volume'] < mounts['Right']['Max Volume']:
+        return {'Small': mounts['Left'], 'Large': mounts['Right']}
+    return {'Small': mounts['Right'], 'Large': mounts['Left']}
+
+
+def tip_coordinates(transfer_plan, mount, tip_numbers, custom_labware=None):
+    """Deck x, y coordinates of tips (index within the tipracks of a mount)."""
+    rows = np.flatnonzero(transfer_plan.manifest['Role'].values ==
+                          mount + ' Tiprack')
+    if len(rows) == 0:  # no tiprack in the manifest, tips are not located
+        return np.tile(trash_coordinates, (len(tip_numbers), 1))
+    tip_numbers = np.asarray(tip_numbers, dtype=int) % \
+        transfer_plan.manifest.loc[rows, 'Wells'].sum()
+    labware, well = split_well_indices(tip_numbers, rows,
+                                       transfer_plan.manifest)
+    return well_coordinates(transfer_plan, labware, well, custom_labware)
+
+
+def estimate_run_time(transfer_plan, experiment_dict, custom_labware=None,
+                      mode='component', batch=True, reuse_tips=True,
+                      delay_after=0, mix_before=None, mix_after=None,
+                      cleaning_protocol=None, final_transfer=False,
+                      pipette_volumes=None, action_times=None,
+                      gantry_speed=default_gantry_speed):
+    """
+    Predicts the robot run time of a transfer plan, per phase.
+
+    Parameters
+    -----------
+
+    transfer_plan: TransferPlan
+        Transfers to make, executed in the order of the plan.
+    experiment_dict: dict
+        Dictionary containig all the experimental parameters, used for the
+        pipettes, their flow rates and the final transfer.
+    custom_labware: dict or str
+        Dictionary of custom labware definitions or path to their folder.
+    mode: 'component' or 'sample'
+        'component' follows OT2Commands.pipette_volumes_component_wise (one
+        tip per stock and pipette, distributes when batch is True), 'sample'
+        follows OT2Commands.pipette_volumes_sample_wise (one tip per
+        transfer, returned when reuse_tips is True, dropped otherwise).
+    batch: Bool
+        See TransferTables.schedule_component_wise_transfers
+    reuse_tips: Bool
+        See OT2Commands.pipette_volumes_sample_wise
+    delay_after: float
+        Seconds waited after every transfer
+    mix_before, mix_after: tuple
+        (repetitions, volume) mixed at the source before aspirating and at
+        the destination after dispensing, as passed to pipette.transfer.
+    cleaning_protocol: dict
+        Cleaning steps executed after every transfer, as made by
+        OT2Commands.cleaning_tip_protocol, each with 'mix_n' and 'delay'.
+    final_transfer: Bool
+        True, adds the transfer of every sample to the final labware (see
+        OT2Commands.transfer_from_destination_to_final).
+    pipette_volumes: dict
+        (min volume, max volume) by pipette model, see pipette_settings
+    action_times: dict
+        Durations (sec) overriding default_action_times
+    gantry_speed: float
+        Speed (mm/sec) of the gantry between wells
+
+    Returns
+    --------
+
+    run_time: pd.Series
+        Seconds spent in each of run_phases plus the 'Total'.
+    """
+    times = dict(default_action_times)
+    times.update(action_times or {})
+    pipettes = pipette_settings(experiment_dict, pipette_volumes)
+    small_volumes = (pipettes['Small']['Min Volume'],
+                     pipettes['Small']['Max Volume'])
+    large_volumes = (pipettes['Large']['Min Volume'],
+                     pipettes['Large']['Max Volume'])
+
+    transfers = transfer_plan.transfers
+    source_coordinates = well_coordinates(
+        transfer_plan, transfers['Source Labware'].values,
+        transfers['Source Well'].values, custom_labware)
+    destination_coordinates = well_coordinates(
+        transfer_plan, transfers['Destination Labware'].values,
+        transfers['Destination Well'].values, custom_labware)
+
+    if mode == 'component':
+        schedule = schedule_rows(transfer_plan, small_volumes, large_volumes,
+                                 batch=batch)
+        new_tips = (schedule[['Pipette', 'Tip']].shift() !=
+                    schedule[['Pipette', 'Tip']]).any(axis=1).values
+        tip_handling_after = 'Drop Tip'
+    elif mode == 'sample':
+        schedule = schedule_rows(transfer_plan, small_volumes, large_volumes,
+                                 batch=False)
+        # sample wise pipettes every transfer in sample order with its tip
+        order = np.argsort(np.concatenate(
+            schedule['Destination Wells'].values), kind='stable')
+        schedule = schedule.iloc[order].reset_index(drop=True)
+        if reuse_tips:  # the tip of the stock index is picked up again
+            schedule['Tip'] = transfers['Stock'].values[
+                schedule['Stock Position'].values]
+        else:
+            for pipette in ['Small', 'Large']:
+                mask = schedule['Pipette'] == pipette
+                schedule.loc[mask, 'Tip'] = np.arange(mask.sum())
+        new_tips = np.ones(len(schedule), dtype=bool)
+        tip_handling_after = 'Return Tip' if reuse_tips else 'Drop Tip'
+    else:
+        raise AssertionError("mode must be either 'component' or 'sample'")
+
+    run_time = dict.fromkeys(run_phases, 0.0)
+    run_time['Homing'] = times['Home']
+    if len(schedule) == 0:
+        run_time['Total'] = sum(run_time.values())
+        return pd.Series(run_time)
+
+    schedule_pipettes = schedule['Pipette'].values
+    last_of_tip = np.append(new_tips[1:], True)
+    travel = 0.0
+    position = np.array(deck_slot_origins['12'])  # home is at the back right
+    for i, (pipette_name, tip, source_row, destination_rows, volumes,
+            aspirations) in enumerate(zip(
+                schedule_pipettes, schedule['Tip'].tolist(),
+                schedule['Stock Position'].tolist(),
+                schedule['Destination Wells'].tolist(),
+                schedule['Volumes'].tolist(),
+                schedule['Aspirations'].tolist())):
+        pipette = pipettes[pipette_name]
+        points = []
+        if new_tips[i]:
+            points.append(tip_coordinates(transfer_plan, pipette['Mount'],
+                                          [tip], custom_labware)[0])
+            run_time['Tip Handling'] += times['Pick Up Tip']
+
+        total_volume = float(np.sum(volumes))
+        if len(destination_rows) > 1:  # distribute with a disposal volume
+            aspirated_volume = total_volume + pipette['Min Volume']
+            run_time['Dispense'] += times['Blow Out']
+        else:
+            aspirated_volume = total_volume
+        # a transfer above the pipette volume goes back and forth
+        for _ in range(int(aspirations)):
+            points.append(source_coordinates[source_row])
+            points.extend(destination_coordinates[destination_rows])
+        run_time['Aspirate'] += aspirated_volume/pipette['Aspiration Rate']
+        run_time['Dispense'] += total_volume/pipette['Dispense Rate']
+
+        if mix_before is not None:
+            mix_volume = min(mix_before[1], pipette['Max Volume'])
+            run_time['Mixing'] += aspirations * mix_before[0] * mix_volume * \
+                (1/pipette['Aspiration Rate'] + 1/pipette['Dispense Rate'])
+        if mix_after is not None:
+            mix_volume = min(mix_after[1], pipette['Max Volume'])
+            run_time['Mixing'] += len(destination_rows) * mix_after[0] * \
+                mix_volume * (1/pipette['Aspiration Rate'] +
+                              1/pipette['Dispense Rate'])
+        run_time['Delays'] += delay_after
+        if cleaning_protocol:
+            for cleaning_step in cleaning_protocol.values():
+                run_time['Cleaning'] += cleaning_step['mix_n'] * \
+                    pipette['Max Volume'] * (1/pipette['Aspiration Rate'] +
+                                             1/pipette['Dispense Rate']) + \
+                    times['Blow Out'] + cleaning_step['delay']
+            run_time['Cleaning'] += times['Blow Out']
+
+        if last_of_tip[i]:
+            if tip_handling_after == 'Return Tip':
+                points.append(points[0])
+            else:
+                points.append(trash_coordinates)
+            run_time['Tip Handling'] += times[tip_handling_after]
+
+        points = np.vstack([position] + points)
+        travel += np.linalg.norm(np.diff(points, axis=0), axis=1).sum()
+        run_time['Travel'] += (len(points) - 1)*times['Move Overhead']
+        position = points[-1]
+
+    run_time['Travel'] += travel/gantry_speed
+
+    if final_transfer:
+        run_time['Final Transfer'] = estimate_final_transfer_time(
+            transfer_plan, experiment_dict, pipettes, times, gantry_speed,
+            custom_labware)
+
+    run_time['Total'] = sum(run_time.values())
+    return pd.Series(run_time)
+
+
+def estimate_final_transfer_time(transfer_plan, experiment_dict, pipettes,
+                                 times, gantry_speed, custom_labware=None):
+    """
+    Seconds taken by OT2Commands.transfer_from_destination_to_final, one new
+    tip per sample. Travel is estimated between the destination well and
+    the final labware slot.
+    """
+    n_samples = transfer_plan.sample_count
+    transfer_volume = float(experiment_dict[
+        'OT2 Single Transfer From Dest Volume (uL)'])
+    if pipettes['Small']['Min Volume'] <= transfer_volume <= \
+            max(pipettes['Small']['Max Volume'],
+                pipettes['Large']['Min Volume']):
+        pipette = pipettes['Small']
+    else:
+        pipette = pipettes['Large']
+    aspiration_rate = float(experiment_dict[
+        'OT2 Single Transfer Pipette Aspiration Rate (uL/sec)'])
+    dispense_rate = float(experiment_dict[
+        'OT2 Single Transfer Pipette Dispense Rate (uL/sec)'])
+    aspirations = int(np.ceil(transfer_volume/pipette['Max Volume']))
+
+    destinations = transfer_plan.transfers.drop_duplicates('Sample')
+    destination_coordinates = well_coordinates(
+        transfer_plan, destinations['Destination Labware'].values,
+        destinations['Destination Well'].values, custom_labware)
+    final_slots = [str(slot) for slot in experiment_dict[
+        'OT2 Single Transfer From Dest Slots']]
+    final_coordinates = np.array(deck_slot_origins[final_slots[0]]) + \
+        (64.0, 43.0)
+    tips = tip_coordinates(transfer_plan, pipette['Mount'],
+                           np.arange(n_samples), custom_labware)
+    legs = np.linalg.norm(tips - destination_coordinates, axis=1) + \
+        (2*aspirations - 1)*np.linalg.norm(
+            destination_coordinates - final_coordinates, axis=1) + \
+        np.linalg.norm(final_coordinates - trash_coordinates)
+
+    return n_samples*(times['Pick Up Tip'] + times['Drop Tip'] +
+                      (2*aspirations + 1)*times['Move Overhead'] +
+                      transfer_volume/aspiration_rate +
+                      transfer_volume/dispense_rate) + \
+        legs.sum()/gantry_speed
+
+
+def compare_run_times(transfer_plans, experiment_dict, custom_labware=None,
+                      **kwargs):
+    """
+    Estimated run times of several alternatives side by side.
+
+    Parameters
+    -----------
+
+    transfer_plans: dict
+        Name of the alternative: TransferPlan, or (TransferPlan,
+        experiment_dict) to compare deck layouts or pipettes.
+    experiment_dict: dict
+        Dictionary containig all the experimental parameters
+    kwargs:
+        Passed to estimate_run_time
+
+    Returns
+    --------
+
+    run_times: pd.DataFrame
+        One column per alternative, one row per phase (seconds).
+    """
+    run_times = {}
+    for name, transfer_plan in transfer_plans.items():
+        plan_experiment_dict = experiment_dict
+        if isinstance(transfer_plan, tuple):
+            transfer_plan, plan_experiment_dict = transfer_plan
+        run_times[name] = estimate_run_time(transfer_plan,
+                                            plan_experiment_dict,
+                                            custom_labware, **kwargs)
+    return pd.DataFrame(run_times)
@@ -0,0 +1,238 @@
+import glob
+import json
+import os
+from collections import namedtuple
+
+import numpy as np
+
+# Labware definitions (built-in opentrons and custom .json) parsed once and
+# kept by load name. Answers questions like well capacity, well count and
+# well ordering without creating a protocol context through
+# opentrons.simulate, which is the slow part of planning.
+
+try:
+    import opentrons_shared_data
+    builtin_labware_dir = os.path.join(
+        os.path.dirname(opentrons_shared_data.__file__),
+        'data', 'labware', 'definitions', '2')
+except ImportError:  # opentrons not installed, only custom labware available
+    builtin_labware_dir = None
+
+LabwareInfo = namedtuple('LabwareInfo', ['load_name', 'definition',
+                                         'wells_row_order',
+                                         'wells_column_order',
+                                         'well_capacities', 'well_positions'])
+
+labware_info_cache = {}  # (namespace, load name, version): LabwareInfo
+definition_file_cache = {}  # file path: (modified time, definition)
+
+
+def custom_labware_definitions(labware_dir_path):
+    """
+    Parses every .json labware definition within a folder (searched
+    recursively). Files are only parsed again when they are modified.
+
+    Parameters
+    -----------
+
+    labware_dir_path : str
+        Path to the folder containing the labware .json files.
+
+    Returns
+    --------
+
+    labware_dict: dict
+        Dictionary of key = file path without the .json extension and
+        value = labware definition, as used by
+        OT2Commands.custom_labware_dict.
+
+    """
+    labware_dict = {}
+    for file in glob.glob(labware_dir_path + '/**/*.json', recursive=True):
+        labware_dict[os.path.splitext(file)[0]] = load_definition_file(file)
+    return labware_dict
+
+
+def load_definition_file(file):
+    """
+    Returns the parsed labware definition of a .json file, reusing the
+    previous parse while the file is unmodified.
+    """
+    modified_time = os.stat(file).st_mtime_ns
+    cached = definition_file_cache.get(file)
+    if cached is None or cached[0] != modified_time:
+        with open(file) as labware_file:
+            cached = (modified_time, json.load(labware_file))
+        definition_file_cache[file] = cached
+    return cached[1]
+
+
+def find_labware_definition(load_name, custom_labware=None):
+    """
+    Finds the definition of a labware by load name, looking first through
+    the custom labware and then the built-in opentrons definitions
+    (highest version).
+
+    Parameters
+    -----------
+
+    load_name: str
+        Load name of the labware, i.e. 'falcon_48_wellplate_1500ul'
+    custom_labware: dict or str
+        Either a dictionary of custom labware definitions (the values are
+        definitions, as returned by OT2Commands.custom_labware_dict) or the
+        path of a folder of custom labware .json files.
+
+    Returns
+    --------
+
+    definition: dict
+        Labware definition
+    """
+    if isinstance(custom_labware, str):
+        custom_labware = custom_labware_definitions(custom_labware)
+    if custom_labware:
+        for definition in custom_labware.values():
+            if definition['parameters']['loadName'] == load_name:
+                return definition
+
+    if builtin_labware_dir is not None:
+        version_files = glob.glob(os.path.join(builtin_labware_dir,
+                                               load_name, '*.json'))
+        if version_files:
+            latest = max(version_files, key=lambda file: int(
+                os.path.splitext(os.path.basename(file))[0]))
+            return load_definition_file(latest)
+
+    raise AssertionError('Labware definition for ' + load_name +
+                         ' was not found in the custom or built-in labware')
+
+
+def labware_info(load_name, custom_labware=None):
+    """
+    Returns the LabwareInfo of a labware, built once per definition and then
+    served from the cache.
+
+    Parameters
+    -----------
+
+    load_name: str
+        Load name of the labware
+    custom_labware: dict or str
+        Dictionary of custom labware definitions or path to their folder.
+
+    Returns
+    --------
+
+    info: LabwareInfo
+        Named tuple of load_name, definition, wells_row_order and
+        wells_column_order (lists of well names in the order
+        OT2Commands.object_list_to_well_list visits them), well_capacities
+        (dict of well name: uL) and well_positions (dict of well name:
+        (x, y, z) of the well top center relative to the labware origin).
+    """
+    definition = find_labware_definition(load_name, custom_labware)
+    cache_key = (definition.get('namespace'), load_name,
+                 definition.get('version'))
+    cached = labware_info_cache.get(cache_key)
+    if cached is None or cached.definition is not definition:
+        cached = build_labware_info(definition)
+        labware_info_cache[cache_key] = cached
+    return cached
+
+
+def build_labware_info(definition):
+    """
+    Builds the LabwareInfo of a labware definition.
+    """
+    wells = definition['wells']
+    wells_column_order = [well for column in definition['ordering']
+                          for well in column]
+    # same as labware.rows(): grouped by the row letter in column order
+    row_names = []
+    for column in definition['ordering']:
+        for well in column:
+            row_name = well.rstrip('0123456789')
+            if row_name not in row_names:
+                row_names.append(row_name)
+    row_index = {row_name: i for i, row_name in enumerate(row_names)}
+    column_position = {well: i for i, well in enumerate(wells_column_order)}
+    wells_row_order = sorted(
+        wells_column_order,
+        key=lambda well: (row_index[well.rstrip('0123456789')],
+                          column_position[well]))
+
+    well_capacities = {well: wells[well]['totalLiquidVolume']
+                       for well in wells_column_order}
+    well_positions = {well: (wells[well]['x'], wells[well]['y'],
+                             wells[well]['z'] + wells[well]['depth'])
+                      for well in wells_column_order}
+
+    return LabwareInfo(load_name=definition['parameters']['loadName'],
+                       definition=definition,
+                       wells_row_order=wells_row_order,
+                       wells_column_order=wells_column_order,
+                       well_capacities=well_capacities,
+                       well_positions=well_positions)
+
+
+def well_capacity(load_name, custom_labware=None, well='A1'):
+    """
+    Returns the total liquid volume (uL) of a well of a labware.
+    """
+    return labware_info(load_name, custom_labware).well_capacities[well]
+
+
+def well_count(load_name, custom_labware=None):
+    """
+    Returns the number of wells of a labware.
+    """
+    return len(labware_info(load_name, custom_labware).wells_column_order)
+
+
+def labware_well_order(load_name, well_order='row', custom_labware=None):
+    """
+    Returns the well names of a labware in 'row' or 'column' order.
+    """
+    info = labware_info(load_name, custom_labware)
+    if well_order == 'row':
+        return info.wells_row_order
+    if well_order == 'column':
+        return info.wells_column_order
+    raise AssertionError("well_order must be either 'row' or 'column'")
+
+
+def labware_list_wells(load_names, well_order='row', custom_labware=None):
+    """
+    Simulator free equivalent of OT2Commands.object_list_to_well_list. Wells
+    of each labware are concatenated in the order of the labware provided.
+
+    Parameters
+    -----------
+
+    load_names: list
+        Load names of the labware, in the order they are used.
+    well_order: 'row' or 'column'
+        String indicating the order in which the wells will be accessed by
+        the robot
+    custom_labware: dict or str
+        Dictionary of custom labware definitions or path to their folder.
+
+    Returns
+    --------
+
+    labware_indexes: np.ndarray
+        Index (position in load_names) of the labware of each well
+    well_names: list
+        Well name of each well
+    """
+    labware_indexes = []
+    well_names = []
+    for i, load_name in enumerate(load_names):
+        if well_order == 'row':
+            wells = labware_info(load_name, custom_labware).wells_row_order
+        else:
+            wells = labware_info(load_name, custom_labware).wells_column_order
+        labware_indexes.extend([i]*len(wells))
+        well_names.extend(wells)
+    return np.asarray(labware_indexes, dtype=int), well_names
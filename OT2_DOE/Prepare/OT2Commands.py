@@ -1,12 +1,15 @@
-import glob
-import os
-import json
 import opentrons.simulate as simulate
 import pandas as pd
 import numpy as np
 import time
 
-from Plan.CreateSamples import isolate_common_column
+from Plan.CreateSamples import isolate_common_column, select_columns
+from Prepare.LabwareRegistry import custom_labware_definitions, well_capacity
+from Prepare.TransferTables import NotEnoughStockWells, \
+    directions_from_table, pack_stock_volumes, pipette_assignment, \
+    schedule_component_wise_transfers, schedule_summary, \
+    stock_allocation_order, stock_well_boundaries, table_from_directions
+from Prepare.TransferLog import TransferLog, transfer_time
 
 # All logic is based on api 2.2+ from opentrons, please read:
 # https://docs.opentrons.com/OpentronsPythonAPIV2.pdf
@@ -39,13 +42,8 @@ def custom_labware_dict(labware_dir_path):
         There include: size, # of wells, well size, height, etc.
 
     """
-    labware_dict = {}
-    for file in glob.glob(labware_dir_path + '/**/*.json', recursive=True):
-        with open(file) as labware_file:
-            # removes the .json extnesion
-            labware_name = os.path.splitext(file)[0]
-            labware_def = json.load(labware_file)
-            labware_dict[labware_name] = labware_def
+    # definitions are cached by the registry, only modified files are parsed
+    labware_dict = custom_labware_definitions(labware_dir_path)
     return labware_dict
 
 
@@ -376,66 +374,242 @@ def stock_well_ranges(volume_df, stock_labware_wells, volume_buffer_pct=10):
     volume_df = pd.DataFrame(volume_df)
     limit = float(stock_labware_wells[0].max_volume)*(
         100-volume_buffer_pct)/100
-    col_names = [name for name in volume_df.columns if "stock" in name]
+    col_names = select_columns(volume_df, role='stock')
     stock_info_to_pull = {}
 
+    stock_position_index = 0
     for col_name in col_names:
         series = volume_df[col_name]
-        series_cs = series.cumsum()
-        multiplier = 1
-        range_list = [0]
-        for index, entry in enumerate(series_cs):
-            limit_m = limit*multiplier
-            if entry > limit_m:
-                multiplier = multiplier + 1
-                range_list.append(index)  # doubled on purpose
-                range_list.append(index)
-        range_list.append(len(series_cs))
-        range_list_2D = [range_list[i:i+2] for i in range(0,
-                                                          len(range_list), 2)]
-        stock_info_to_pull[col_name] = {'Ranges': range_list_2D,
-                                        'Total Volume': series.sum()}
-
-    # Now let us add the information of stock position
-    stock_position_index = 0
-    for col in col_names:
-        add_positions_dict = stock_info_to_pull[col]
-        ranges = add_positions_dict['Ranges']
-        stock_wells_to_pull = []
-        for r in ranges:
-            stock_well = stock_labware_wells[stock_position_index]
-            stock_wells_to_pull.append(stock_well)
-            stock_position_index += 1
-        add_positions_dict['Stock Wells'] = stock_wells_to_pull
+        boundaries = stock_well_boundaries(series.cumsum().values, limit)
+        range_starts = [0] + boundaries.tolist()
+        range_ends = boundaries.tolist() + [len(series)]
+        range_list_2D = [[start, end] for start, end in zip(range_starts,
+                                                            range_ends)]
+
+        # Now let us add the information of stock position
+        stock_well_indices = list(range(
+            stock_position_index, stock_position_index + len(range_list_2D)))
+        stock_position_index += len(range_list_2D)
+        stock_wells_to_pull = [stock_labware_wells[i]
+                               for i in stock_well_indices]
+
+        sample_wells = np.searchsorted(boundaries, np.arange(len(series)),
+                                       side='right')
+
+        stock_info_to_pull[col_name] = {
+            'Ranges': range_list_2D,
+            'Total Volume': series.sum(),
+            'Stock Wells': stock_wells_to_pull,
+            'Stock Well Indices': stock_well_indices,
+            'Sample Stock Well Indices': np.asarray(stock_well_indices)[
+                sample_wells],
+            'Well Volumes': np.bincount(sample_wells, weights=series.values,
+                                        minlength=len(range_list_2D))}
 
     return stock_info_to_pull
 
 
-def create_sample_making_directions(volume_df, stock_position_info,
-                                    loaded_labware_dict, start_position=0):
+def allocate_stock_wells(volume_df, stock_labware_wells, volume_buffer_pct=10,
+                         stock_order=None, balance=True):
     """
-    Function to generate the direction for each sample. This will include total
-    volume to be dispensed for each of the stock composing the sample. It will
-    also indicate the soruce well for each stock and the sample destination
-    well.
+    Bin packing alternative to stock_well_ranges. The samples of a stock are
+    not split into contiguous ranges, each sample is assigned to a stock well
+    so the stock uses as few wells as possible (see pack_stock_volumes).
+    Output can be used wherever the output of stock_well_ranges is used.
 
     Parameters
     -----------
 
+    volume_df: pd.DataFrame
+        Dataframe containing all the species volumes composing each sample.
+    stock_labware_wells: list
+        Stock wells available, in the order they are filled.
+    volume_buffer_pct: int
+        Percentage of volume to use as buffer. This will be use to ensure that
+        the robot will have enough volume to pipette out of the stock source.
+    stock_order: list
+        Position of each stock (in the order of the stock columns) when
+        allocating the stock wells, flat or nested per stock labware as
+        'OT2 Stock Labware Stock Order' (see stock_allocation_order). Stocks
+        are given their wells by increasing position, by default in column
+        order.
+    balance: Bool
+        True, the volumes of a stock are spread evenly over its wells.
 
     Returns
     --------
 
+    stock_volume_to_pull: dict
+        Dictionary keyed by stock name with 'Total Volume', 'Stock Wells',
+        'Stock Well Indices', 'Sample Stock Well Indices' (stock well index
+        of each sample) and 'Well Volumes' (uL pulled from each stock well).
+        'Ranges' is only given when every well serves contiguous samples.
+    """
+    volume_df = pd.DataFrame(volume_df)
+    well_volume = float(stock_labware_wells[0].max_volume)
+    limit = well_volume*(100-volume_buffer_pct)/100
+    col_names = select_columns(volume_df, role='stock')
+    allocation_order = stock_allocation_order(stock_order, len(col_names))
 
+    stock_info_to_pull = {}
+    stock_position_index = 0
+    for col_index in allocation_order:
+        col_name = col_names[col_index]
+        series = volume_df[col_name]
+        sample_wells, well_volumes = pack_stock_volumes(
+            series.values, limit, balance=balance)
+        stock_well_indices = list(range(
+            stock_position_index, stock_position_index + len(well_volumes)))
+        stock_position_index += len(well_volumes)
+        if stock_position_index > len(stock_labware_wells):
+            raise NotEnoughStockWells(
+                'Not enough stock wells, ' + col_name + ' needs wells up to ' +
+                str(stock_position_index) + ' of ' +
+                str(len(stock_labware_wells)))
+
+        stock_info = {'Total Volume': series.sum(),
+                      'Stock Wells': [stock_labware_wells[i]
+                                      for i in stock_well_indices],
+                      'Stock Well Indices': stock_well_indices,
+                      'Sample Stock Well Indices': np.asarray(
+                          stock_well_indices)[sample_wells],
+                      'Well Volumes': well_volumes}
+        # wells serving contiguous samples are also described by ranges
+        if (np.diff(sample_wells) >= 0).all():
+            boundaries = np.flatnonzero(np.diff(sample_wells)) + 1
+            stock_info['Ranges'] = [
+                [start, end] for start, end in zip(
+                    [0] + boundaries.tolist(),
+                    boundaries.tolist() + [len(series)])]
+        stock_info_to_pull[col_name] = stock_info
+
+    # keeping the column order of the volume dataframe
+    return {col_name: stock_info_to_pull[col_name] for col_name in col_names}
+
+
+def stock_preparation_volumes(stock_position_info, well_volume,
+                              volume_buffer_pct=10):
+    """
+    Volumes of each stock to prepare, the volume pulled from every stock well
+    plus the buffer left in the well.
+
+    Parameters
+    -----------
+
+    stock_position_info: dict
+        Output of stock_well_ranges or allocate_stock_wells (uses 'Stock Well
+        Indices' and 'Well Volumes').
+    well_volume: float
+        Volume (uL) of a stock well
+    volume_buffer_pct: int
+        Percentage of the well volume used as buffer.
+
+    Returns
+    --------
 
+    wells_df: pd.DataFrame
+        One row per stock well with 'Stock', 'Stock Well Index', 'Volume
+        (uL)' (pulled), 'Preparation Volume (uL)' and 'Fill (%)'.
+    stocks_df: pd.DataFrame
+        Indexed by stock with 'Wells', 'Volume (uL)' and 'Preparation
+        Volume (uL)'.
     """
+    buffer_volume = well_volume*volume_buffer_pct/100
+    rows = []
+    for stock_name, stock_info in stock_position_info.items():
+        well_indices = stock_info['Stock Well Indices']
+        well_volumes = stock_info['Well Volumes']
+        for well_index, volume in zip(well_indices, well_volumes):
+            rows.append([stock_name, well_index, float(volume),
+                         float(volume) + buffer_volume,
+                         100*float(volume)/well_volume])
+    wells_df = pd.DataFrame(rows, columns=['Stock', 'Stock Well Index',
+                                           'Volume (uL)',
+                                           'Preparation Volume (uL)',
+                                           'Fill (%)'])
+    stocks_df = wells_df.groupby('Stock', sort=False).agg(
+        **{'Wells': ('Stock Well Index', 'size'),
+           'Volume (uL)': ('Volume (uL)', 'sum'),
+           'Preparation Volume (uL)': ('Preparation Volume (uL)', 'sum')})
+    return wells_df, stocks_df
+
+
+def sample_stock_well_indices(stock_position_info, stock_names, n_samples):
+    """
+    Builds the sample to stock well lookup of all stocks.
+
+    Parameters
+    -----------
 
+    stock_position_info: dict
+        Output of stock_well_ranges.
+    stock_names: list
+        Stock names (columns of the lookup)
+    n_samples: int
+        Number of samples (rows of the lookup)
+
+    Returns
+    --------
+
+    lookup: np.ndarray
+        Integer array of shape (n_samples, n_stocks) with the index (within
+        loaded_labware_dict['Stock Wells']) of the stock well each sample
+        pulls every stock from.
+    """
+    lookup = np.empty((n_samples, len(stock_names)), dtype=int)
+    for i, stock_name in enumerate(stock_names):
+        assert stock_name in stock_position_info, \
+            'No stock well ranges found for ' + stock_name
+        stock_info = stock_position_info[stock_name]
+        if 'Sample Stock Well Indices' in stock_info and \
+                len(stock_info['Sample Stock Well Indices']) == n_samples:
+            lookup[:, i] = stock_info['Sample Stock Well Indices']
+            continue
+        # stock info made by hand, only the ranges are known
+        ranges = stock_info['Ranges']
+        if ranges[0][0] > 0 or ranges[-1][1] < n_samples:
+            raise AssertionError('Well is not covered by current stock,' +
+                                 ' please verify stock well ranges.')
+        boundaries = [well_range[0] for well_range in ranges[1:]]
+        well_indices = np.asarray(stock_info.get(
+            'Stock Well Indices', list(range(len(ranges)))))
+        lookup[:, i] = well_indices[np.searchsorted(
+            boundaries, np.arange(n_samples), side='right')]
+    return lookup
+
+
+def create_sample_making_table(volume_df, stock_position_info,
+                               loaded_labware_dict, start_position=0):
+    """
+    Columnar version of the sample making directions, one row per sample and
+    stock (sample major, stocks in column order).
+
+    Parameters
+    -----------
+
+    volume_df: pd.DataFrame
+        Dataframe containing the stock volumes (uL) of each sample.
+    stock_position_info: dict
+        Output of stock_well_ranges.
+    loaded_labware_dict: dict
+        Output of loading_labware.
+    start_position: int
+        Index of the first destination well to use.
+
+    Returns
+    --------
+
+    directions_df: pd.DataFrame
+        Columns 'Sample Index', 'Stock Name', 'Stock Well Index', 'Stock
+        Position', 'Destination Well Index', 'Destination Well Position' and
+        'Stock Volume'. The positions are the well objects.
+    """
     if not isinstance(volume_df, pd.DataFrame):
         volume_df = pd.DataFrame(volume_df)
     volume_df = volume_df.reset_index(drop=True)
     volume_df = isolate_common_column(volume_df, 'stock')
-    destination_wells = loaded_labware_dict['Destination Wells']
-    stock_wells = loaded_labware_dict['Stock Wells']  # might not be needed
+    stock_names = list(volume_df.columns)
+    n_samples, n_stocks = volume_df.shape
 
     # checking if labware and pipette is appropiate before moving forward
     labware_check_enough_wells(volume_df, loaded_labware_dict)
@@ -443,27 +617,64 @@ def create_sample_making_directions(volume_df, stock_position_info,
     pipette_check(volume_df, loaded_labware_dict['Left Pipette'],
                   loaded_labware_dict['Right Pipette'])
 
-    sample_making_dict = {}
-    for i, row in volume_df.iterrows():
-        single_sample_stock_volumes = row
-        well_index = i  # same as sample index  # could add sample + i
-        destination_well = destination_wells[well_index+start_position]
-        sample_making_dict[i] = {}
-        single_sample_dict = sample_making_dict[i]
-
-        for stock_index, column_name in enumerate(volume_df.columns):
-            stock_name = column_name
-            single_sample_dict[stock_name] = {}
-            single_stock_direction_entry = single_sample_dict[stock_name]
-            stock_volume_to_pull = float(
-                single_sample_stock_volumes[stock_name])
-            stock_position = find_stock_to_pull(
-                stock_name, well_index, stock_position_info)
-
-            single_stock_direction_entry['Stock Position'] = stock_position
-            single_stock_direction_entry[
-                'Destination Well Position'] = destination_well
-            single_stock_direction_entry['Stock Volume'] = stock_volume_to_pull
+    stock_well_lookup = sample_stock_well_indices(
+        stock_position_info, stock_names, n_samples)
+    stock_wells = np.empty(len(loaded_labware_dict['Stock Wells']),
+                           dtype=object)
+    stock_wells[:] = loaded_labware_dict['Stock Wells']
+    destination_wells = np.empty(len(loaded_labware_dict['Destination Wells']),
+                                 dtype=object)
+    destination_wells[:] = loaded_labware_dict['Destination Wells']
+
+    sample_indexes = np.repeat(np.arange(n_samples), n_stocks)
+    stock_well_indexes = stock_well_lookup.ravel()
+    destination_well_indexes = sample_indexes + start_position
+
+    directions_df = pd.DataFrame({
+        'Sample Index': sample_indexes,
+        'Stock Name': np.tile(np.asarray(stock_names, dtype=object),
+                              n_samples),
+        'Stock Well Index': stock_well_indexes,
+        'Stock Position': stock_wells[stock_well_indexes],
+        'Destination Well Index': destination_well_indexes,
+        'Destination Well Position': destination_wells[
+            destination_well_indexes],
+        'Stock Volume': volume_df.values.astype(float).ravel()})
+    return directions_df
+
+
+def create_sample_making_directions(volume_df, stock_position_info,
+                                    loaded_labware_dict, start_position=0):
+    """
+    Function to generate the direction for each sample. This will include total
+    volume to be dispensed for each of the stock composing the sample. It will
+    also indicate the soruce well for each stock and the sample destination
+    well. Nested dictionary form of create_sample_making_table.
+
+    Parameters
+    -----------
+
+    volume_df: pd.DataFrame
+        Dataframe containing the stock volumes (uL) of each sample.
+    stock_position_info: dict
+        Output of stock_well_ranges.
+    loaded_labware_dict: dict
+        Output of loading_labware.
+    start_position: int
+        Index of the first destination well to use.
+
+    Returns
+    --------
+
+    sample_making_dict: dict
+        {sample index: {stock name: {'Stock Position', 'Destination Well
+        Position', 'Stock Volume'}}}
+
+    """
+    directions_df = create_sample_making_table(
+        volume_df, stock_position_info, loaded_labware_dict,
+        start_position=start_position)
+    sample_making_dict = directions_from_table(directions_df)
 
     return sample_making_dict
 
@@ -607,11 +818,20 @@ def find_stock_to_pull(stock_name, well_index, stocks_position_dict):
     """
 
     stock_position_info = stocks_position_dict[stock_name]
-    well_ranges = stock_position_info['Ranges']
     stock_positions = stock_position_info['Stock Wells']
 
+    if 'Sample Stock Well Indices' in stock_position_info:
+        sample_wells = stock_position_info['Sample Stock Well Indices']
+        if 0 <= well_index < len(sample_wells):
+            return stock_positions[stock_position_info[
+                'Stock Well Indices'].index(sample_wells[well_index])]
+        raise AssertionError('Well is not covered by current stock,' +
+                             ' please verify stock well ranges.')
+
+    well_ranges = stock_position_info['Ranges']
+    # ranges are half open, the upper index belongs to the next well
     for stock_position, well_range in zip(stock_positions, well_ranges):
-        if well_range[0] <= well_index <= well_range[1]:
+        if well_range[0] <= well_index < well_range[1]:
             return stock_position
     else:
         raise AssertionError('Well is not covered by current stock,' +
@@ -674,16 +894,34 @@ def execute_cleaning_protocol(loaded_labware_dict, pipette, protocol):
 
 def pipette_volumes_sample_wise(protocol, directions, loaded_labware_dict,
                                 reuse_tips=True, clean_tips=False,
-                                after_delay_sec=0, **kwargs):
+                                after_delay_sec=0, transfer_log=None,
+                                verbosity=1, **kwargs):
     """
+    Pipettes the stocks of one sample after the other. With reuse_tips the
+    tip of the stock index is picked up and returned for every transfer,
+    otherwise a new tip is used for every transfer.
+
     Parameters
     -----------
 
+    transfer_log: TransferLog
+        Log the transfer events are added to, a new one by default. The log
+        is also kept in loaded_labware_dict['Transfer Log'].
+    verbosity: int
+        0 prints nothing, 1 the log summary and total time, 2 also every
+        protocol command.
 
     Returns
     --------
+
+    transfer_log: TransferLog
     """
 
+    if hasattr(directions, 'to_directions'):  # TransferPlan
+        directions = directions.to_directions(loaded_labware_dict)
+    if transfer_log is None:
+        transfer_log = TransferLog()
+    loaded_labware_dict['Transfer Log'] = transfer_log
     protocol.home()
     start = time.time()
 
@@ -692,28 +930,38 @@ def pipette_volumes_sample_wise(protocol, directions, loaded_labware_dict,
     large_pipette = loaded_labware_dict['Large Pipette']
     large_tiprack = loaded_labware_dict['Large Tiprack']
 
-    if reuse_tips is True:  # Case when making alot of samples
-        for sample_index, stock_instruction in directions.items():
-            for stock_index, (stock_name, single_stock_instructions) in \
-               enumerate(stock_instruction.items()):
-                stock_volume_to_pull = single_stock_instructions[
-                    'Stock Volume']
-                stock_position_to_pull = single_stock_instructions[
-                    'Stock Position']
-                destination_well = single_stock_instructions[
-                    'Destination Well Position']
-                if stock_volume_to_pull == 0:
-                    pass
-                else:
-                    # Now the three pieces of info available:
-                    # volume, destination, source.
-                    pipette, tiprack_wells = determine_pipette_tiprack(
-                        stock_volume_to_pull, small_pipette,
-                        large_pipette, small_tiprack, large_tiprack)
-                    # Checking if the machine has tips attached prior
-                    if pipette.has_tip:
-                        pipette.drop_tip()
-                    pipette.pick_up_tip(tiprack_wells[stock_index])
+    for sample_index, stock_instruction in directions.items():
+        for stock_index, (stock_name, single_stock_instructions) in \
+           enumerate(stock_instruction.items()):
+            stock_volume_to_pull = single_stock_instructions[
+                'Stock Volume']
+            stock_position_to_pull = single_stock_instructions[
+                'Stock Position']
+            destination_well = single_stock_instructions[
+                'Destination Well Position']
+            if stock_volume_to_pull == 0:
+                continue
+            # Now the three pieces of info available:
+            # volume, destination, source.
+            pipette, tiprack_wells = determine_pipette_tiprack(
+                stock_volume_to_pull, small_pipette,
+                large_pipette, small_tiprack, large_tiprack)
+            # Checking if the machine has tips attached prior
+            if pipette.has_tip:
+                pipette.drop_tip()
+
+            if reuse_tips is True:  # Case when making alot of samples
+                tip = tiprack_wells[stock_index]
+            else:  # case when making only a few samples
+                tip = None  # chosen by opentrons, read by the transfer log
+            with transfer_log.step(protocol, Phase='Sample Making',
+                                   Sample=sample_index, Stock=stock_name,
+                                   Pipette=pipette_label(pipette),
+                                   **{'Volume (uL)': stock_volume_to_pull},
+                                   Tip=tip, Source=stock_position_to_pull,
+                                   Destination=destination_well) as event:
+                if reuse_tips is True:
+                    pipette.pick_up_tip(tip)
                     pipette.transfer(stock_volume_to_pull,
                                      stock_position_to_pull,
                                      destination_well,
@@ -726,57 +974,106 @@ def pipette_volumes_sample_wise(protocol, directions, loaded_labware_dict,
                                                   pipette, protocol)
 
                     pipette.return_tip()
-
-    if reuse_tips is False:  # case when making only a few samples
-        for sample_index, stock_instruction in directions.items():
-            for stock_index, (stock_name, single_stock_instructions) in \
-             enumerate(stock_instruction.items()):
-                stock_volume_to_pull = single_stock_instructions[
-                    'Stock Volume']
-                stock_position_to_pull = single_stock_instructions[
-                    'Stock Position']
-                destination_well = single_stock_instructions[
-                    'Destination Well Position']
-                if stock_volume_to_pull == 0:
-                    pass
                 else:
-                    # Now the three pieces of info available
-                    # volume, destination, source.
-                    pipette, tiprack_wells = determine_pipette_tiprack(
-                        stock_volume_to_pull, small_pipette,
-                        large_pipette, small_tiprack, large_tiprack)
-                    # Checking if the machine has tips attached prior
-                    if pipette.has_tip:
-                        pipette.drop_tip()
-
                     pipette.transfer(stock_volume_to_pull,
                                      stock_position_to_pull,
                                      destination_well,
                                      new_tip='always',
                                      **kwargs)
+                event['Simulated Time (sec)'] = transfer_time(
+                    pipette, stock_volume_to_pull,
+                    after_delay_sec if reuse_tips else 0)
+
+    report_protocol_run(protocol, transfer_log, start, verbosity)
+    return transfer_log
 
-    for line in protocol.commands():
-        print(line)
 
-    # Keeping track of execution time. Will print total run time in minutes
-    end = time.time()
-    time_consumed = end-start
-#     print(time_consumed)
-    print("\nThis protocol took \033[1m{}\033[0m minutes to execute".format(
-        np.round(time_consumed/60, 3)))
+def pipette_label(pipette):
+    """Name of a pipette for the transfer log, i.e. 'p300_single_gen2'."""
+    return getattr(pipette, 'name', str(pipette))
+
+
+def report_protocol_run(protocol, transfer_log, start, verbosity=1):
+    """
+    Prints what a pipetting function did: nothing for verbosity 0, the
+    transfer log summary and total time for 1 and also every protocol
+    command for 2.
+    """
+    if verbosity >= 2:
+        for line in protocol.commands():
+            print(line)
+    if verbosity >= 1:
+        if len(transfer_log):
+            print(transfer_log.summary().to_string())
+        # Keeping track of execution time. Will print total run time in
+        # minutes
+        time_consumed = time.time()-start
+        print("\nThis protocol took \033[1m{}\033[0m minutes to "
+              "execute".format(np.round(time_consumed/60, 3)))
+
+
+def clamp_mix_volume(kwargs, pipette):
+    """
+    Copy of the transfer keyword arguments with the mix_before and mix_after
+    volumes limited to the pipette maximum volume.
+    """
+    kwargs = dict(kwargs)
+    for key in ['mix_before', 'mix_after']:
+        if key in kwargs and kwargs[key][1] > pipette.max_volume:
+            kwargs[key] = (kwargs[key][0], pipette.max_volume)
+    return kwargs
 
 
 def pipette_volumes_component_wise(
         protocol, directions, loaded_labware_dict, delay_after=0,
-        cleaning=False, **kwargs):
+        cleaning=False, batch=True, transfer_log=None, verbosity=1,
+        **kwargs):
     """
+    Pipettes the stocks one after the other following
+    schedule_component_wise_transfers. With new_tip='never' (default) a
+    single tip is used per stock and pipette, taken in order from the
+    tiprack, and transfers from the same stock well are distributed when
+    batch is True. Any other new_tip value is passed to each transfer as is.
+
     Parameters
     -----------
 
+    protocol: opentrons.protocol_api.protocol_context.ProtocolContext
+        Protocol object from the robot
+    directions: dict, pd.DataFrame or TransferPlan
+        Sample making directions, table or transfer plan.
+    loaded_labware_dict: dict
+        Output of loading_labware.
+    delay_after: float
+        Seconds waited after every transfer
+    cleaning: Bool
+        True, the cleaning protocol is executed after every transfer
+    batch: Bool
+        True, transfers from the same stock well are merged into distributes.
+        Disabled when mix_after is used as a distribute cannot mix each
+        destination.
+    transfer_log: TransferLog
+        Log the transfer events are added to, a new one by default. The log
+        is also kept in loaded_labware_dict['Transfer Log'].
+    verbosity: int
+        0 prints nothing, 1 the log summary and total time, 2 also every
+        protocol command.
+    kwargs:
+        Passed to pipette.transfer (and pipette.distribute)
 
     Returns
     --------
+
+    schedule: pd.DataFrame
+        Schedule that was executed, see schedule_component_wise_transfers.
     """
+    if hasattr(directions, 'to_sample_making_table'):  # TransferPlan
+        directions_df = directions.to_sample_making_table(loaded_labware_dict)
+    elif isinstance(directions, pd.DataFrame):
+        directions_df = directions
+    else:
+        directions_df = table_from_directions(directions)
+
     protocol.home()
     start = time.time()
 
@@ -784,129 +1081,93 @@ def pipette_volumes_component_wise(
     small_tiprack = loaded_labware_dict['Small Tiprack']
     large_pipette = loaded_labware_dict['Large Pipette']
     large_tiprack = loaded_labware_dict['Large Tiprack']
-
-    stock_to_pipette_order = None
-    if stock_to_pipette_order is None:
-        stock_to_pipette_order = directions[0].keys()
+    pipettes = {'Small': (small_pipette, small_tiprack),
+                'Large': (large_pipette, large_tiprack)}
+
+    new_tip = kwargs.pop('new_tip', 'never')
+    disposal_volume = kwargs.pop('disposal_volume', None)
+    batch = batch and new_tip == 'never' and 'mix_after' not in kwargs
+    schedule = schedule_component_wise_transfers(
+        directions_df,
+        (small_pipette.min_volume, small_pipette.max_volume),
+        (large_pipette.min_volume, large_pipette.max_volume),
+        batch=batch, disposal_volume=disposal_volume)
 
     # Checking if the machine has tips attached prior
     if small_pipette.has_tip:
         small_pipette.drop_tip()
     if large_pipette.has_tip:
         large_pipette.drop_tip()
-    pipette = small_pipette
-    for i, stock_name in enumerate(stock_to_pipette_order):
-        for stock_index, stock_instructions in directions.items():
-            single_stock_instructions = stock_instructions[stock_name]
-            stock_volume_to_pull = single_stock_instructions[
-                'Stock Volume']
-            stock_position_to_pull = single_stock_instructions[
-                'Stock Position']
-            destination_well = single_stock_instructions[
-                'Destination Well Position']
-
-            if stock_volume_to_pull == 0:
-                pass
-            elif small_pipette.min_volume <= stock_volume_to_pull <= \
-                    small_pipette.max_volume or small_pipette.max_volume <= \
-                    stock_volume_to_pull <= large_pipette.min_volume:
-
-                if pipette == large_pipette and pipette.has_tip is True:
-                    # Returning tip if other pipette has tip
-                    pipette.return_tip()
-                pipette = small_pipette
-                tiprack = small_tiprack
-
-                if 'mix_before' in kwargs.keys():
-                    vol_to_mix = kwargs['mix_before'][1]
-                    if vol_to_mix > pipette.max_volume:
-                        kwargs['mix_before'] = (kwargs['mix_before'][0],
-                                                pipette.max_volume)
-                    else:
-                        pass
-                if 'mix_after' in kwargs.keys():
-                    vol_to_mix = kwargs['mix_after'][1]
-                    if vol_to_mix > pipette.max_volume:
-                        kwargs['mix_after'] = (kwargs['mix_after'][0],
-                                               pipette.max_volume)
-                    else:
-                        pass
-
-                if kwargs['new_tip'] == 'never':
-                    if pipette.has_tip is False:
-                        pipette.pick_up_tip(tiprack[i])
-
-                pipette.transfer(stock_volume_to_pull,
-                                 stock_position_to_pull,
-                                 destination_well,
-                                 **kwargs)
-                if delay_after != 0:
-                    protocol.delay(seconds=delay_after)
-                else:
-                    pass
-
-                if cleaning:
-                    execute_cleaning_protocol(
-                        loaded_labware_dict, pipette, protocol)
-            # ------------------------------------------------------ #
-            elif large_pipette.min_volume <= stock_volume_to_pull:
-                if pipette == small_pipette and pipette.has_tip is True:
-                    pipette.return_tip()
 
-                tiprack = large_tiprack
-                pipette = large_pipette
-
-                if 'mix_before' in kwargs.keys():
-                    vol_to_mix = kwargs['mix_before'][1]
-                    if vol_to_mix > pipette.max_volume:
-                        kwargs['mix_before'] = (kwargs['mix_before'][0],
-                                                pipette.max_volume)
-                    else:
-                        pass
-                if 'mix_after' in kwargs.keys():
-                    vol_to_mix = kwargs['mix_after'][1]
-                    if vol_to_mix > pipette.max_volume:
-                        kwargs['mix_after'] = (kwargs['mix_after'][0],
-                                               pipette.max_volume)
-                    else:
-                        pass
-
-                if kwargs['new_tip'] == 'never':
-                    if pipette.has_tip is False:
-                        pipette.pick_up_tip(tiprack[i])
-
-                pipette.transfer(stock_volume_to_pull,
-                                 stock_position_to_pull,
-                                 destination_well,
-                                 **kwargs)
-                if delay_after != 0:
-                    protocol.delay(seconds=delay_after)
+    if transfer_log is None:
+        transfer_log = TransferLog()
+    loaded_labware_dict['Transfer Log'] = transfer_log
+    sample_indexes = dict(zip(
+        [id(well) for well in directions_df['Destination Well Position']],
+        directions_df['Sample Index'].tolist()))
+
+    current_tip = None
+    for stock_name, pipette_name, tip, stock_position, destination_wells, \
+            volumes in zip(schedule['Stock Name'].tolist(),
+                           schedule['Pipette'].tolist(),
+                           schedule['Tip'].tolist(),
+                           schedule['Stock Position'].tolist(),
+                           schedule['Destination Wells'].tolist(),
+                           schedule['Volumes'].tolist()):
+        pipette, tiprack = pipettes[pipette_name]
+        pipette_kwargs = clamp_mix_volume(kwargs, pipette)
+        samples = [sample_indexes.get(id(well)) for well in destination_wells]
+
+        with transfer_log.step(
+                protocol, Phase='Sample Making',
+                Sample=samples[0] if len(samples) == 1 else samples,
+                Stock=stock_name, Pipette=pipette_label(pipette),
+                **{'Volume (uL)': float(np.sum(volumes))},
+                Tip=tiprack[tip] if new_tip == 'never' else None,
+                Source=stock_position,
+                Destination=', '.join(str(well) for well in
+                                      destination_wells)) as event:
+            if new_tip == 'never' and current_tip != (pipette_name, tip):
+                # a stock and pipette group is done, its tip is not reused
+                for other_pipette, _ in pipettes.values():
+                    if other_pipette.has_tip:
+                        other_pipette.drop_tip()
+                pipette.pick_up_tip(tiprack[tip])
+                current_tip = (pipette_name, tip)
+
+            if len(destination_wells) > 1:
+                if disposal_volume is None:
+                    pipette_kwargs['disposal_volume'] = pipette.min_volume
                 else:
-                    pass
-
-                if cleaning:
-                    execute_cleaning_protocol(
-                        loaded_labware_dict, pipette, protocol)
+                    pipette_kwargs['disposal_volume'] = disposal_volume
+                pipette.distribute(volumes, stock_position,
+                                   destination_wells, new_tip='never',
+                                   **pipette_kwargs)
             else:
-                raise AssertionError('Pipettes not suitable for volume',
-                                     stock_volume_to_pull)
-        if small_pipette.has_tip is True:
-            small_pipette.drop_tip()
-        if large_pipette.has_tip is True:
-            large_pipette.drop_tip()
-
-    for line in protocol.commands():
-        print(line)
+                pipette.transfer(volumes[0], stock_position,
+                                 destination_wells[0], new_tip=new_tip,
+                                 **pipette_kwargs)
+
+            if delay_after != 0:
+                protocol.delay(seconds=delay_after)
+            if cleaning:
+                execute_cleaning_protocol(loaded_labware_dict, pipette,
+                                          protocol)
+            event['Simulated Time (sec)'] = transfer_time(
+                pipette, float(np.sum(volumes)), delay_after)
+
+    if small_pipette.has_tip is True:
+        small_pipette.drop_tip()
+    if large_pipette.has_tip is True:
+        large_pipette.drop_tip()
 
-    # Keeping track of execution time. Will print total run time in minutes
-    end = time.time()
-    time_consumed = end-start
-    print("This protocol took \033[1m{}\033[0m minutes to execute".format(
-        np.round(time_consumed/60, 3)))
+    report_protocol_run(protocol, transfer_log, start, verbosity)
+    return schedule
 
 
 def transfer_from_destination_to_final(protocol, loaded_labware_dict,
-                                       experiment_dict, number_of_samples):
+                                       experiment_dict, number_of_samples,
+                                       transfer_log=None, verbosity=1):
     """
     This function will take the already loaded dictionary and load more
     labware, specfically made for a final transfer from the destination sample
@@ -963,14 +1224,28 @@ def transfer_from_destination_to_final(protocol, loaded_labware_dict,
     pipette.well_bottom_clearance.aspirate = experiment_dict[
         'OT2 Single Transfer From Dest Bottom Aspirating Clearance (mm)']
 
+    if transfer_log is None:
+        transfer_log = TransferLog()
+    loaded_labware_dict['Transfer Log'] = transfer_log
+    start = time.time()
+
     sample_final_location = []
 
     for well_index in range(number_of_samples):
-        pipette.transfer(transfer_volume, dest_wells[well_index],
-                         final_transfer_wells[well_index], new_tip='always')
+        with transfer_log.step(protocol, Phase='Final Transfer',
+                               Sample=well_index,
+                               Pipette=pipette_label(pipette),
+                               **{'Volume (uL)': transfer_volume},
+                               Source=dest_wells[well_index],
+                               Destination=final_transfer_wells[
+                                   well_index]) as event:
+            pipette.transfer(transfer_volume, dest_wells[well_index],
+                             final_transfer_wells[well_index],
+                             new_tip='always')
+            event['Simulated Time (sec)'] = transfer_time(pipette,
+                                                          transfer_volume)
         sample_final_location.append(final_transfer_wells[well_index])
-    for line in protocol.commands():
-        print(line)
+    report_protocol_run(protocol, transfer_log, start, verbosity)
     return sample_final_location
 
 
@@ -1093,20 +1368,6 @@ def labware_check_enough_volume(volumes_df, loaded_labware_dict):
 #     return well_volume
 
 
-def isolate_common_column(df, common_string):
-    """
-    Parameters
-    -----------
-
-
-    Returns
-    --------
-    """
-    cols = df.columns
-    common_string_cols = [col for col in cols if common_string in col]
-    final_df = df.copy()[common_string_cols]
-    return final_df
-
 # ##################### Require Further Testing ##################### #
 
 
@@ -1129,9 +1390,11 @@ def range_gap(small_pipette, pipette_2):
 def find_max_dest_volume_labware(experiment_csv_dict,
                                  custom_labware_dict=None):
     """
-    Using the stock labware name from the csv, loads the appropiate labware
-    from both a custom and the native libary and determines the maximum volume
-    for one stock labware well. Assumes all labware is all identical.
+    Using the destination labware name from the csv, looks up the appropiate
+    labware from both a custom and the native libary and determines the
+    maximum volume for one destination labware well. Assumes all labware is
+    all identical. The definition is read from the labware registry, no
+    protocol is simulated.
 
     Parameters
     -----------
@@ -1140,27 +1403,19 @@ def find_max_dest_volume_labware(experiment_csv_dict,
     Returns
     --------
     """
-    # Protocol encapsulated as only need an instance to simualte and toss
-    if custom_labware_dict:
-        protocol = simulate.get_protocol_api('2.8',
-                                             extra_labware=custom_labware_dict)
-    else:
-        protocol = simulate.get_protocol_api('2.8')
-    stock_plate = protocol.load_labware(
+    dest_plate_well_volume = well_capacity(
         experiment_csv_dict['OT2 Destination Labwares'][0],
-        experiment_csv_dict['OT2 Destination Labware Slots'][0])
-    stock_plate_rows = [well for row in stock_plate.rows() for well in row]
-    stock_plate_well_volume = stock_plate.__dict__[
-        '_well_definition']['A1']['totalLiquidVolume']
-    return stock_plate_well_volume
+        custom_labware_dict)
+    return dest_plate_well_volume
 
 
 def find_max_stock_volume_labware(experiment_csv_dict,
                                   custom_labware_dict=None):
     """
-    Using the stock labware name from the csv, loads the appropiate labware
+    Using the stock labware name from the csv, looks up the appropiate labware
     from both a custom and the native libary and determines the maximum volume
-    for one stock labware well. Assumes all labware is all identical.
+    for one stock labware well. Assumes all labware is all identical. The
+    definition is read from the labware registry, no protocol is simulated.
 
     Parameters
     -----------
@@ -1169,16 +1424,7 @@ def find_max_stock_volume_labware(experiment_csv_dict,
     Returns
     --------
     """
-    # Protocol encapsulated as only need an instance to simualte and toss
-    if custom_labware_dict:
-        protocol = simulate.get_protocol_api('2.8',
-                                             extra_labware=custom_labware_dict)
-    else:
-        protocol = simulate.get_protocol_api('2.8')
-    stock_plate = protocol.load_labware(
+    stock_plate_well_volume = well_capacity(
         experiment_csv_dict['OT2 Stock Labwares'][0],
-        experiment_csv_dict['OT2 Stock Labware Slots'][0])
-    stock_plate_rows = [well for row in stock_plate.rows() for well in row]
-    stock_plate_well_volume = stock_plate.__dict__[
-        '_well_definition']['A1']['totalLiquidVolume']
+        custom_labware_dict)
     return stock_plate_well_volume
@@ -95,38 +95,19 @@ def stock_search_sep(stock_dict, experiment_csv_dict, unfiltered_wtfs):
         
 def baseline_correction(df_samples, baseline_series): 
     """Given the series iloc of a the blank, subtracts the value at every wavelength of blank at resp. wavelength. 
-    Simple subtraction blanking."""
-    new_df_con = []
-    for key, row in df_samples.iterrows():
-        if key == 'Wavelength':
-            wavelengths = row
-            new_df_con.append(wavelengths)
-        else: 
-            series = row
-#             series = (pd.to_numeric(series , errors='coerce').fillna(0)) # just know that the series is an instance so will not update df
-            corrected = series.subtract(baseline_series)
-            new_df_con.append(corrected)
-    
-    baseline_corrected_df = pd.concat(new_df_con, axis = 1).T
-    baseline_corrected_df.index = df_samples[0].index
+    Simple subtraction blanking, broadcast over all the rows at once (the Wavelength row is kept as is)."""
+    baseline_corrected_df = df_samples.sub(baseline_series, axis=1)
+    if 'Wavelength' in df_samples.index:
+        baseline_corrected_df.loc['Wavelength'] = df_samples.loc['Wavelength']
     return baseline_corrected_df
 
 def plot_single_wavelength(dataframe, wavelength):
-    for i, (key, row) in enumerate(dataframe.iterrows()):
-        if key == 'Wavelength':
-            wavelengths = row
-    
+    """Plots the absorbance of every well at one wavelength, selecting the wavelength column and all the wells at once."""
+    wavelengths = dataframe.loc['Wavelength']
     index = np.where(wavelengths == wavelength)[0][0]
-    wells = []
-    absorbances = []
-    for i, (key, row) in enumerate(dataframe.iterrows()):
-        if key == 'Wavelength':
-            pass
-        else:
-            well = key
-            wells.append(well)
-            absorbance = row[index]
-            absorbances.append(absorbance)
+    wells_df = dataframe.drop(['Wavelength'])
+    wells = list(wells_df.index)
+    absorbances = wells_df.iloc[:, index].tolist()
 
     plt.scatter(range(len(wells)), absorbances, s = 20, alpha = 0.5, marker = 'o', color = 'r') # in order for sample creation and analysis 
     plt.xlabel('Well Index')
@@ -0,0 +1,356 @@
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from Plan.ExperimentPlan import labware_plan_keys
+from Prepare.DeckPath import schedule_rows
+from Prepare.DryRun import pipette_settings
+from Prepare.LabwareRegistry import labware_info
+from Prepare.TransferPlan import split_well_indices
+
+# Compiles a TransferPlan into a standalone opentrons protocol .py. Labware,
+# pipette settings, custom labware definitions and every pipetting operation
+# (wells resolved to names) are embedded as JSON in the script, so it can be
+# uploaded to the robot or simulated without this package. The operations
+# follow the same schedules as OT2Commands.pipette_volumes_component_wise
+# ('component') and pipette_volumes_sample_wise ('sample').
+
+protocol_template = '''import json
+
+metadata = {metadata}
+
+# labware, pipettes and operations of the transfer plan
+DATA = json.loads({data})
+
+
+def run(protocol):
+    labware = []
+    for load_name, slot, definition, offset in zip(
+            DATA['labware']['load_name'], DATA['labware']['slot'],
+            DATA['labware']['definition'], DATA['labware']['offset']):
+        if definition is None:
+            labware_object = protocol.load_labware(load_name, slot)
+        else:
+            labware_object = protocol.load_labware_from_definition(
+                definition, slot)
+        if offset:
+            labware_object.set_offset(x=offset[0], y=offset[1], z=offset[2])
+        labware.append(labware_object)
+
+    pipettes = {{}}
+    for name, settings in DATA['pipettes'].items():
+        pipette = protocol.load_instrument(
+            settings['model'], settings['mount'],
+            tip_racks=[labware[i] for i in settings['tipracks']])
+        pipette.flow_rate.aspirate = settings['aspiration_rate']
+        pipette.flow_rate.dispense = settings['dispense_rate']
+        if settings['dispense_clearance'] is not None:
+            pipette.well_bottom_clearance.dispense = \\
+                settings['dispense_clearance']
+        if pipette.has_tip:
+            pipette.drop_tip()
+        pipettes[name] = pipette
+
+    operations = DATA['operations']
+    for pipette_name, pick_up, tip, source, destinations, volumes, drop in \\
+            zip(operations['pipette'], operations['pick_up'],
+                operations['tip'], operations['source'],
+                operations['destinations'], operations['volumes'],
+                operations['drop']):
+        pipette = pipettes[pipette_name]
+        options = dict(DATA['transfer_options'])
+        for key in ['mix_before', 'mix_after']:
+            if key in options:
+                options[key] = (options[key][0],
+                                min(options[key][1], pipette.max_volume))
+        if pick_up:
+            pipette.pick_up_tip(labware[tip[0]][tip[1]])
+        source_well = labware[source[0]][source[1]]
+        destination_wells = [labware[i][well] for i, well in destinations]
+        if len(destination_wells) > 1:
+            pipette.distribute(volumes, source_well, destination_wells,
+                               new_tip='never',
+                               disposal_volume=pipette.min_volume,
+                               **options)
+        else:
+            pipette.transfer(volumes[0], source_well, destination_wells[0],
+                             new_tip='never', **options)
+        if DATA['delay_after']:
+            protocol.delay(seconds=DATA['delay_after'])
+        if drop:
+            if DATA['return_tips']:
+                pipette.return_tip()
+            else:
+                pipette.drop_tip()
+'''
+
+
+def protocol_operations(transfer_plan, small_pipette_volumes,
+                        large_pipette_volumes, mode='component', batch=True):
+    """
+    Pipetting operations of a transfer plan in execution order.
+
+    Parameters
+    -----------
+
+    transfer_plan: TransferPlan
+    small_pipette_volumes: tuple
+        (min volume, max volume) of the small pipette
+    large_pipette_volumes: tuple
+        (min volume, max volume) of the large pipette
+    mode: 'component' or 'sample'
+        'component' one tip per stock and pipette with distributes when batch
+        is True, 'sample' one new tip per transfer in sample order.
+    batch: Bool
+        See TransferTables.schedule_component_wise_transfers
+
+    Returns
+    --------
+
+    operations: pd.DataFrame
+        Schedule (see DeckPath.schedule_rows) with the extra columns 'Pick
+        Up' and 'Drop', True when the operation starts or ends a tip.
+    """
+    if mode == 'component':
+        operations = schedule_rows(transfer_plan, small_pipette_volumes,
+                                   large_pipette_volumes, batch=batch)
+    elif mode == 'sample':
+        operations = schedule_rows(transfer_plan, small_pipette_volumes,
+                                   large_pipette_volumes, batch=False)
+        order = np.argsort(np.concatenate(
+            operations['Destination Wells'].values), kind='stable')
+        operations = operations.iloc[order].reset_index(drop=True)
+        for pipette in ['Small', 'Large']:
+            mask = operations['Pipette'] == pipette
+            operations.loc[mask, 'Tip'] = np.arange(mask.sum())
+    else:
+        raise AssertionError("mode must be either 'component' or 'sample'")
+
+    tips = operations[['Pipette', 'Tip']]
+    operations['Pick Up'] = (tips.shift() != tips).any(axis=1).values
+    operations['Drop'] = (tips.shift(-1) != tips).any(axis=1).values
+    return operations
+
+
+def labware_offsets(manifest, experiment_dict):
+    """Offset (x, y, z) of every labware of the manifest, None without one."""
+    offsets = []
+    role_positions = manifest.groupby('Role', sort=False).cumcount().values
+    for role, position in zip(manifest['Role'].values, role_positions):
+        offset_key = labware_plan_keys[role][2]
+        if offset_key is not None and experiment_dict.get(offset_key):
+            offsets.append(list(experiment_dict[offset_key][position]))
+        else:
+            offsets.append(None)
+    return offsets
+
+
+def protocol_data(transfer_plan, experiment_dict, custom_labware=None,
+                  mode='component', batch=True, delay_after=0,
+                  return_tips=False, pipette_volumes=None,
+                  **transfer_options):
+    """
+    Dictionary embedded in the exported protocol, everything is resolved to
+    labware positions and well names.
+    """
+    manifest = transfer_plan.manifest
+    pipettes = pipette_settings(experiment_dict, pipette_volumes)
+    operations = protocol_operations(
+        transfer_plan,
+        (pipettes['Small']['Min Volume'], pipettes['Small']['Max Volume']),
+        (pipettes['Large']['Min Volume'], pipettes['Large']['Max Volume']),
+        mode=mode, batch=batch)
+
+    definitions = []
+    for load_name in manifest['Labware'].values:
+        definition = labware_info(load_name, custom_labware).definition
+        if definition.get('namespace') == 'opentrons':
+            definitions.append(None)
+        else:  # custom labware is loaded from its embedded definition
+            definitions.append(definition)
+
+    transfers = transfer_plan.transfers
+    source_names = transfer_plan.well_names(
+        transfers['Source Labware'].values, transfers['Source Well'].values,
+        custom_labware)
+    destination_names = transfer_plan.well_names(
+        transfers['Destination Labware'].values,
+        transfers['Destination Well'].values, custom_labware)
+
+    pipette_data = {}
+    tip_locations = {}
+    for name, pipette in pipettes.items():
+        tiprack_rows = np.flatnonzero(manifest['Role'].values ==
+                                      pipette['Mount'] + ' Tiprack')
+        pipette_data[name] = {
+            'model': pipette['Model'], 'mount': pipette['Mount'].lower(),
+            'tipracks': tiprack_rows.tolist(),
+            'aspiration_rate': pipette['Aspiration Rate'],
+            'dispense_rate': pipette['Dispense Rate'],
+            'dispense_clearance': experiment_dict.get(
+                'OT2 Bottom Dispensing Clearance (mm)')}
+        tips = operations.loc[operations['Pipette'] == name, 'Tip'].values
+        if len(tips) == 0:
+            continue
+        assert len(tiprack_rows) > 0 and tips.max() < \
+            manifest.loc[tiprack_rows, 'Wells'].sum(), \
+            'Not enough tips for the ' + name.lower() + ' pipette'
+        tip_labware, tip_wells = split_well_indices(tips, tiprack_rows,
+                                                    manifest)
+        tip_locations[name] = dict(zip(
+            tips.tolist(), zip(tip_labware.tolist(),
+                               transfer_plan.well_names(
+                                   tip_labware, tip_wells,
+                                   custom_labware).tolist())))
+
+    source_rows = operations['Stock Position'].values
+    return {
+        'labware': {'load_name': manifest['Labware'].tolist(),
+                    'slot': manifest['Slot'].tolist(),
+                    'definition': definitions,
+                    'offset': labware_offsets(manifest, experiment_dict)},
+        'pipettes': pipette_data,
+        'operations': {
+            'pipette': operations['Pipette'].tolist(),
+            'pick_up': operations['Pick Up'].tolist(),
+            'tip': [list(tip_locations[pipette][tip]) for pipette, tip in
+                    zip(operations['Pipette'], operations['Tip'])],
+            'source': [[int(labware), name] for labware, name in zip(
+                transfers['Source Labware'].values[source_rows],
+                source_names[source_rows])],
+            'destinations': [[[int(transfers['Destination Labware'].values[
+                row]), destination_names[row]] for row in rows]
+                for rows in operations['Destination Wells']],
+            'volumes': operations['Volumes'].tolist(),
+            'drop': operations['Drop'].tolist()},
+        'transfer_options': transfer_options,
+        'delay_after': delay_after,
+        'return_tips': return_tips}
+
+
+def export_protocol(transfer_plan, experiment_dict, file_path,
+                    custom_labware=None, protocol_name=None, api_level='2.8',
+                    mode='component', batch=True, delay_after=0,
+                    return_tips=False, pipette_volumes=None,
+                    **transfer_options):
+    """
+    Writes a standalone opentrons protocol making the samples of a transfer
+    plan.
+
+    Parameters
+    -----------
+
+    transfer_plan: TransferPlan
+    experiment_dict: dict
+        Dictionary containig all the experimental parameters (pipettes, flow
+        rates, labware offsets and dispensing clearance).
+    file_path: str
+        Path of the protocol .py to write
+    custom_labware: dict or str
+        Dictionary of custom labware definitions or path to their folder,
+        the definitions used are embedded in the protocol.
+    protocol_name: str
+        Name in the protocol metadata, by default the file name.
+    api_level: str
+        Opentrons API level of the protocol
+    mode: 'component' or 'sample'
+        See protocol_operations
+    batch: Bool
+        True, transfers from the same stock well are distributed
+    delay_after: float
+        Seconds waited after every operation
+    return_tips: Bool
+        True, tips are returned to the tiprack instead of dropped in trash
+    pipette_volumes: dict
+        (min volume, max volume) by pipette model, see DryRun.pipette_settings
+    transfer_options:
+        Passed to pipette.transfer and pipette.distribute (i.e mix_before,
+        touch_tip, blow_out)
+
+    Returns
+    --------
+
+    file_path: str
+    """
+    if protocol_name is None:
+        protocol_name = os.path.splitext(os.path.basename(file_path))[0]
+    data = protocol_data(transfer_plan, experiment_dict, custom_labware,
+                         mode=mode, batch=batch, delay_after=delay_after,
+                         return_tips=return_tips,
+                         pipette_volumes=pipette_volumes, **transfer_options)
+    metadata = {'protocolName': protocol_name, 'apiLevel': api_level,
+                'description': 'Exported transfer plan of ' +
+                str(transfer_plan.sample_count) + ' samples'}
+    with open(file_path, 'w') as file:
+        file.write(protocol_template.format(metadata=repr(metadata),
+                                            data=repr(json.dumps(data))))
+    return file_path
+
+
+def simulate_protocol_file(file_path, timeout=None):
+    """
+    Runs opentrons.simulate on a protocol file in a subprocess.
+
+    Returns
+    --------
+
+    result: dict
+        'File', 'Passed', 'Return Code', 'Commands' (number of simulated
+        commands), 'Error' (last line of the error output) and 'Duration
+        (sec)'.
+    """
+    start = time.time()
+    try:
+        completed = subprocess.run(
+            [sys.executable, '-m', 'opentrons.simulate', file_path],
+            capture_output=True, text=True, timeout=timeout)
+        return_code = completed.returncode
+        commands = len([line for line in completed.stdout.splitlines()
+                        if line.strip()])
+        error_lines = completed.stderr.strip().splitlines()
+        error = error_lines[-1] if return_code != 0 and error_lines else ''
+    except subprocess.TimeoutExpired:
+        return_code = None
+        commands = 0
+        error = 'Simulation timed out after ' + str(timeout) + ' sec'
+    return {'File': file_path, 'Passed': return_code == 0,
+            'Return Code': return_code, 'Commands': commands,
+            'Error': error, 'Duration (sec)': time.time() - start}
+
+
+def validate_protocols(file_paths, processes=None, timeout=None):
+    """
+    Simulates several exported protocols in parallel, each in its own
+    python subprocess.
+
+    Parameters
+    -----------
+
+    file_paths: list
+        Protocol files to simulate
+    processes: int
+        Number of simulations running at once, by default the cpu count.
+    timeout: float
+        Seconds after which a simulation is stopped
+
+    Returns
+    --------
+
+    results_df: pd.DataFrame
+        One row per file, see simulate_protocol_file.
+    """
+    if isinstance(file_paths, str):
+        file_paths = [file_paths]
+    processes = processes or os.cpu_count() or 1
+    # the simulations are subprocesses, threads only wait on them
+    with ThreadPoolExecutor(max_workers=processes) as executor:
+        results = list(executor.map(
+            lambda file_path: simulate_protocol_file(file_path, timeout),
+            file_paths))
+    return pd.DataFrame(results)
@@ -0,0 +1,189 @@
+import itertools
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import opentrons.simulate as simulate
+import pandas as pd
+
+from Prepare import OT2Commands
+from Prepare.DryRun import estimate_run_time
+from Prepare.TransferPlan import TransferPlan
+
+# Simulates protocol variants (executor, tip use, mixing, well order, deck
+# assignments) of the same design in parallel, every variant in a worker
+# process with its own opentrons protocol context, and gathers tips, commands,
+# estimated run time and failures into one comparison table.
+
+
+def protocol_variants(executor=('component',), well_order=('row',),
+                      experiment_overrides=({},), **options):
+    """
+    Every combination of the given settings as a list of variants.
+
+    Parameters
+    -----------
+
+    executor: list
+        'component' (OT2Commands.pipette_volumes_component_wise) and/or
+        'sample' (OT2Commands.pipette_volumes_sample_wise)
+    well_order: list
+        'row' and/or 'column'
+    experiment_overrides: list
+        Dictionaries of experiment dictionary entries replaced in the
+        variant, i.e. other deck slots {'OT2 Stock Labware Slots': ['4']}
+    options: lists
+        Keyword arguments of the pipetting function to combine, i.e.
+        new_tip=['never', 'always'], mix_before=[None, (1, 300)]. None
+        leaves the argument out.
+
+    Returns
+    --------
+
+    variants: list
+        Dictionaries with 'Name', 'Executor', 'Well Order', 'Experiment
+        Overrides' and 'Options'.
+    """
+    option_names = list(options.keys())
+    variants = []
+    for executor_name, order, overrides, *option_values in itertools.product(
+            executor, well_order, experiment_overrides,
+            *[options[name] for name in option_names]):
+        variant_options = {name: value for name, value in
+                           zip(option_names, option_values)
+                           if value is not None}
+        name = ', '.join([executor_name, order] +
+                         [key + '=' + str(value) for key, value in
+                          list(overrides.items()) +
+                          list(variant_options.items())])
+        variants.append({'Name': name, 'Executor': executor_name,
+                         'Well Order': order,
+                         'Experiment Overrides': overrides,
+                         'Options': variant_options})
+    return variants
+
+
+def simulate_variant(variant, volume_df, experiment_dict,
+                     custom_labware_path=None, api_level='2.8',
+                     volume_buffer_pct=10):
+    """
+    Simulates one protocol variant from scratch (new protocol context,
+    labware loading, stock wells, directions and pipetting). Run in the
+    worker processes of sweep_protocol_variants.
+
+    Returns
+    --------
+
+    result: dict
+        'Variant', 'Passed', 'Error', 'Tips Used', 'Commands', 'Estimated
+        Run Time (sec)' and 'Simulation Time (sec)'.
+    """
+    start = time.time()
+    result = {'Variant': variant['Name'], 'Passed': False, 'Error': '',
+              'Tips Used': None, 'Commands': None,
+              'Estimated Run Time (sec)': None}
+    variant_experiment_dict = dict(experiment_dict)
+    variant_experiment_dict.update(variant['Experiment Overrides'])
+    options = dict(variant['Options'])
+    try:
+        extra_labware = None
+        if custom_labware_path is not None:
+            extra_labware = OT2Commands.custom_labware_dict(
+                custom_labware_path)
+        protocol = simulate.get_protocol_api(api_level,
+                                             extra_labware=extra_labware)
+        loaded_dict = OT2Commands.loading_labware(
+            protocol, variant_experiment_dict,
+            well_order=variant['Well Order'])
+        stock_info = OT2Commands.stock_well_ranges(
+            volume_df, loaded_dict['Stock Wells'],
+            volume_buffer_pct=volume_buffer_pct)
+        directions_df = OT2Commands.create_sample_making_table(
+            volume_df, stock_info, loaded_dict)
+        directions = OT2Commands.directions_from_table(directions_df)
+
+        # only the structured results are kept, nothing is printed
+        options.setdefault('verbosity', 0)
+        if variant['Executor'] == 'component':
+            OT2Commands.pipette_volumes_component_wise(
+                protocol, directions, loaded_dict, **options)
+        elif variant['Executor'] == 'sample':
+            OT2Commands.pipette_volumes_sample_wise(
+                protocol, directions, loaded_dict, **options)
+        else:
+            raise AssertionError("Executor must be either 'component' "
+                                 "or 'sample'")
+
+        commands = protocol.commands()
+        result['Commands'] = len(commands)
+        result['Tips Used'] = sum(command.startswith('Picking up tip')
+                                  for command in commands)
+
+        transfer_plan = TransferPlan.from_sample_making_table(
+            directions_df, variant_experiment_dict, custom_labware_path,
+            well_order=variant['Well Order'])
+        mode = variant['Executor']
+        estimate_options = {key: options[key] for key in
+                            ['mix_before', 'mix_after', 'batch',
+                             'reuse_tips'] if key in options}
+        if 'after_delay_sec' in options:
+            estimate_options['delay_after'] = options['after_delay_sec']
+        if 'delay_after' in options:
+            estimate_options['delay_after'] = options['delay_after']
+        if options.get('new_tip', 'never') != 'never':
+            estimate_options['batch'] = False
+        result['Estimated Run Time (sec)'] = float(estimate_run_time(
+            transfer_plan, variant_experiment_dict, custom_labware_path,
+            mode=mode, **estimate_options)['Total'])
+        result['Passed'] = True
+    except Exception as error:
+        result['Error'] = ''.join(traceback.format_exception_only(
+            type(error), error)).strip()
+    result['Simulation Time (sec)'] = time.time() - start
+    return result
+
+
+def sweep_protocol_variants(variants, volume_df, experiment_dict,
+                            custom_labware_path=None, processes=None,
+                            api_level='2.8', volume_buffer_pct=10):
+    """
+    Simulates protocol variants in parallel and compares them.
+
+    Parameters
+    -----------
+
+    variants: list
+        Variants to simulate, see protocol_variants.
+    volume_df: pd.DataFrame
+        Dataframe containing the stock volumes (uL) of each sample.
+    experiment_dict: dict
+        Dictionary containig all the experimental parameters
+    custom_labware_path: str
+        Path of the folder of custom labware .json files
+    processes: int
+        Number of worker processes, by default the cpu count.
+    api_level: str
+        Opentrons API level of the simulated protocols
+    volume_buffer_pct: int
+        Percentage of the stock well volume kept as buffer.
+
+    Returns
+    --------
+
+    comparison_df: pd.DataFrame
+        One row per variant (see simulate_variant), passing variants first
+        by increasing estimated run time and tips used.
+    """
+    processes = min(processes or os.cpu_count() or 1, max(len(variants), 1))
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(simulate_variant, variant, volume_df,
+                                   experiment_dict, custom_labware_path,
+                                   api_level, volume_buffer_pct)
+                   for variant in variants]
+        results = [future.result() for future in futures]
+    comparison_df = pd.DataFrame(results)
+    return comparison_df.sort_values(
+        ['Passed', 'Estimated Run Time (sec)', 'Tips Used'],
+        ascending=[False, True, True], na_position='last').reset_index(
+            drop=True)
@@ -0,0 +1,108 @@
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+try:
+    import pyarrow  # only needed to write .parquet logs
+except ImportError:
+    pyarrow = None
+
+# Structured record of what the pipetting functions of OT2Commands did, one
+# event per transfer (or distribute), replacing the printing of every line of
+# protocol.commands().
+
+event_columns = ['Phase', 'Sample', 'Stock', 'Pipette', 'Volume (uL)', 'Tip',
+                 'Tips', 'Source', 'Destination', 'Commands',
+                 'Simulated Time (sec)', 'Wall Time (sec)']
+
+# start of the protocol command text of a tip pick up, followed by the tip
+pick_up_tip_text = 'Picking up tip from '
+
+
+class TransferLog:
+    """
+    Events recorded while executing a protocol. Every event has the
+    event_columns: the phase ('Sample Making', 'Final Transfer', ...), sample
+    index (or indexes of a distribute), stock name, pipette, volume, tip
+    (tiprack well given, or else the first tip picked up during the event),
+    number of tips picked up, source and destination wells (as text),
+    number of protocol commands emitted, the robot time estimated from the
+    flow rates and delays and the wall clock time spent in the simulation.
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def __len__(self):
+        return len(self.events)
+
+    @contextmanager
+    def step(self, protocol, **fields):
+        """
+        Records an event around the protocol calls made within the with
+        block. The yielded dictionary can be completed inside the block
+        (i.e. event['Simulated Time (sec)'] = ...).
+        """
+        event = dict.fromkeys(event_columns)
+        event.update(fields)
+        for key in ['Source', 'Destination', 'Tip']:
+            if event[key] is not None and not isinstance(event[key], str):
+                event[key] = str(event[key])
+        commands_before = len(protocol.commands())
+        start = time.perf_counter()
+        yield event
+        event['Wall Time (sec)'] = time.perf_counter() - start
+        commands = protocol.commands()[commands_before:]
+        event['Commands'] = len(commands)
+        # tips chosen by opentrons (new_tip='always') are read from the
+        # pick up commands of the event
+        picked_tips = [str(command)[len(pick_up_tip_text):]
+                       for command in commands
+                       if str(command).startswith(pick_up_tip_text)]
+        event['Tips'] = len(picked_tips)
+        if event['Tip'] is None and picked_tips:
+            event['Tip'] = picked_tips[0]
+        self.events.append(event)
+
+    def to_frame(self):
+        """Events as a dataframe, one row per event."""
+        return pd.DataFrame(self.events, columns=event_columns)
+
+    def summary(self, by='Phase'):
+        """
+        Aggregates of the events grouped by a column (or list of columns):
+        number of events, volume, tips picked up, commands and times.
+        """
+        events_df = self.to_frame()
+        return events_df.groupby(by, sort=False, dropna=False).agg(
+            **{'Events': ('Phase', 'size'),
+               'Volume (uL)': ('Volume (uL)', 'sum'),
+               'Tips': ('Tips', 'sum'),
+               'Commands': ('Commands', 'sum'),
+               'Simulated Time (sec)': ('Simulated Time (sec)', 'sum'),
+               'Wall Time (sec)': ('Wall Time (sec)', 'sum')})
+
+    def save(self, path):
+        """Saves the events as JSON Lines (.jsonl) or .parquet."""
+        events_df = self.to_frame()
+        if path.endswith('.jsonl'):
+            events_df.to_json(path, orient='records', lines=True)
+        elif path.endswith('.parquet'):
+            assert pyarrow is not None, \
+                'pyarrow is required to save the transfer log as .parquet'
+            # distributes have several samples, kept as text in parquet
+            events_df['Sample'] = events_df['Sample'].astype(str)
+            events_df.to_parquet(path, index=False)
+        else:
+            raise AssertionError('Transfer logs are saved as .jsonl or '
+                                 '.parquet')
+
+
+def transfer_time(pipette, volume, delay=0):
+    """
+    Robot time (sec) of aspirating and dispensing a volume at the flow rates
+    of a pipette, plus a delay.
+    """
+    return volume/pipette.flow_rate.aspirate + \
+        volume/pipette.flow_rate.dispense + delay
@@ -0,0 +1,381 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from Plan.CreateSamples import isolate_common_column
+from Plan.ExperimentPlan import labware_plan_keys
+from Prepare.LabwareRegistry import labware_info, well_capacity
+from Prepare.TransferTables import NotEnoughStockWells, \
+    directions_from_table, pack_stock_volumes, stock_allocation_order, \
+    stock_well_boundaries
+
+try:
+    import pyarrow  # only needed to read/write .parquet transfer plans
+except ImportError:
+    pyarrow = None
+
+# A transfer plan is the interchange format between the planning (Plan) and
+# the execution (Prepare) of an experiment: one row per sample and stock with
+# integer labware and well indices and the volume to move. Labware are
+# referenced by their row in the labware manifest (role, load name, slot) and
+# wells by their position within the labware in the plan well order, so a plan
+# can be built, saved and reloaded without a protocol context and only turned
+# into opentrons Well objects by the executors.
+
+transfer_columns = ['Sample', 'Stock', 'Source Labware', 'Source Well',
+                    'Destination Labware', 'Destination Well', 'Volume (uL)']
+manifest_columns = ['Role', 'Labware', 'Slot', 'Wells', 'Display Name']
+
+
+def labware_manifest(experiment_dict, custom_labware=None):
+    """
+    Table of every labware of the experiment dictionary, in the order they are
+    loaded by OT2Commands.loading_labware within each role.
+
+    Parameters
+    -----------
+
+    experiment_dict: dict
+        Dictionary containig all the experimental parameters
+    custom_labware: dict or str
+        Dictionary of custom labware definitions or path to their folder.
+
+    Returns
+    --------
+
+    manifest: pd.DataFrame
+        Columns 'Role' (as in ExperimentPlan.labware_plan_keys), 'Labware'
+        (load name), 'Slot', 'Wells' (number of wells) and 'Display Name'.
+    """
+    rows = []
+    for role, (names_key, slots_key, _) in labware_plan_keys.items():
+        if names_key not in experiment_dict or \
+                slots_key not in experiment_dict:
+            continue
+        for name, slot in zip(experiment_dict[names_key],
+                              experiment_dict[slots_key]):
+            info = labware_info(name, custom_labware)
+            rows.append([role, name, str(slot),
+                         len(info.wells_column_order),
+                         info.definition['metadata']['displayName']])
+    return pd.DataFrame(rows, columns=manifest_columns)
+
+
+def split_well_indices(well_indices, labware_rows, manifest):
+    """
+    Converts indices into the concatenated wells of several labware (such as
+    loaded_labware_dict['Stock Wells']) into (manifest row, well within the
+    labware) pairs.
+    """
+    well_counts = manifest.loc[labware_rows, 'Wells'].values
+    labware_starts = np.concatenate([[0], np.cumsum(well_counts)[:-1]])
+    well_indices = np.asarray(well_indices, dtype=int)
+    assert len(well_indices) == 0 or \
+        well_indices.max() < well_counts.sum(), \
+        'Well index exceeds the number of wells of the labware'
+    labware_position = np.searchsorted(labware_starts, well_indices,
+                                       side='right') - 1
+    return (np.asarray(labware_rows)[labware_position],
+            well_indices - labware_starts[labware_position])
+
+
+class TransferPlan:
+    """
+    Columnar plan of the stock transfers making the samples.
+
+    - transfers: pd.DataFrame of transfer_columns. 'Stock' is the index of
+      the stock within stock_names, 'Source Labware' and 'Destination
+      Labware' are rows of the manifest and the wells are indices within
+      their labware (in well_order).
+    - manifest: pd.DataFrame of manifest_columns, see labware_manifest().
+    - stock_names: list of the stock (volume column) names.
+    - well_order: 'row' or 'column', order of the well indices.
+    """
+
+    def __init__(self, transfers, manifest, stock_names, well_order='row'):
+        self.transfers = transfers[transfer_columns].reset_index(drop=True)
+        self.manifest = manifest[manifest_columns].reset_index(drop=True)
+        self.stock_names = list(stock_names)
+        self.well_order = well_order
+
+    @classmethod
+    def from_volumes(cls, volume_df, experiment_dict, custom_labware=None,
+                     well_order='row', volume_buffer_pct=10,
+                     start_position=0, stock_allocation='ranges',
+                     stock_order=None):
+        """
+        Builds the transfer plan of a dataframe of stock volumes (uL) without
+        a protocol context. Stock wells are split the same way as
+        OT2Commands.stock_well_ranges (or OT2Commands.allocate_stock_wells),
+        using the capacity of the first stock labware from the labware
+        registry.
+
+        Parameters
+        -----------
+
+        volume_df: pd.DataFrame
+            Dataframe containing the stock volumes (uL) of each sample, stock
+            columns are identified by the term stock in their name.
+        experiment_dict: dict
+            Dictionary containig all the experimental parameters
+        custom_labware: dict or str
+            Dictionary of custom labware definitions or path to their folder.
+        well_order: 'row' or 'column'
+            String indicating the order in which the wells will be accessed by
+            the robot
+        volume_buffer_pct: int
+            Percentage of the stock well volume kept as buffer.
+        start_position: int
+            Index of the first destination well to use.
+        stock_allocation: 'ranges' or 'bin packing'
+            'ranges' gives each stock well contiguous samples (as
+            OT2Commands.stock_well_ranges), 'bin packing' uses as few stock
+            wells as possible (as OT2Commands.allocate_stock_wells).
+        stock_order: list
+            Position of each stock when allocating the stock wells, flat or
+            nested per stock labware as 'OT2 Stock Labware Stock Order' (see
+            TransferTables.stock_allocation_order), by default the column
+            order.
+
+        Returns
+        --------
+
+        transfer_plan: TransferPlan
+        """
+        volume_df = isolate_common_column(
+            pd.DataFrame(volume_df).reset_index(drop=True), 'stock')
+        stock_names = list(volume_df.columns)
+        n_samples, n_stocks = volume_df.shape
+        volumes = volume_df.values.astype(float)
+
+        manifest = labware_manifest(experiment_dict, custom_labware)
+        stock_rows = np.flatnonzero(manifest['Role'].values == 'Stock')
+        destination_rows = np.flatnonzero(
+            manifest['Role'].values == 'Destination')
+        assert len(stock_rows) > 0 and len(destination_rows) > 0, \
+            'The experiment needs both stock and destination labware'
+
+        limit = float(well_capacity(manifest.loc[stock_rows[0], 'Labware'],
+                                    custom_labware)) * \
+            (100-volume_buffer_pct)/100
+
+        sample_stock_wells = np.empty((n_samples, n_stocks), dtype=int)
+        stock_position_index = 0
+        for i in stock_allocation_order(stock_order, n_stocks):
+            if stock_allocation == 'ranges':
+                boundaries = stock_well_boundaries(np.cumsum(volumes[:, i]),
+                                                   limit)
+                sample_wells = np.searchsorted(
+                    boundaries, np.arange(n_samples), side='right')
+                well_count = len(boundaries) + 1
+            elif stock_allocation == 'bin packing':
+                sample_wells, well_volumes = pack_stock_volumes(
+                    volumes[:, i], limit)
+                well_count = len(well_volumes)
+            else:
+                raise AssertionError("stock_allocation must be either "
+                                     "'ranges' or 'bin packing'")
+            sample_stock_wells[:, i] = stock_position_index + sample_wells
+            stock_position_index += well_count
+
+        if stock_position_index > manifest.loc[stock_rows, 'Wells'].sum():
+            raise NotEnoughStockWells(
+                'Not enough stock wells for the stock volumes, ' +
+                str(stock_position_index) + ' wells are needed')
+        assert n_samples + start_position <= \
+            manifest.loc[destination_rows, 'Wells'].sum(), \
+            'Not enough destination wells for the number of samples'
+
+        source_labware, source_well = split_well_indices(
+            sample_stock_wells.ravel(), stock_rows, manifest)
+        destination_labware, destination_well = split_well_indices(
+            np.repeat(np.arange(n_samples) + start_position, n_stocks),
+            destination_rows, manifest)
+
+        transfers = pd.DataFrame({
+            'Sample': np.repeat(np.arange(n_samples), n_stocks),
+            'Stock': np.tile(np.arange(n_stocks), n_samples),
+            'Source Labware': source_labware,
+            'Source Well': source_well,
+            'Destination Labware': destination_labware,
+            'Destination Well': destination_well,
+            'Volume (uL)': volumes.ravel()})
+        return cls(transfers, manifest, stock_names, well_order=well_order)
+
+    @classmethod
+    def from_sample_making_table(cls, directions_df, experiment_dict,
+                                 custom_labware=None, well_order='row'):
+        """
+        Builds the transfer plan of the output of
+        OT2Commands.create_sample_making_table, using its stock and destination
+        well indices.
+        """
+        manifest = labware_manifest(experiment_dict, custom_labware)
+        stock_rows = np.flatnonzero(manifest['Role'].values == 'Stock')
+        destination_rows = np.flatnonzero(
+            manifest['Role'].values == 'Destination')
+
+        stock_names = list(pd.unique(directions_df['Stock Name']))
+        stock_codes = {stock_name: i for i, stock_name in
+                       enumerate(stock_names)}
+        source_labware, source_well = split_well_indices(
+            directions_df['Stock Well Index'].values, stock_rows, manifest)
+        destination_labware, destination_well = split_well_indices(
+            directions_df['Destination Well Index'].values, destination_rows,
+            manifest)
+
+        transfers = pd.DataFrame({
+            'Sample': directions_df['Sample Index'].values,
+            'Stock': directions_df['Stock Name'].map(stock_codes).values,
+            'Source Labware': source_labware,
+            'Source Well': source_well,
+            'Destination Labware': destination_labware,
+            'Destination Well': destination_well,
+            'Volume (uL)': directions_df['Stock Volume'].values.astype(float)})
+        return cls(transfers, manifest, stock_names, well_order=well_order)
+
+    def __len__(self):
+        return len(self.transfers)
+
+    @property
+    def sample_count(self):
+        return int(self.transfers['Sample'].max()) + 1 if len(self) else 0
+
+    def labware_well_indices(self, labware, well, role):
+        """
+        Converts (manifest row, well within labware) pairs into indices of the
+        concatenated wells of a role, as listed in loaded_labware_dict (e.g.
+        'Stock Wells').
+        """
+        role_rows = np.flatnonzero(self.manifest['Role'].values == role)
+        labware_starts = np.zeros(len(self.manifest), dtype=int)
+        labware_starts[role_rows] = np.concatenate(
+            [[0], np.cumsum(self.manifest.loc[role_rows, 'Wells'].values)[:-1]])
+        return labware_starts[np.asarray(labware, dtype=int)] + \
+            np.asarray(well, dtype=int)
+
+    def well_names(self, labware, well, custom_labware=None):
+        """
+        Well names (i.e A1) of (manifest row, well within labware) pairs.
+        """
+        labware = np.asarray(labware, dtype=int)
+        well = np.asarray(well, dtype=int)
+        names = np.empty(len(well), dtype=object)
+        for labware_row in np.unique(labware):
+            info = labware_info(self.manifest.loc[labware_row, 'Labware'],
+                                custom_labware)
+            if self.well_order == 'row':
+                ordered_wells = np.asarray(info.wells_row_order, dtype=object)
+            else:
+                ordered_wells = np.asarray(info.wells_column_order,
+                                           dtype=object)
+            mask = labware == labware_row
+            names[mask] = ordered_wells[well[mask]]
+        return names
+
+    def sample_locations(self, custom_labware=None):
+        """
+        Destination of every sample.
+
+        Returns
+        --------
+
+        locations: pd.DataFrame
+            Indexed by sample with the columns 'Labware' (display name, as in
+            str(well)), 'Slot' and 'Well'.
+        """
+        destinations = self.transfers.drop_duplicates('Sample').sort_values(
+            'Sample')
+        labware = destinations['Destination Labware'].values
+        return pd.DataFrame(
+            {'Labware': self.manifest['Display Name'].values[labware],
+             'Slot': self.manifest['Slot'].values[labware],
+             'Well': self.well_names(labware,
+                                     destinations['Destination Well'].values,
+                                     custom_labware)},
+            index=destinations['Sample'].values)
+
+    def to_sample_making_table(self, loaded_labware_dict):
+        """
+        Resolves the plan into the well objects of a loaded protocol, same
+        output as OT2Commands.create_sample_making_table. The labware must have
+        been loaded with the well order of the plan.
+        """
+        transfers = self.transfers
+        stock_well_index = self.labware_well_indices(
+            transfers['Source Labware'].values, transfers['Source Well'].values,
+            'Stock')
+        destination_well_index = self.labware_well_indices(
+            transfers['Destination Labware'].values,
+            transfers['Destination Well'].values, 'Destination')
+
+        stock_wells = np.empty(len(loaded_labware_dict['Stock Wells']),
+                               dtype=object)
+        stock_wells[:] = loaded_labware_dict['Stock Wells']
+        destination_wells = np.empty(
+            len(loaded_labware_dict['Destination Wells']), dtype=object)
+        destination_wells[:] = loaded_labware_dict['Destination Wells']
+
+        return pd.DataFrame({
+            'Sample Index': transfers['Sample'].values,
+            'Stock Name': np.asarray(self.stock_names, dtype=object)[
+                transfers['Stock'].values],
+            'Stock Well Index': stock_well_index,
+            'Stock Position': stock_wells[stock_well_index],
+            'Destination Well Index': destination_well_index,
+            'Destination Well Position': destination_wells[
+                destination_well_index],
+            'Stock Volume': transfers['Volume (uL)'].values})
+
+    def to_directions(self, loaded_labware_dict):
+        """
+        Resolves the plan into the nested directions dictionary made by
+        OT2Commands.create_sample_making_directions.
+        """
+        return directions_from_table(
+            self.to_sample_making_table(loaded_labware_dict))
+
+    def save(self, path):
+        """
+        Saves the transfers as .csv or .parquet (by extension) and the
+        manifest, stock names and well order next to it as .json.
+        """
+        extension = os.path.splitext(path)[1]
+        if extension == '.parquet':
+            assert pyarrow is not None, \
+                'pyarrow is required to save the transfer plan as .parquet'
+            self.transfers.to_parquet(path, index=False)
+        elif extension == '.csv':
+            self.transfers.to_csv(path, index=False)
+        else:
+            raise AssertionError('Transfer plans are saved as .csv or .parquet')
+
+        with open(os.path.splitext(path)[0] + '.json', 'w') as file:
+            json.dump({'Stock Names': self.stock_names,
+                       'Well Order': self.well_order,
+                       'Manifest': self.manifest.to_dict(orient='list')},
+                      file, indent=1)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a transfer plan saved with TransferPlan.save.
+        """
+        extension = os.path.splitext(path)[1]
+        if extension == '.parquet':
+            assert pyarrow is not None, \
+                'pyarrow is required to load a .parquet transfer plan'
+            transfers = pd.read_parquet(path)
+        elif extension == '.csv':
+            transfers = pd.read_csv(path, float_precision='round_trip')
+        else:
+            raise AssertionError('Transfer plans are saved as .csv or .parquet')
+
+        with open(os.path.splitext(path)[0] + '.json') as file:
+            info = json.load(file)
+        manifest = pd.DataFrame(info['Manifest'])
+        manifest['Slot'] = manifest['Slot'].astype(str)
+        return cls(transfers, manifest, info['Stock Names'],
+                   well_order=info['Well Order'])
@@ -0,0 +1,360 @@
+import numpy as np
+import pandas as pd
+
+# Table helpers of the sample making directions: stock well allocation,
+# directions tables and the component wise transfer schedule. They only work
+# on numbers and dataframes, so the transfer plans, deck path, dry run and
+# batch modules can use them without opentrons (OT2Commands re-exports them).
+
+
+class NotEnoughStockWells(AssertionError):
+    """The stocks need more stock wells than the stock labware hold."""
+
+
+def stock_well_boundaries(cumulative_volumes, limit):
+    """
+    Sample indexes at which a new stock well is started. A new well starts at
+    the first sample whose cumulative volume exceeds the volume of the wells
+    used so far, each well providing up to limit. The boundaries are found
+    with np.searchsorted, one search per stock well instead of one comparison
+    per sample.
+
+    Parameters
+    -----------
+
+    cumulative_volumes: np.ndarray
+        Cumulative sum of the stock volume of each sample
+    limit: float
+        Usable volume of a single stock well
+
+    Returns
+    --------
+
+    boundaries: np.ndarray
+        Sorted sample indexes, range k of a stock covers the samples
+        [boundaries[k-1], boundaries[k]) (half open).
+    """
+    cumulative_volumes = np.asarray(cumulative_volumes, dtype=float)
+    boundaries = []
+    previous = -1
+    multiplier = 1
+    while True:
+        # a sample never starts more than one well, the next boundary can
+        # only be after the previous one
+        index = max(int(np.searchsorted(cumulative_volumes, limit*multiplier,
+                                        side='right')), previous + 1)
+        if index >= len(cumulative_volumes):
+            break
+        boundaries.append(index)
+        previous = index
+        multiplier = multiplier + 1
+    return np.asarray(boundaries, dtype=int)
+
+
+def pack_stock_volumes(volumes, limit, balance=True):
+    """
+    Packs the stock volumes of the samples into as few stock wells as
+    possible (first fit decreasing bin packing), each well providing up to
+    limit. When balance is True the volumes are then spread over that number
+    of wells so the wells are evenly filled (largest volume to the least
+    filled well), keeping the first fit decreasing packing if the balanced
+    one does not fit.
+
+    Parameters
+    -----------
+
+    volumes: np.ndarray
+        Stock volume of each sample
+    limit: float
+        Usable volume of a single stock well
+
+    Returns
+    --------
+
+    sample_wells: np.ndarray
+        Well (0 to n wells - 1) each sample pulls from
+    well_volumes: np.ndarray
+        Volume pulled from each well
+    """
+    volumes = np.asarray(volumes, dtype=float)
+    assert (volumes <= limit).all(), \
+        'A single sample needs more stock than a stock well holds (' + \
+        str(limit) + ' uL)'
+    sample_wells = np.zeros(len(volumes), dtype=int)
+    order = np.argsort(-volumes, kind='stable')
+    well_volumes = np.zeros(0)
+    for sample in order:
+        if volumes[sample] == 0:  # nothing pulled, first well by default
+            continue
+        fits = np.flatnonzero(well_volumes + volumes[sample] <= limit)
+        if len(fits) == 0:
+            well_volumes = np.append(well_volumes, 0.0)
+            well = len(well_volumes) - 1
+        else:
+            well = fits[0]
+        well_volumes[well] += volumes[sample]
+        sample_wells[sample] = well
+    if len(well_volumes) == 0:
+        return sample_wells, np.zeros(1)
+
+    if balance and len(well_volumes) > 1:
+        balanced_wells = np.zeros(len(volumes), dtype=int)
+        balanced_volumes = np.zeros(len(well_volumes))
+        for sample in order:
+            well = int(np.argmin(balanced_volumes))
+            balanced_volumes[well] += volumes[sample]
+            balanced_wells[sample] = well
+        if (balanced_volumes <= limit).all():
+            sample_wells, well_volumes = balanced_wells, balanced_volumes
+    return sample_wells, well_volumes
+
+def stock_allocation_order(stock_order, n_stocks):
+    """
+    Order in which the stocks (column indices) are given their stock wells.
+
+    Parameters
+    -----------
+
+    stock_order: list
+        Position of each stock, in the order of the stock columns. Either a
+        flat list or, as 'OT2 Stock Labware Stock Order' of the plan, one list
+        per stock labware (i.e. [[1, 2], [3, 4, 5, 6, 7, 8, 9, 10, 11, 12]]),
+        read labware after labware. None keeps the column order.
+    n_stocks: int
+        Number of stocks, extra positions are ignored.
+
+    Returns
+    --------
+
+    allocation_order: np.ndarray
+        Stock column indices by increasing position.
+    """
+    if stock_order is None:
+        return np.arange(n_stocks)
+    positions = []
+    for entry in stock_order:
+        if isinstance(entry, (list, tuple, np.ndarray)):
+            positions.extend(entry)
+        else:
+            positions.append(entry)
+    assert len(positions) >= n_stocks, \
+        'The stock order needs one position per stock, ' + \
+        str(len(positions)) + ' positions for ' + str(n_stocks) + ' stocks'
+    return np.argsort(np.asarray(positions[:n_stocks], dtype=float),
+                      kind='stable')
+
+
+
+def directions_from_table(directions_df):
+    """
+    Nests the rows of a sample making table (see
+    OT2Commands.create_sample_making_table) into {sample index: {stock name:
+    {'Stock Position', 'Destination Well Position', 'Stock Volume'}}}.
+    """
+    sample_making_dict = {}
+    for sample_index, stock_name, stock_position, destination_well, \
+            stock_volume in zip(directions_df['Sample Index'].tolist(),
+                                directions_df['Stock Name'].tolist(),
+                                directions_df['Stock Position'].tolist(),
+                                directions_df[
+                                    'Destination Well Position'].tolist(),
+                                directions_df['Stock Volume'].tolist()):
+        sample_making_dict.setdefault(sample_index, {})[stock_name] = {
+            'Stock Position': stock_position,
+            'Destination Well Position': destination_well,
+            'Stock Volume': stock_volume}
+
+    return sample_making_dict
+
+
+def table_from_directions(directions):
+    """
+    Flattens nested sample making directions (see
+    OT2Commands.create_sample_making_directions) back into a sample making
+    table. Stock and destination well indices number the distinct well objects
+    in order of appearance.
+    """
+    rows = []
+    well_numbers = {}
+    for sample_index, stock_instructions in directions.items():
+        for stock_name, single_stock_instructions in \
+                stock_instructions.items():
+            stock_position = single_stock_instructions['Stock Position']
+            destination_well = single_stock_instructions[
+                'Destination Well Position']
+            rows.append([sample_index, stock_name,
+                         well_numbers.setdefault(id(stock_position),
+                                                 len(well_numbers)),
+                         stock_position,
+                         well_numbers.setdefault(id(destination_well),
+                                                 len(well_numbers)),
+                         destination_well,
+                         float(single_stock_instructions['Stock Volume'])])
+    return pd.DataFrame(rows, columns=['Sample Index', 'Stock Name',
+                                       'Stock Well Index', 'Stock Position',
+                                       'Destination Well Index',
+                                       'Destination Well Position',
+                                       'Stock Volume'])
+
+
+def pipette_assignment(volumes, small_pipette_volumes, large_pipette_volumes):
+    """
+    Chooses the pipette of each volume the same way as
+    OT2Commands.determine_pipette_tiprack: the small pipette within its range
+    or in the gap below the large pipette minimum, otherwise the large
+    pipette.
+
+    Parameters
+    -----------
+
+    volumes: np.ndarray
+        Non zero volumes (uL) to pipette
+    small_pipette_volumes: tuple
+        (min volume, max volume) of the small pipette
+    large_pipette_volumes: tuple
+        (min volume, max volume) of the large pipette
+
+    Returns
+    --------
+
+    pipettes: np.ndarray
+        'Small' or 'Large' for each volume
+    """
+    volumes = np.asarray(volumes, dtype=float)
+    small_mask = (small_pipette_volumes[0] <= volumes) & \
+        (volumes <= max(small_pipette_volumes[1], large_pipette_volumes[0]))
+    large_mask = ~small_mask & (large_pipette_volumes[0] <= volumes)
+    if not np.all(small_mask | large_mask):
+        raise AssertionError('Pipettes not suitable for volume',
+                             volumes[~(small_mask | large_mask)][0])
+    return np.where(small_mask, 'Small', 'Large')
+
+
+def schedule_component_wise_transfers(directions_df, small_pipette_volumes,
+                                      large_pipette_volumes, batch=True,
+                                      disposal_volume=None, stock_order=None):
+    """
+    Schedules the stock transfers to use as few tips, pipette swaps and
+    aspirations as possible. Stocks are pipetted one after the other, the
+    transfers of a stock are grouped by pipette (one tip per stock and
+    pipette) and, when batch is True, the transfers from the same stock well
+    are merged into distributes while the summed volume plus the disposal
+    volume fits in the pipette.
+
+    Parameters
+    -----------
+
+    directions_df: pd.DataFrame
+        Sample making table, see OT2Commands.create_sample_making_table.
+    small_pipette_volumes: tuple
+        (min volume, max volume) of the small pipette
+    large_pipette_volumes: tuple
+        (min volume, max volume) of the large pipette
+    batch: Bool
+        True, transfers from the same stock well are merged into distributes
+    disposal_volume: float
+        Extra volume aspirated by a distribute, opentrons uses the pipette
+        minimum volume by default.
+    stock_order: list
+        Order in which the stocks are pipetted, by default the order of the
+        stock names in directions_df.
+
+    Returns
+    --------
+
+    schedule: pd.DataFrame
+        One row per pipette operation, in execution order, with the columns
+        'Stock Name', 'Pipette' ('Small' or 'Large'), 'Tip' (tip number of
+        that pipette), 'Stock Position', 'Destination Wells' and 'Volumes'
+        (lists, more than one entry is a distribute) and 'Aspirations'.
+    """
+    directions_df = directions_df[directions_df['Stock Volume'] > 0]
+    if stock_order is None:
+        stock_order = list(pd.unique(directions_df['Stock Name']))
+    pipettes = pipette_assignment(directions_df['Stock Volume'].values,
+                                  small_pipette_volumes,
+                                  large_pipette_volumes)
+    pipette_volumes = {'Small': small_pipette_volumes,
+                       'Large': large_pipette_volumes}
+
+    stock_names = directions_df['Stock Name'].values
+    stock_wells = directions_df['Stock Well Index'].values
+    stock_positions = directions_df['Stock Position'].values
+    destinations = directions_df['Destination Well Position'].values
+    volumes = directions_df['Stock Volume'].values
+
+    operations = []
+    tip_counts = {'Small': 0, 'Large': 0}
+    current_pipette = None
+    for stock_name in stock_order:
+        stock_mask = stock_names == stock_name
+        # starting with the pipette already in use avoids a swap
+        pipette_order = ['Small', 'Large']
+        if current_pipette == 'Large':
+            pipette_order = ['Large', 'Small']
+        for pipette in pipette_order:
+            rows = np.flatnonzero(stock_mask & (pipettes == pipette))
+            if len(rows) == 0:
+                continue
+            if batch:
+                # stock wells can serve interleaved samples (bin packing),
+                # the rows of a well are made consecutive (in order of first
+                # use of the wells) so they can be batched together
+                well_codes = pd.factorize(stock_wells[rows])[0]
+                rows = rows[np.argsort(well_codes, kind='stable')]
+            current_pipette = pipette
+            tip = tip_counts[pipette]
+            tip_counts[pipette] += 1
+            min_volume, max_volume = pipette_volumes[pipette]
+            if disposal_volume is None:
+                extra_volume = min_volume
+            else:
+                extra_volume = disposal_volume
+
+            batch_rows = []
+            for row in rows:
+                if batch_rows and batch and \
+                        stock_wells[row] == stock_wells[batch_rows[0]] and \
+                        volumes[batch_rows].sum() + volumes[row] + \
+                        extra_volume <= max_volume:
+                    batch_rows.append(row)
+                    continue
+                if batch_rows:
+                    operations.append(scheduled_operation(
+                        stock_name, pipette, tip, batch_rows, stock_positions,
+                        destinations, volumes, max_volume, extra_volume))
+                batch_rows = [row]
+            operations.append(scheduled_operation(
+                stock_name, pipette, tip, batch_rows, stock_positions,
+                destinations, volumes, max_volume, extra_volume))
+
+    return pd.DataFrame(operations, columns=[
+        'Stock Name', 'Pipette', 'Tip', 'Stock Position',
+        'Destination Wells', 'Volumes', 'Aspirations'])
+
+
+def scheduled_operation(stock_name, pipette, tip, rows, stock_positions,
+                        destinations, volumes, max_volume, extra_volume):
+    """
+    Row of schedule_component_wise_transfers for the transfers at rows.
+    """
+    if len(rows) > 1:
+        aspirations = 1
+    else:
+        aspirations = int(np.ceil(volumes[rows[0]]/max_volume))
+    return [stock_name, pipette, tip, stock_positions[rows[0]],
+            list(destinations[rows]), volumes[rows].tolist(), aspirations]
+
+
+def schedule_summary(schedule):
+    """
+    Counts of tips used per pipette, pipette swaps, aspirations and
+    dispenses of a schedule from schedule_component_wise_transfers.
+    """
+    pipettes = schedule['Pipette'].values
+    tips = schedule.drop_duplicates(['Pipette', 'Tip'])['Pipette']
+    return {'Small Tips': int((tips == 'Small').sum()),
+            'Large Tips': int((tips == 'Large').sum()),
+            'Pipette Swaps': int((pipettes[1:] != pipettes[:-1]).sum()),
+            'Aspirations': int(schedule['Aspirations'].sum()),
+            'Dispenses': int(schedule['Volumes'].map(len).sum())}
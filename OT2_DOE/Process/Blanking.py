@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+
+from Process.PlateReader import wavelength_columns
+
+# Group-wise blanking of the spectra of a combined sample info and absorbance
+# dataframe (see PlateReader.join_abs_to_sample_info). Every sample is paired
+# with the blank sharing its values of the matching columns (i.e. the solvent
+# composition), replicate blanks are averaged and all the samples are blanked
+# with one broadcast subtraction.
+
+
+def blank_groups(df, match_on, decimals=None):
+    """
+    Group key of every row given by its values of the matching columns.
+
+    Parameters
+    -----------
+
+    df: pd.DataFrame
+    match_on: list
+        Columns whose values define the blank of a sample, empty for a
+        single blank shared by every sample.
+    decimals: int
+        Decimals the numeric matching columns are rounded to, so
+        compositions carrying float noise still match.
+
+    Returns
+    --------
+
+    keys: pd.MultiIndex or pd.Index
+        One key per row.
+    """
+    if len(match_on) == 0:
+        return pd.Index(np.zeros(len(df), dtype=int))
+    key_columns = []
+    for column in match_on:
+        values = df[column]
+        if decimals is not None and pd.api.types.is_numeric_dtype(values):
+            values = values.round(decimals)
+        key_columns.append(values.to_numpy())
+    return pd.MultiIndex.from_arrays(key_columns, names=match_on)
+
+
+def blank_spectra(combined_df, blanks, match_on=(), decimals=None,
+                  include_blanks=False, add_unit='nm'):
+    """
+    Subtracts from every sample the mean spectrum of the blanks matching it.
+
+    Parameters
+    -----------
+
+    combined_df: pd.DataFrame
+        Sample info and one column per wavelength (see
+        PlateReader.join_abs_to_sample_info), blanks included.
+    blanks: str or array like
+        Boolean mask of the blank rows, or the name of a column holding it.
+    match_on: list
+        Composition columns defining the blank of a sample, i.e.
+        ['ethanol concentration wtf']. Samples are blanked with the mean of
+        the blank replicates sharing their values, an empty list blanks
+        every sample with the mean of all the blanks.
+    decimals: int
+        See blank_groups.
+    include_blanks: bool
+        Whether the blank rows are kept (blanked with their own mean) in the
+        unblanked and blanked dataframes.
+    add_unit: str
+        Unit ending the wavelength column names.
+
+    Returns
+    --------
+
+    blanking_dict: dict
+        'Unblanked' the rows as given, 'Blanked' the same rows with the
+        blanked spectra and 'Blanks' the mean blank spectrum of every
+        matching group with its number of 'Replicates'.
+    """
+    match_on = list(match_on)
+    if isinstance(blanks, str):
+        blanks = combined_df[blanks]
+    is_blank = np.asarray(blanks, dtype=bool)
+    assert is_blank.any(), 'There are no blanks to subtract'
+    wavelength_cols = wavelength_columns(combined_df, add_unit)
+    # float32 spectra (see PlateReader.spectra_matrix) are kept in float32
+    dtype = np.result_type(*combined_df.dtypes[wavelength_cols])
+    if dtype.kind != 'f':  # integer or object readings
+        dtype = np.dtype(float)
+    absorbance = combined_df[wavelength_cols].to_numpy(dtype=dtype)
+
+    keys = blank_groups(combined_df, match_on, decimals)
+    blank_codes, blank_keys = pd.factorize(keys[is_blank])
+    replicates = np.bincount(blank_codes, minlength=len(blank_keys))
+    blank_means = np.zeros((len(blank_keys), absorbance.shape[1]),
+                           dtype=dtype)
+    np.add.at(blank_means, blank_codes, absorbance[is_blank])
+    blank_means /= replicates[:, np.newaxis]
+
+    rows = np.arange(len(combined_df)) if include_blanks \
+        else np.flatnonzero(~is_blank)
+    sample_codes = blank_keys.get_indexer(keys[rows])
+    unmatched = sample_codes < 0
+    assert not unmatched.any(), 'No blank matches the ' + str(match_on) + \
+        ' of the samples ' + str(list(keys[rows][unmatched].unique()[:10]))
+
+    unblanked_df = combined_df.iloc[rows].reset_index(drop=True)
+    blanked_df = unblanked_df.copy()
+    blanked_df[wavelength_cols] = absorbance[rows] - blank_means[sample_codes]
+
+    blanks_df = pd.DataFrame(blank_means, columns=wavelength_cols,
+                             index=blank_keys)
+    blanks_df.insert(0, 'Replicates', replicates)
+    return {'Unblanked': unblanked_df, 'Blanked': blanked_df,
+            'Blanks': blanks_df}
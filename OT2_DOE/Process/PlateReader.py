@@ -1,3 +1,9 @@
+import glob
+import hashlib
+import os
+import time
+import zipfile
+
 import pandas as pd
 import numpy as np
 
@@ -12,42 +18,391 @@ def merge_wavelength_dfs(df_list):
         merge_list.append(df)
     return pd.concat(merge_list)
 
+overflow_marker = 'OVRFLW'
+overflow_policies = ['cap', 'nan', 'max']
+
+
+def overflow_mask(df):
+    """Boolean array of the entries of a plate reader dataframe that are
+    overflow markers (saturated readings)."""
+    return df.to_numpy(dtype=object) == overflow_marker
+
+def overflow_fill_value(policy, holder=15, instrument_max=4.0):
+    """Value given to saturated readings under an overflow policy, see
+    spectra_matrix."""
+    assert policy in overflow_policies, \
+        'policy must be one of ' + str(overflow_policies)
+    return {'cap': holder, 'nan': np.nan, 'max': instrument_max}[policy]
+
 def detect_ovflw(df, holder=15):
-    hold_index = df.index
-    
-    df = df.copy() # Setting up to prevent any errors
-    df.reset_index(drop=True, inplace=True)
-
-    for name, row in df.iterrows():
-        row = list(row)
-        if 'OVRFLW' in row: 
-            row = [holder if value == 'OVRFLW' else value for value in row]
-            df.loc[name] = row
-        else:
-            df.loc[name] = row
-    df.index = hold_index
-    
-    return df
+    """
+    Replaces the overflow markers of a plate reader dataframe by holder in one
+    vectorized step. The values are returned as numbers (float) rather than
+    objects whenever holder is numeric.
+    """
+    saturated = overflow_mask(df)
+    df = df.mask(saturated, holder)
+    return df.infer_objects()
+
+def spectra_matrix(platereader_df, policy='nan', holder=15,
+                   instrument_max=4.0, dtype=np.float32):
+    """
+    Converts a plate reader dataframe into a dense (wells x wavelengths)
+    absorbance array and a separate saturation mask.
+
+    Parameters
+    -----------
+
+    platereader_df: pd.DataFrame
+        Plate reader dataframe with one row per well, either with a
+        'Wavelength' row (extract_plates/merge_wavelength_dfs) or with
+        wavelength columns named as in rehead_wavelengths (i.e. '300.0nm').
+    policy: 'cap', 'nan' or 'max'
+        Value given to saturated readings, 'cap' the holder value, 'nan'
+        NaN and 'max' the instrument maximum absorbance.
+    holder: float
+        Value of saturated readings under the 'cap' policy.
+    instrument_max: float
+        Maximum absorbance of the instrument, used under the 'max' policy.
+    dtype: np.dtype
+        dtype of the absorbance array.
+
+    Returns
+    --------
+
+    spectra: dict
+        'Wells' (index of the wells), 'Wavelengths' (float array),
+        'Absorbance' (array (wells, wavelengths) of dtype) and 'Saturated'
+        (boolean array of the same shape).
+    """
+    fill_value = overflow_fill_value(policy, holder, instrument_max)
+    if 'Wavelength' in platereader_df.index:
+        wavelengths = platereader_df.loc['Wavelength'].to_numpy(dtype=float)
+        platereader_df = platereader_df.drop(['Wavelength'])
+    else:
+        wavelengths = platereader_df.columns.astype(str).str.replace(
+            'nm', '').to_numpy(dtype=float)
+
+    values = platereader_df.to_numpy(dtype=object)
+    saturated = values == overflow_marker
+    absorbance = np.where(saturated, fill_value, values).astype(dtype)
+
+    return {'Wells': platereader_df.index, 'Wavelengths': wavelengths,
+            'Absorbance': absorbance, 'Saturated': saturated}
+
+def spectra_to_df(spectra, add_unit='nm'):
+    """
+    Dataframe of the absorbance of spectra_matrix, one row per well and one
+    column per wavelength (named as in rehead_wavelengths), keeping the
+    absorbance dtype.
+    """
+    wavelengths_names = [str(wavelength)+add_unit for wavelength
+                         in spectra['Wavelengths']]
+    return pd.DataFrame(spectra['Absorbance'], index=spectra['Wells'],
+                        columns=wavelengths_names)
 
 def extract_plates(path, sheet_list):
-    plate_dfs = []
-    for sheet_name in sheet_list:
-        plate_df = pd.read_excel(path, sheet_name = sheet_name).T
-        plate_dfs.append(plate_df)
-    return plate_dfs
+    """Reads all the sheets of sheet_list in a single pass over the workbook,
+    one transposed dataframe per sheet (wells as rows)."""
+    sheets = pd.read_excel(path, sheet_name=list(sheet_list))
+    return [sheets[sheet_name].T for sheet_name in sheet_list]
 
-def add_abs_to_sample_info(sample_info_df, abs_df):
-    
-    wavelengths = list(abs_df.loc['Wavelength'])
-    wavelengths_names = [str(wavelength)+'nm' for wavelength in wavelengths]
-    abs_df.columns = wavelengths_names
-    abs_df.drop(['Wavelength'], inplace=True)
+def workbook_hash(path):
+    """sha1 of the content of a workbook, reading it in chunks."""
+    content_hash = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            content_hash.update(chunk)
+    return content_hash.hexdigest()
 
-    
-    
-    sample_info_df.reset_index(drop=True, inplace=True)
-    abs_df.reset_index(drop=True, inplace=True)
-    combined_df = pd.concat([sample_info_df, abs_df], axis = 1)
+def spectra_cache_path(path):
+    """Path of the spectra cache sidecar of a workbook."""
+    return os.path.splitext(path)[0] + '_spectra.npz'
+
+def save_spectra_cache(cache_path, content_hash, sheet_spectra):
+    """Saves the spectra of every sheet (see spectra_matrix, saturated
+    readings as NaN) with the workbook hash in a .npz sidecar."""
+    arrays = {'hash': np.array(content_hash),
+              'sheet_names': np.array(list(sheet_spectra.keys()), dtype=str)}
+    for i, spectra in enumerate(sheet_spectra.values()):
+        arrays['wells_' + str(i)] = np.asarray(spectra['Wells'], dtype=str)
+        arrays['wavelengths_' + str(i)] = spectra['Wavelengths']
+        arrays['absorbance_' + str(i)] = spectra['Absorbance']
+        arrays['saturated_' + str(i)] = spectra['Saturated']
+    np.savez(cache_path, **arrays)
+
+def load_spectra_cache(cache_path, content_hash, sheet_list):
+    """Spectra of the sheets of a .npz sidecar by sheet name, None when the
+    cache is missing, of another workbook version or lacks a sheet."""
+    if not os.path.exists(cache_path):
+        return None
+    with np.load(cache_path) as cache:
+        if str(cache['hash']) != content_hash:
+            return None
+        sheet_names = list(cache['sheet_names'])
+        if not set(map(str, sheet_list)).issubset(sheet_names):
+            return None
+        sheet_spectra = {}
+        for sheet_name in sheet_list:
+            i = str(sheet_names.index(str(sheet_name)))
+            sheet_spectra[sheet_name] = {
+                'Wells': pd.Index(cache['wells_' + i], dtype=object),
+                'Wavelengths': cache['wavelengths_' + i],
+                'Absorbance': cache['absorbance_' + i],
+                'Saturated': cache['saturated_' + i]}
+    return sheet_spectra
+
+def load_plate_spectra(path, sheet_list, policy='nan', holder=15,
+                       instrument_max=4.0, cache=True):
+    """
+    Spectra of the sheets of a plate reader workbook, parsing the workbook
+    once and caching the parsed spectra so repeated loads skip the Excel
+    parsing.
+
+    Parameters
+    -----------
+
+    path: str
+        Path of the plate reader workbook (.xlsx)
+    sheet_list: list
+        Names of the sheets to read, one plate read per sheet.
+    policy, holder, instrument_max:
+        Treatment of the saturated readings, see spectra_matrix.
+    cache: bool
+        Whether to use (and write) the .npz sidecar of the workbook (see
+        spectra_cache_path), keyed by the sha1 of the workbook content.
+
+    Returns
+    --------
+
+    sheet_spectra: dict
+        Spectra (see spectra_matrix) by sheet name, in the order of
+        sheet_list.
+    """
+    fill_value = overflow_fill_value(policy, holder, instrument_max)
+    sheet_spectra = None
+    if cache:
+        content_hash = workbook_hash(path)
+        cache_path = spectra_cache_path(path)
+        sheet_spectra = load_spectra_cache(cache_path, content_hash,
+                                           sheet_list)
+    if sheet_spectra is None:
+        plate_dfs = extract_plates(path, sheet_list)
+        sheet_spectra = {sheet_name: spectra_matrix(plate_df, policy='nan')
+                         for sheet_name, plate_df in zip(sheet_list,
+                                                         plate_dfs)}
+        if cache:
+            save_spectra_cache(cache_path, content_hash, sheet_spectra)
+
+    for spectra in sheet_spectra.values():
+        if policy != 'nan':
+            spectra['Absorbance'] = np.where(
+                spectra['Saturated'], fill_value,
+                spectra['Absorbance']).astype(spectra['Absorbance'].dtype)
+    return sheet_spectra
+
+def merge_spectra(spectra_list):
+    """Stacks the wells of several spectra (see spectra_matrix) read over the
+    same wavelengths, the array counterpart of merge_wavelength_dfs."""
+    wavelengths = spectra_list[0]['Wavelengths']
+    for spectra in spectra_list[1:]:
+        assert np.array_equal(spectra['Wavelengths'], wavelengths), \
+            'The spectra were not read over the same wavelengths'
+    return {'Wells': pd.Index(np.concatenate(
+                [np.asarray(spectra['Wells'], dtype=object)
+                 for spectra in spectra_list])),
+            'Wavelengths': wavelengths,
+            'Absorbance': np.concatenate([spectra['Absorbance']
+                                          for spectra in spectra_list]),
+            'Saturated': np.concatenate([spectra['Saturated']
+                                         for spectra in spectra_list])}
+
+def watch_plate_exports(folder_path, sheet_list, pattern='*.xlsx',
+                        poll_interval=5, settle_time=2, timeout=None,
+                        **load_kwargs):
+    """
+    Generator ingesting the plate reader workbooks of a folder as they are
+    exported: yields (path, sheet_spectra) (see load_plate_spectra) once for
+    every workbook already present and then for every new or rewritten one,
+    polling the folder every poll_interval seconds.
+
+    Parameters
+    -----------
+
+    folder_path: str
+        Folder the plate reader exports to.
+    sheet_list: list
+        Names of the sheets to read.
+    pattern: str
+        Glob pattern of the workbooks within the folder.
+    poll_interval: float
+        Seconds between scans of the folder.
+    settle_time: float
+        Seconds a workbook must stay unmodified before being read, so files
+        still being written by the reader are skipped until complete.
+    timeout: float
+        Seconds without new workbooks after which the generator stops, None
+        to watch until closed.
+    load_kwargs:
+        Keyword arguments of load_plate_spectra.
+    """
+    ingested = {}
+    last_ingest = time.time()
+    while True:
+        for path in sorted(glob.glob(os.path.join(folder_path, pattern))):
+            if os.path.basename(path).startswith('~$'):  # Excel lock files
+                continue
+            file_stat = os.stat(path)
+            version = (file_stat.st_mtime_ns, file_stat.st_size)
+            if ingested.get(path) == version or \
+                    time.time() - file_stat.st_mtime < settle_time:
+                continue
+            try:
+                sheet_spectra = load_plate_spectra(path, sheet_list,
+                                                   **load_kwargs)
+            except (OSError, ValueError, zipfile.BadZipFile):
+                continue  # not fully written yet, retried on the next scan
+            ingested[path] = version
+            last_ingest = time.time()
+            yield path, sheet_spectra
+        if timeout is not None and time.time() - last_ingest > timeout:
+            return
+        time.sleep(poll_interval)
+
+def add_abs_to_sample_info(sample_info_df, abs_df, plate_slots=None):
+    """Absorbance of each sample appended to the sample info, matched on the
+    sample's slot and well (see join_abs_to_sample_info) rather than on row
+    order. The sample info therefore needs a 'Well' column (and 'Slot' for
+    several plates), as added by Plan.CreateSamples.add_final_location."""
+    return join_abs_to_sample_info(sample_info_df, abs_df, plate_slots)
+
+def slot_keys(slots):
+    """Slots as text keys, so 2, 2.0 and '2' match."""
+    slots = pd.Series(slots, dtype=object)
+    numeric = pd.to_numeric(slots, errors='coerce')
+    keys = slots.astype(str).str.strip()
+    is_integer = numeric.notna() & (numeric % 1 == 0)
+    keys[is_integer] = numeric[is_integer].astype(int).astype(str)
+    return keys.to_numpy(dtype=object)
+
+def well_keys(wells):
+    """Well names as keys, upper case and without padding zeros so 'd01'
+    and 'D1' match."""
+    wells = pd.Series(wells, dtype=object).astype(str).str.strip().str.upper()
+    parts = wells.str.extract(r'^([A-Z]+)0*(\d+)$')
+    keys = parts[0] + parts[1]
+    return keys.fillna(wells).to_numpy(dtype=object)
+
+def abs_plate_arrays(abs_data, add_unit='nm'):
+    """Wells, wavelength names and absorbance array of one plate given as a
+    plate reader dataframe (with a 'Wavelength' row or reheaded) or as
+    spectra (see spectra_matrix)."""
+    if isinstance(abs_data, pd.DataFrame):
+        if 'Wavelength' in abs_data.index:
+            abs_data = rehead_wavelengths(abs_data, add_unit)
+        return abs_data.index, list(abs_data.columns), abs_data.to_numpy()
+    wavelengths_names = [str(wavelength)+add_unit for wavelength
+                         in abs_data['Wavelengths']]
+    return abs_data['Wells'], wavelengths_names, abs_data['Absorbance']
+
+def join_abs_to_sample_info(sample_info_df, abs_data, plate_slots=None,
+                            add_unit='nm'):
+    """
+    Joins the absorbance of each sample to the sample info (see
+    Plan.CreateSamples.add_final_location) by (slot, well) through a hash
+    index, one plate at a time, copying each plate's spectra once into the
+    combined dataframe.
+
+    Parameters
+    -----------
+
+    sample_info_df: pd.DataFrame
+        Sample info with 'Slot' and 'Well' columns, one row per sample.
+    abs_data: pd.DataFrame, dict or list
+        Absorbance of one plate, as a plate reader dataframe (wells as rows)
+        or spectra (see spectra_matrix), or of several plates as a dict
+        (i.e. load_plate_spectra) or list of them.
+    plate_slots: dict or list
+        Deck slot of each plate (by key of the abs_data dict or in the order
+        of the list). May be left out for a single plate, which is then
+        matched on the wells alone.
+    add_unit: str
+        Unit appended to the wavelength column names.
+
+    Returns
+    --------
+
+    combined_df: pd.DataFrame
+        sample_info_df (index reset) followed by one column per wavelength.
+        Wells of the plates without a sample are left out.
+    """
+    if isinstance(abs_data, pd.DataFrame) or \
+            (isinstance(abs_data, dict) and 'Absorbance' in abs_data):
+        abs_data = [abs_data]
+    if isinstance(abs_data, dict):
+        plate_names = list(abs_data.keys())
+        plates = list(abs_data.values())
+        if plate_slots is not None and not isinstance(plate_slots, dict):
+            plate_slots = dict(zip(plate_names, plate_slots))
+    else:
+        plate_names = list(range(len(abs_data)))
+        plates = list(abs_data)
+        if plate_slots is not None:
+            plate_slots = dict(zip(plate_names, plate_slots))
+
+    assert 'Well' in sample_info_df, 'The sample info has no Well column, ' \
+        'see Plan.CreateSamples.add_final_location'
+    sample_wells = well_keys(sample_info_df['Well'])
+    if plate_slots is None:
+        assert len(plates) == 1, \
+            'plate_slots is required to join several plates'
+        sample_slots = np.full(len(sample_wells), None, dtype=object)
+        plate_slots = {plate_names[0]: None}
+    else:
+        assert set(plate_names).issubset(plate_slots), \
+            'plate_slots is missing plates ' + \
+            str(sorted(set(plate_names) - set(plate_slots), key=str))
+        assert 'Slot' in sample_info_df, 'The sample info has no Slot ' \
+            'column to match the plate_slots on'
+        sample_slots = slot_keys(sample_info_df['Slot'])
+        plate_slots = {name: slot_keys([slot])[0]
+                       for name, slot in plate_slots.items()}
+    sample_index = pd.MultiIndex.from_arrays([sample_slots, sample_wells])
+    duplicated = sample_index.duplicated()
+    assert not duplicated.any(), 'Several samples share the (slot, well) ' + \
+        str(list(sample_index[duplicated][:10]))
+
+    combined_abs = None
+    matched = np.zeros(len(sample_index), dtype=bool)
+    for plate_name, plate in zip(plate_names, plates):
+        wells, wavelengths_names, absorbance = abs_plate_arrays(plate,
+                                                                add_unit)
+        plate_wells = pd.Index(well_keys(wells))
+        assert plate_wells.is_unique, 'Plate ' + str(plate_name) + \
+            ' has duplicated wells'
+        if combined_abs is None:
+            combined_names = wavelengths_names
+            combined_abs = np.full((len(sample_index), absorbance.shape[1]),
+                                   np.nan, dtype=absorbance.dtype
+                                   if absorbance.dtype.kind == 'f'
+                                   else object)
+        assert wavelengths_names == combined_names, 'Plate ' + \
+            str(plate_name) + ' was not read over the same wavelengths'
+
+        on_plate = np.flatnonzero(sample_slots == plate_slots[plate_name]) \
+            if plate_slots[plate_name] is not None \
+            else np.arange(len(sample_index))
+        positions = plate_wells.get_indexer(sample_wells[on_plate])
+        found = positions >= 0
+        combined_abs[on_plate[found]] = absorbance[positions[found]]
+        matched[on_plate[found]] = True
+
+    assert matched.all(), 'No absorbance for the samples at (slot, well) ' + \
+        str(list(sample_index[~matched][:10]))
+
+    combined_df = pd.concat(
+        [sample_info_df.reset_index(drop=True),
+         pd.DataFrame(combined_abs, columns=combined_names)], axis=1)
     return combined_df
 
 def rehead_wavelengths(platereader_df, add_unit = 'nm'):
@@ -59,4 +414,18 @@ def rehead_wavelengths(platereader_df, add_unit = 'nm'):
     platereader_df.columns = wavelengths_names
     platereader_df.drop(['Wavelength'], inplace = True)
     
-    return platereader_df
\ No newline at end of file
+    return platereader_df
+
+def wavelength_columns(df, add_unit='nm'):
+    """Columns of a dataframe named as wavelengths (see rehead_wavelengths),
+    i.e. '300.0nm', in their order."""
+    columns = []
+    for column in df.columns:
+        name = str(column)
+        if name.endswith(add_unit):
+            try:
+                float(name[:-len(add_unit)])
+            except ValueError:
+                continue
+            columns.append(column)
+    return columns
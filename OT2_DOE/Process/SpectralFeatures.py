@@ -0,0 +1,142 @@
+import numpy as np
+import pandas as pd
+from scipy.signal import savgol_filter
+
+from Process.PlateReader import wavelength_columns
+
+# Features of the full absorbance matrix of a (blanked) combined dataframe,
+# computed for every well at once: peaks, band integrals, absorbance ratios
+# and derivatives, optionally after Savitzky-Golay smoothing. The features are
+# returned as columns next to the sample info (UID and composition), ready to
+# be used as GPModeling inputs.
+
+
+def spectra_array(df, add_unit='nm'):
+    """Wavelengths (float array) and absorbance array (rows x wavelengths) of
+    the wavelength columns of a dataframe."""
+    wavelength_cols = wavelength_columns(df, add_unit)
+    assert len(wavelength_cols) > 1, 'The dataframe has no spectra'
+    wavelengths = np.array([float(str(column)[:-len(add_unit)])
+                            for column in wavelength_cols])
+    order = np.argsort(wavelengths, kind='stable')
+    absorbance = df[wavelength_cols].to_numpy(dtype=float)[:, order]
+    return wavelengths[order], absorbance
+
+
+def wavelength_index(wavelengths, wavelength):
+    """Index of the wavelength closest to wavelength, which must be within
+    the read range."""
+    assert wavelengths[0] <= wavelength <= wavelengths[-1], \
+        str(wavelength) + 'nm is outside the read range'
+    return int(np.abs(wavelengths - wavelength).argmin())
+
+
+def window_mask(wavelengths, window):
+    """Boolean mask of the wavelengths within window (low, high), both
+    included."""
+    low, high = window
+    mask = (wavelengths >= low) & (wavelengths <= high)
+    assert mask.sum() > 1, 'The window ' + str(window) + \
+        ' holds less than two wavelengths'
+    return mask
+
+
+def window_name(window):
+    return str(window[0]) + '-' + str(window[1]) + 'nm'
+
+
+def band_integrals(wavelengths, absorbance, window):
+    """Trapezoidal integral of every spectrum over the window."""
+    mask = window_mask(wavelengths, window)
+    x = wavelengths[mask]
+    y = absorbance[:, mask]
+    return ((y[:, 1:] + y[:, :-1])/2*np.diff(x)).sum(axis=1)
+
+
+def spectral_features(combined_df, peak_windows=None, bands=(), ratios=(),
+                      derivative_wavelengths=(), smoothing=None,
+                      id_column='UID', keep_spectra=False, add_unit='nm'):
+    """
+    Spectral features of every sample of a combined dataframe.
+
+    Parameters
+    -----------
+
+    combined_df: pd.DataFrame
+        Sample info and one column per wavelength (see
+        Process.Blanking.blank_spectra), one row per sample.
+    peak_windows: list
+        (low, high) windows in which the peak wavelength and absorbance are
+        located, by default the whole read range.
+    bands: list
+        (low, high) windows over which the absorbance is integrated.
+    ratios: list
+        (numerator, denominator) wavelengths of absorbance ratios.
+    derivative_wavelengths: list
+        Wavelengths at which the first and second derivatives of the spectra
+        (per nm) are reported.
+    smoothing: dict
+        Savitzky-Golay filter keyword arguments applied along the
+        wavelengths before any feature, i.e. {'window_length': 7,
+        'polyorder': 2}. None leaves the spectra as read.
+    id_column: str
+        Column identifying the samples, which must be unique.
+    keep_spectra: bool
+        Whether the wavelength columns are kept in the returned dataframe.
+    add_unit: str
+        Unit ending the wavelength column names.
+
+    Returns
+    --------
+
+    features_df: pd.DataFrame
+        The columns of combined_df (without the spectra unless
+        keep_spectra) followed by one column per feature, i.e. 'Peak
+        Wavelength 400-600nm', 'Peak Absorbance 400-600nm', 'Integral
+        400-600nm', 'Ratio 450nm/550nm', 'First Derivative 500nm' and 'Second
+        Derivative 500nm'.
+    """
+    assert combined_df[id_column].is_unique, 'The ' + id_column + \
+        ' of the samples are not unique'
+    wavelengths, absorbance = spectra_array(combined_df, add_unit)
+    if smoothing is not None:
+        absorbance = savgol_filter(absorbance, axis=1, **smoothing)
+    if peak_windows is None:
+        peak_windows = [(wavelengths[0], wavelengths[-1])]
+
+    features = {}
+    for window in peak_windows:
+        mask = window_mask(wavelengths, window)
+        # NaN (saturated) readings are skipped, all NaN spectra have no peak
+        window_absorbance = np.where(mask & ~np.isnan(absorbance),
+                                     absorbance, -np.inf)
+        peaks = window_absorbance.argmax(axis=1)
+        has_values = np.isfinite(window_absorbance).any(axis=1)
+        rows = np.arange(len(absorbance))
+        features['Peak Wavelength ' + window_name(window)] = np.where(
+            has_values, wavelengths[peaks], np.nan)
+        features['Peak Absorbance ' + window_name(window)] = np.where(
+            has_values, absorbance[rows, peaks], np.nan)
+    for window in bands:
+        features['Integral ' + window_name(window)] = band_integrals(
+            wavelengths, absorbance, window)
+    for numerator, denominator in ratios:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            features['Ratio ' + str(numerator) + 'nm/' + str(denominator) +
+                     'nm'] = \
+                absorbance[:, wavelength_index(wavelengths, numerator)] / \
+                absorbance[:, wavelength_index(wavelengths, denominator)]
+    if len(derivative_wavelengths) > 0:
+        first_derivative = np.gradient(absorbance, wavelengths, axis=1)
+        second_derivative = np.gradient(first_derivative, wavelengths, axis=1)
+        for wavelength in derivative_wavelengths:
+            index = wavelength_index(wavelengths, wavelength)
+            features['First Derivative ' + str(wavelength) + 'nm'] = \
+                first_derivative[:, index]
+            features['Second Derivative ' + str(wavelength) + 'nm'] = \
+                second_derivative[:, index]
+
+    info_df = combined_df if keep_spectra else combined_df.drop(
+        columns=wavelength_columns(combined_df, add_unit))
+    features_df = pd.DataFrame(features, index=combined_df.index)
+    return pd.concat([info_df, features_df], axis=1)
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the modules import each other as top level packages (from Plan import ...),
+# as they do when the notebooks are run from OT2_DOE
+package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, package_dir)
@@ -0,0 +1,44 @@
+import os
+
+import pandas as pd
+import pytest
+
+from Prepare.BatchRuns import split_into_runs
+
+package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+custom_labware = os.path.join(package_dir, 'Custom Labware')
+
+# the built-in tipracks need opentrons, a 96 well plate gives the tip count
+experiment_dict = {
+    'OT2 Destination Labwares': ['falcon_48_wellplate_1500ul'],
+    'OT2 Destination Labware Slots': ['2'],
+    'OT2 Stock Labwares': ['20mlscintillation_12_wellplate_18000ul'],
+    'OT2 Stock Labware Slots': ['1'],
+    'OT2 Left Tipracks': ['bbgene_96_wellplate_2200ul'],
+    'OT2 Left Tiprack Slots': ['7'],
+    'OT2 Right Tipracks': ['bbgene_96_wellplate_2200ul'],
+    'OT2 Right Tiprack Slots': ['10'],
+    'OT2 Left Pipette': 'p300_single_gen2',
+    'OT2 Left Pipette Aspiration Rate (uL/sec)': 100,
+    'OT2 Left Pipette Dispense Rate (uL/sec)': 200,
+    'OT2 Right Pipette': 'p1000_single_gen2',
+    'OT2 Right Pipette Aspiration Rate (uL/sec)': 200,
+    'OT2 Right Pipette Dispense Rate (uL/sec)': 400}
+
+
+def test_runs_split_on_stock_wells():
+    # 18 stock wells (two samples per 16.2 mL well) for 12 available
+    volume_df = pd.DataFrame({'water stock uL': [6000.]*12,
+                              'ethanol stock uL': [6000.]*12,
+                              'toluene stock uL': [6000.]*12})
+    runs = split_into_runs(volume_df, experiment_dict, custom_labware)
+    assert len(runs) == 2
+    assert sorted(len(run['Samples']) for run in runs) == [6, 6]
+
+
+def test_sample_exceeding_a_stock_well_is_reported():
+    volume_df = pd.DataFrame({'water stock uL': [20000., 100.],
+                              'ethanol stock uL': [100., 100.]})
+    with pytest.raises(AssertionError,
+                       match='A single sample needs more stock'):
+        split_into_runs(volume_df, experiment_dict, custom_labware)
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from Process.Blanking import blank_spectra
+
+
+def combined_df(dtype=np.float32):
+    """Two ethanol compositions, each with two blank replicates, and three
+    samples (one of them with float noise in its composition)."""
+    return pd.DataFrame({
+        'UID': ['B1', 'B2', 'B3', 'B4', 'S1', 'S2', 'S3'],
+        'Blank': [True, True, True, True, False, False, False],
+        'ethanol concentration wtf': [0.1, 0.1, 0.3, 0.3,
+                                      0.1, 0.3, 0.1 + 1e-12],
+        '400.0nm': np.array([1, 3, 10, 20, 5, 25, 6], dtype=dtype),
+        '500.0nm': np.array([0, 2, 4, 6, 3, 9, 4], dtype=dtype)})
+
+
+def test_blank_replicates_are_averaged_per_group():
+    blanking_dict = blank_spectra(combined_df(), 'Blank',
+                                  match_on=['ethanol concentration wtf'],
+                                  decimals=6)
+    blanks_df = blanking_dict['Blanks']
+    assert blanks_df['Replicates'].tolist() == [2, 2]
+    np.testing.assert_array_equal(blanks_df[['400.0nm', '500.0nm']],
+                                  [[2, 1], [15, 5]])
+
+    blanked_df = blanking_dict['Blanked']
+    assert blanked_df['UID'].tolist() == ['S1', 'S2', 'S3']
+    np.testing.assert_array_equal(blanked_df[['400.0nm', '500.0nm']],
+                                  [[3, 2], [10, 4], [4, 3]])
+    np.testing.assert_array_equal(
+        blanking_dict['Unblanked'][['400.0nm', '500.0nm']],
+        [[5, 3], [25, 9], [6, 4]])
+    # the float32 spectra are not promoted
+    assert (blanked_df[['400.0nm', '500.0nm']].dtypes == np.float32).all()
+    assert (blanks_df[['400.0nm', '500.0nm']].dtypes == np.float32).all()
+
+
+def test_single_blank_and_included_blanks():
+    blanking_dict = blank_spectra(combined_df(np.float64), 'Blank',
+                                  include_blanks=True)
+    blanked_df = blanking_dict['Blanked']
+    assert len(blanked_df) == 7
+    assert blanking_dict['Blanks']['Replicates'].tolist() == [4]
+    np.testing.assert_array_equal(blanked_df['400.0nm'],
+                                  [-7.5, -5.5, 1.5, 11.5, -3.5, 16.5, -2.5])
+    assert blanked_df['400.0nm'].dtype == np.float64
+
+
+def test_unmatched_samples_are_reported():
+    # without rounding the noisy composition has no blank
+    with pytest.raises(AssertionError, match='No blank matches'):
+        blank_spectra(combined_df(), 'Blank',
+                      match_on=['ethanol concentration wtf'])
+    with pytest.raises(AssertionError, match='no blanks'):
+        blank_spectra(combined_df(), np.zeros(7, dtype=bool))
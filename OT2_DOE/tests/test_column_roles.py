@@ -0,0 +1,55 @@
+import os
+
+import pandas as pd
+import pytest
+
+from Plan import CreateSamples
+
+package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+example_plans = ['07_22_21_Octadecene_SDS.csv', '06_23_21_CdSe.csv',
+                 'New_Testing_Protocol_Generalized.csv']
+
+
+def example_plan_columns(plan_file):
+    """Column names of the sample table built from an example plan, as in the
+    Plan and Prepare notebook."""
+    plan = CreateSamples.get_experiment_plan(
+        os.path.join(package_dir, 'Testing Plans', plan_file),
+        os.path.join(package_dir, 'Chemical Database.csv'))
+    names = plan['Component Shorthand Names']
+    units = plan['Component Concentration Units']
+    columns = [name + ' concentration ' + unit
+               for name, unit in zip(names, units)]
+    for name in names:
+        columns += [name + ' amount mass g', name + ' amount volume mL']
+    columns += [stock_name + ' amount volume mL'
+                for stock_name in plan['Stock Names']]
+    return columns + ['UID', 'Labware', 'Slot', 'Well', 'Total Volume mL',
+                      'Negative Stock Volume', 'Stock Solve Residual']
+
+
+@pytest.mark.parametrize('plan_file', example_plans)
+@pytest.mark.parametrize('common_string',
+                         ['stock', 'concentration', 'mass', 'volume'])
+def test_isolate_common_column_matches_name_search(plan_file, common_string):
+    columns = example_plan_columns(plan_file)
+    df = pd.DataFrame([[0]*len(columns)], columns=columns)
+    isolated = CreateSamples.isolate_common_column(df, common_string)
+    assert list(isolated.columns) == [column for column in columns
+                                      if common_string in column]
+
+
+def test_flag_columns_have_no_role():
+    role = CreateSamples.parse_column_role('Negative Stock Volume')
+    assert (role.role, role.quantity, role.unit) == ('other', None, None)
+    role = CreateSamples.parse_column_role('Total Volume mL')
+    assert (role.role, role.quantity, role.unit) == ('other', None, 'mL')
+
+
+def test_unit_is_the_last_word():
+    role = CreateSamples.parse_column_role('ODE concentration mgpermL')
+    assert (role.component, role.role, role.quantity, role.unit) == \
+        ('ODE', 'component', 'concentration', 'mgpermL')
+    role = CreateSamples.parse_column_role('SDS-ethanol-stock amount volume mL')
+    assert (role.component, role.role, role.quantity, role.unit) == \
+        ('SDS-ethanol-stock', 'stock', 'volume', 'mL')
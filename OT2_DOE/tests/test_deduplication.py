@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+
+from Plan import CreateSamples
+
+
+def test_codes_count_from_the_column_minimum():
+    values = np.array([[1000.0, 0.5, np.nan],
+                       [1000.3, 0.7, np.nan],
+                       [1000.1, np.nan, np.nan]])
+    quantized = CreateSamples.quantize_compositions(values,
+                                                    np.full(3, 0.1))
+    np.testing.assert_array_equal(quantized, [[1, 1, 0],
+                                              [4, 3, 0],
+                                              [2, 0, 0]])
+
+
+def test_offset_compositions_use_packed_keys():
+    # 6 columns of 1000 steps each fit a packed int64 key once the offset of
+    # the values is removed, but not when the codes count from 0
+    rng = np.random.default_rng(0)
+    values = 1e3 + rng.integers(0, 1000, size=(500, 6))*1e-3
+    quantized = CreateSamples.quantize_compositions(values,
+                                                    np.full(6, 1e-3))
+    radices = quantized.max(axis=0) + 1
+    assert np.sum(np.log2(radices)) < 62
+
+    df = pd.DataFrame(np.vstack([values, values[:10] + 1e-5]),
+                      columns=['c' + str(i) + ' concentration wtf'
+                               for i in range(6)])
+    deduplicated_df = CreateSamples.deduplicate_compositions(df, 1e-3)
+    assert list(deduplicated_df.index) == list(
+        pd.DataFrame(values).drop_duplicates().index)
+
+
+def test_merging_follows_the_tolerance_grid():
+    df = pd.DataFrame({'x concentration wtf': [0.1499, 0.1501, 0.151,
+                                               0.249]})
+    deduplicated_df, groups = CreateSamples.deduplicate_compositions(
+        df, 0.1, return_groups=True)
+    # 0.1499 and 0.1501 round to different multiples of the tolerance
+    assert list(deduplicated_df.index) == [0, 1]
+    assert groups == {1: [1, 2, 3]}
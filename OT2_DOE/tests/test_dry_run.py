@@ -0,0 +1,48 @@
+import importlib
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+custom_labware = os.path.join(package_dir, 'Custom Labware')
+
+experiment_dict = {
+    'OT2 Destination Labwares': ['falcon_48_wellplate_1500ul'],
+    'OT2 Destination Labware Slots': ['2'],
+    'OT2 Stock Labwares': ['20mlscintillation_12_wellplate_18000ul'],
+    'OT2 Stock Labware Slots': ['1'],
+    'OT2 Left Pipette': 'p300_single_gen2',
+    'OT2 Left Pipette Aspiration Rate (uL/sec)': 100,
+    'OT2 Left Pipette Dispense Rate (uL/sec)': 200,
+    'OT2 Right Pipette': 'p1000_single_gen2',
+    'OT2 Right Pipette Aspiration Rate (uL/sec)': 200,
+    'OT2 Right Pipette Dispense Rate (uL/sec)': 400}
+
+
+def import_without_opentrons(monkeypatch, module_name):
+    """Imports a module afresh with opentrons made unimportable."""
+    monkeypatch.setitem(sys.modules, 'opentrons', None)
+    monkeypatch.setitem(sys.modules, 'opentrons.simulate', None)
+    for name in list(sys.modules):
+        if name.startswith('Prepare.'):
+            monkeypatch.delitem(sys.modules, name)
+    return importlib.import_module(module_name)
+
+
+def test_dry_run_estimate_without_opentrons(monkeypatch):
+    DryRun = import_without_opentrons(monkeypatch, 'Prepare.DryRun')
+    TransferPlan = sys.modules['Prepare.TransferPlan']
+    assert 'Prepare.OT2Commands' not in sys.modules
+
+    volume_df = pd.DataFrame({'water stock uL': [400., 250., 40., 900.],
+                              'ethanol stock uL': [100., 250., 460., 0.]})
+    transfer_plan = TransferPlan.TransferPlan.from_volumes(
+        volume_df, experiment_dict, custom_labware)
+    for mode in ['component', 'sample']:
+        run_time = DryRun.estimate_run_time(transfer_plan, experiment_dict,
+                                            custom_labware, mode=mode)
+        assert list(run_time.index) == DryRun.run_phases + ['Total']
+        assert np.isclose(run_time['Total'], run_time.drop('Total').sum())
+        assert run_time['Aspirate'] > 0 and run_time['Travel'] > 0
@@ -0,0 +1,176 @@
+import zipfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from Process import PlateReader
+
+
+def plate_df(values, wells=('A1', 'A2')):
+    """Plate reader dataframe as read from a sheet: a 'Wavelength' row and
+    one row per well."""
+    return pd.DataFrame([[400, 500]] + [list(row) for row in values],
+                        index=['Wavelength'] + list(wells), dtype=object)
+
+
+def test_spectra_cache_hit_and_invalidation(tmp_path, monkeypatch):
+    path = str(tmp_path / 'plate.xlsx')
+    with open(path, 'wb') as file:
+        file.write(b'first export')
+    reads = []
+
+    def extract_plates(path, sheet_list):
+        reads.append(path)
+        return [plate_df([[0.1, 'OVRFLW'], [0.3, 0.4]])
+                for _ in sheet_list]
+    monkeypatch.setattr(PlateReader, 'extract_plates', extract_plates)
+
+    first = PlateReader.load_plate_spectra(path, ['Sheet1'])
+    cached = PlateReader.load_plate_spectra(path, ['Sheet1'], policy='cap')
+    assert len(reads) == 1
+    np.testing.assert_array_equal(first['Sheet1']['Absorbance'],
+                                  np.array([[0.1, np.nan], [0.3, 0.4]],
+                                           dtype=np.float32))
+    np.testing.assert_array_equal(cached['Sheet1']['Absorbance'],
+                                  np.array([[0.1, 15], [0.3, 0.4]],
+                                           dtype=np.float32))
+    assert list(cached['Sheet1']['Wells']) == ['A1', 'A2']
+
+    # a rewritten workbook has another hash, the cache is not used
+    with open(path, 'wb') as file:
+        file.write(b'second export')
+    PlateReader.load_plate_spectra(path, ['Sheet1'])
+    assert len(reads) == 2
+    PlateReader.load_plate_spectra(path, ['Sheet1'])
+    assert len(reads) == 2
+    # nor for sheets it does not hold, or when turned off
+    PlateReader.load_plate_spectra(path, ['Sheet1', 'Sheet2'])
+    PlateReader.load_plate_spectra(path, ['Sheet1'], cache=False)
+    assert len(reads) == 4
+
+
+def test_watch_retries_half_written_exports(tmp_path, monkeypatch):
+    path = str(tmp_path / 'plate.xlsx')
+    with open(path, 'wb') as file:
+        file.write(b'PK partial')
+    attempts = []
+
+    def load_plate_spectra(path, sheet_list, **kwargs):
+        attempts.append(path)
+        if len(attempts) == 1:
+            raise zipfile.BadZipFile('File is not a zip file')
+        return {'Sheet1': 'spectra'}
+    monkeypatch.setattr(PlateReader, 'load_plate_spectra', load_plate_spectra)
+
+    watcher = PlateReader.watch_plate_exports(str(tmp_path), ['Sheet1'],
+                                              poll_interval=0, settle_time=0)
+    assert next(watcher) == (path, {'Sheet1': 'spectra'})
+    assert attempts == [path, path]
+    watcher.close()
+
+
+def sample_info(slots, wells):
+    return pd.DataFrame({'UID': ['S' + str(slot) + '_' + str(well)
+                                 for slot, well in zip(slots, wells)],
+                         'Slot': slots, 'Well': wells})
+
+
+def spectra(wells, absorbance):
+    return {'Wells': pd.Index(wells, dtype=object),
+            'Wavelengths': np.array([400., 500.]),
+            'Absorbance': np.asarray(absorbance, dtype=np.float32),
+            'Saturated': np.zeros((len(wells), 2), dtype=bool)}
+
+
+def test_join_matches_plates_on_slot_and_well():
+    plates = {'Plate 1': spectra(['A1', 'A2'], [[1, 1], [2, 2]]),
+              'Plate 2': spectra(['A1', 'A2'], [[3, 3], [4, 4]])}
+    # rows out of plate order, float and text slots, padded lower case wells
+    info_df = sample_info([5.0, 2, '5', 2], ['a02', 'A1', 'A01', 'a2'])
+    combined_df = PlateReader.join_abs_to_sample_info(
+        info_df, plates, plate_slots={'Plate 1': '2', 'Plate 2': 5})
+    assert list(combined_df.columns) == \
+        ['UID', 'Slot', 'Well', '400.0nm', '500.0nm']
+    np.testing.assert_array_equal(combined_df['400.0nm'], [4, 1, 3, 2])
+    assert (combined_df[['400.0nm', '500.0nm']].dtypes == np.float32).all()
+    pd.testing.assert_frame_equal(combined_df[['UID', 'Slot', 'Well']],
+                                  info_df)
+
+    # list of plates with their slots in the same order
+    listed_df = PlateReader.join_abs_to_sample_info(
+        info_df, list(plates.values()), plate_slots=[2, 5])
+    pd.testing.assert_frame_equal(listed_df, combined_df)
+
+
+def test_join_single_plate_dataframe():
+    abs_df = plate_df([[0.5, 0.6], [0.7, 0.8]], wells=['B1', 'B2'])
+    info_df = sample_info([1, 1], ['B2', 'B1'])
+    combined_df = PlateReader.add_abs_to_sample_info(info_df, abs_df)
+    np.testing.assert_array_equal(combined_df['500nm'].astype(float),
+                                  [0.8, 0.6])
+    assert 'Wavelength' in abs_df.index  # the plate is not modified
+
+
+def test_join_assertions():
+    plate = spectra(['A1', 'A2'], [[1, 1], [2, 2]])
+    with pytest.raises(AssertionError, match='No absorbance'):
+        PlateReader.join_abs_to_sample_info(
+            sample_info([1, 1], ['A1', 'A3']), plate)
+    with pytest.raises(AssertionError, match='share the'):
+        PlateReader.join_abs_to_sample_info(
+            sample_info([1, 1], ['A1', 'a01']), plate)
+    with pytest.raises(AssertionError, match='duplicated wells'):
+        PlateReader.join_abs_to_sample_info(
+            sample_info([1], ['A1']), spectra(['A1', 'A01'], [[1, 1]]*2))
+    with pytest.raises(AssertionError, match='plate_slots is required'):
+        PlateReader.join_abs_to_sample_info(sample_info([1], ['A1']),
+                                            [plate, plate])
+    with pytest.raises(AssertionError, match='missing plates'):
+        PlateReader.join_abs_to_sample_info(
+            sample_info([1], ['A1']), {'Plate 1': plate, 'Plate 2': plate},
+            plate_slots={'Plate 1': 1})
+
+
+def test_sample_info_without_wells_is_rejected():
+    # the absorbance used to be concatenated by row order
+    info_df = pd.DataFrame({'ethanol concentration wtf': [0.1, 0.2]})
+    abs_df = plate_df([[0.5, 0.6], [0.7, 0.8]])
+    with pytest.raises(AssertionError, match='no Well column'):
+        PlateReader.add_abs_to_sample_info(info_df, abs_df)
+
+
+def test_spectra_matrix_overflow_policies():
+    abs_df = plate_df([[0.1, 'OVRFLW'], ['OVRFLW', 0.4]])
+    expected = {'nan': np.nan, 'cap': 9, 'max': 3.5}
+    for policy, fill_value in expected.items():
+        spectra = PlateReader.spectra_matrix(abs_df, policy=policy, holder=9,
+                                             instrument_max=3.5)
+        np.testing.assert_array_equal(spectra['Wavelengths'], [400, 500])
+        assert list(spectra['Wells']) == ['A1', 'A2']
+        assert spectra['Absorbance'].dtype == np.float32
+        np.testing.assert_array_equal(
+            spectra['Saturated'], [[False, True], [True, False]])
+        np.testing.assert_array_equal(
+            spectra['Absorbance'],
+            np.array([[0.1, fill_value], [fill_value, 0.4]],
+                     dtype=np.float32))
+    with pytest.raises(AssertionError, match='policy must be one of'):
+        PlateReader.spectra_matrix(abs_df, policy='clip')
+
+    # reheaded plates give the same matrix, in the dtype asked for
+    spectra = PlateReader.spectra_matrix(
+        PlateReader.rehead_wavelengths(abs_df), dtype=np.float64)
+    assert spectra['Absorbance'].dtype == np.float64
+    np.testing.assert_array_equal(spectra['Wavelengths'], [400, 500])
+
+
+def test_detect_ovflw_returns_numbers():
+    abs_df = plate_df([[0.1, 'OVRFLW'], [0.3, 0.4]]).drop(['Wavelength'])
+    detected_df = PlateReader.detect_ovflw(abs_df)
+    assert (detected_df.dtypes == float).all()
+    np.testing.assert_array_equal(detected_df, [[0.1, 15], [0.3, 0.4]])
+    # a text holder leaves its columns as objects
+    detected_df = PlateReader.detect_ovflw(abs_df, holder='sat')
+    assert detected_df.dtypes.tolist() == [float, object]
+    assert detected_df.iloc[0, 1] == 'sat'
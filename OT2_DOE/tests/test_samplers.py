@@ -0,0 +1,31 @@
+import warnings
+
+import numpy as np
+import pytest
+
+from Plan import CreateSamples
+
+
+@pytest.mark.parametrize('method', ['lhs', 'sobol', 'halton', 'maximin'])
+def test_samplers_are_seeded_and_quiet(method):
+    bounds = [[0, 0.6], [0, 0.6], [0, 0.6]]
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        df = CreateSamples.concentration_from_sampler(
+            ['a', 'b', 'c'], bounds, ['wtf']*3, 37, method=method, seed=3)
+        repeated_df = CreateSamples.concentration_from_sampler(
+            ['a', 'b', 'c'], bounds, ['wtf']*3, 37, method=method, seed=3)
+    assert len(df) == 37
+    assert df.equals(repeated_df)
+
+
+def test_sobol_redraws_keep_powers_of_two():
+    # the unity filter rejects points so the sequence is drawn from again,
+    # every total drawn stays a power of two and scipy does not warn
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        points = CreateSamples.sample_concentration_space(
+            np.zeros(3), np.full(3, 0.9), 50, 'sobol', unity_filter=True,
+            seed=1)
+    assert len(points) == 50
+    assert (points.sum(axis=1) < 1).all()
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from Process.SpectralFeatures import spectral_features
+
+wavelengths = np.arange(400, 601, 10)
+
+
+def combined_df():
+    """Gaussian peaks at 450 and 520 nm, a line and a saturated spectrum,
+    with the wavelength columns out of order."""
+    spectra = [np.exp(-((wavelengths - 450)/30)**2),
+               2*np.exp(-((wavelengths - 520)/30)**2),
+               0.01*wavelengths,
+               np.full(len(wavelengths), np.nan)]
+    spectra_df = pd.DataFrame(spectra, columns=[str(float(wavelength)) + 'nm'
+                                                for wavelength in wavelengths])
+    info_df = pd.DataFrame({'UID': ['S1', 'S2', 'S3', 'S4'],
+                            'SDS concentration wtf': [0.1, 0.2, 0.3, 0.4]})
+    return pd.concat([info_df, spectra_df[spectra_df.columns[::-1]]], axis=1)
+
+
+def test_peaks_integrals_ratios_and_derivatives():
+    features_df = spectral_features(
+        combined_df(), peak_windows=[(400, 600), (500, 600)],
+        bands=[(400, 600)], ratios=[(450, 520)],
+        derivative_wavelengths=[500])
+    assert list(features_df.columns[:2]) == ['UID', 'SDS concentration wtf']
+    np.testing.assert_array_equal(features_df['Peak Wavelength 400-600nm'],
+                                  [450, 520, 600, np.nan])
+    np.testing.assert_allclose(features_df['Peak Absorbance 400-600nm'],
+                               [1, 2, 6, np.nan])
+    np.testing.assert_array_equal(features_df['Peak Wavelength 500-600nm'],
+                                  [500, 520, 600, np.nan])
+    # the line integrates exactly with the trapezoidal rule
+    assert features_df['Integral 400-600nm'][2] == \
+        pytest.approx(0.01*(600**2 - 400**2)/2)
+    np.testing.assert_allclose(features_df['Ratio 450nm/520nm'][:3],
+                               [1/np.exp(-(70/30)**2),
+                                np.exp(-(70/30)**2), 4.5/5.2])
+    np.testing.assert_allclose(features_df['First Derivative 500nm'][2],
+                               0.01)
+    np.testing.assert_allclose(features_df['Second Derivative 500nm'][2], 0,
+                               atol=1e-12)
+    assert '450.0nm' not in features_df
+
+
+def test_smoothing_and_kept_spectra():
+    df = combined_df().iloc[:3]
+    features_df = spectral_features(
+        df, smoothing={'window_length': 5, 'polyorder': 2},
+        keep_spectra=True)
+    assert '450.0nm' in features_df
+    pd.testing.assert_frame_equal(features_df[df.columns], df)
+    # the default window is the read range, a quadratic filter leaves the
+    # line as it is
+    assert features_df['Peak Absorbance 400.0-600.0nm'][2] == \
+        pytest.approx(6)
+
+
+def test_feature_assertions():
+    df = combined_df()
+    df.loc[1, 'UID'] = 'S1'
+    with pytest.raises(AssertionError, match='not unique'):
+        spectral_features(df)
+    with pytest.raises(AssertionError, match='outside the read range'):
+        spectral_features(combined_df(), ratios=[(450, 700)])
+    with pytest.raises(AssertionError, match='less than two wavelengths'):
+        spectral_features(combined_df(), bands=[(401, 409)])
@@ -0,0 +1,85 @@
+import os
+
+import numpy as np
+import pytest
+
+from Plan import CreateSamples
+
+package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def octadecene_plan():
+    plan = CreateSamples.get_experiment_plan(
+        os.path.join(package_dir, 'Testing Plans',
+                     '07_22_21_Octadecene_SDS.csv'),
+        os.path.join(package_dir, 'Chemical Database.csv'))
+    names = plan['Component Shorthand Names']
+    linspaces = plan['Component Concentration Linspaces [min, max, n]']
+    units = plan['Component Concentration Units']
+    concentration_df = CreateSamples.concentration_from_linspace(
+        names[:3], linspaces, units[:3])
+    concentration_df['water concentration wtf'] = \
+        1 - concentration_df.sum(axis=1)
+    stock_dict = CreateSamples.stock_dictionary(
+        plan['Stock Names'], plan['Stock Concentration Units'],
+        plan['Stock Concentrations'],
+        stock_densities=plan['Stock Densities (g/mL)'])
+    amounts_df = CreateSamples.determine_component_amounts(
+        plan, concentration_df, nan_fill_value=0)
+    return plan, stock_dict, amounts_df
+
+
+def test_stock_volumes_match_per_stock_calculation(octadecene_plan):
+    plan, stock_dict, amounts_df = octadecene_plan
+    stock_df = CreateSamples.calculate_stock_volumes_from_component_concs(
+        plan, amounts_df, stock_dict)
+    # mgpermL stocks: solute mass/(g per mL), wtf stocks: mass/(wtf*density)
+    expected = {'ODE-ethanol-stock': amounts_df['ODE amount mass g']/0.005,
+                'SDS-ethanol-stock': amounts_df['SDS amount mass g']/0.003,
+                'ethanol-stock': amounts_df['ethanol amount mass g']/0.789,
+                'water-stock': amounts_df['water amount mass g']/1}
+    for stock_name, volumes in expected.items():
+        np.testing.assert_allclose(
+            stock_df[stock_name + ' amount volume mL'], volumes)
+    assert 'Negative Stock Volume' not in stock_df
+
+
+def test_common_solvent_residual_matches_solver(octadecene_plan):
+    plan, stock_dict, amounts_df = octadecene_plan
+    stock_df = CreateSamples.calculate_stock_volumes_from_component_concs(
+        plan, amounts_df, stock_dict)
+    residual_df = CreateSamples.calculate_common_solvent_residual_volumes(
+        stock_df, stock_dict)
+    carried = stock_df['ODE-ethanol-stock amount volume mL'] - \
+        amounts_df['ODE amount volume mL'] + \
+        stock_df['SDS-ethanol-stock amount volume mL'] - \
+        amounts_df['SDS amount volume mL']
+    np.testing.assert_allclose(
+        residual_df['ethanol-stock amount volume mL'],
+        stock_df['ethanol-stock amount volume mL'] - carried)
+
+    # the solver tracking solvents accounts for the ethanol directly
+    solved_df = CreateSamples.solve_stock_volumes(plan, amounts_df,
+                                                  stock_dict)
+    stock_columns = [stock_name + ' amount volume mL'
+                     for stock_name in stock_dict]
+    np.testing.assert_allclose(solved_df[stock_columns],
+                               residual_df[stock_columns], atol=1e-4)
+
+
+def test_multi_solute_stocks(octadecene_plan):
+    plan, _, amounts_df = octadecene_plan
+    stock_dict = CreateSamples.stock_dictionary(
+        ['ODE-SDS-ethanol-stock', 'ethanol-stock', 'water-stock'],
+        ['mgpermL', 'wtf', 'wtf'], [[5, 3], 1, 1], [0.789, 0.789, 1])
+    stock_df = CreateSamples.calculate_stock_volumes_from_component_concs(
+        plan, amounts_df, stock_dict)
+    assert 'ODE-SDS-ethanol-stock amount volume mL' in stock_df
+
+    with pytest.raises(AssertionError):
+        CreateSamples.calculate_stock_volumes_from_component_masses(
+            plan, amounts_df, stock_dict)
+    with pytest.raises(AssertionError):
+        CreateSamples.stock_dictionary(['ODE-SDS-ethanol-stock'],
+                                       ['mgpermL'], [[5]])
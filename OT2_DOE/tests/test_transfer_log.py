@@ -0,0 +1,46 @@
+from Prepare.TransferLog import TransferLog
+
+
+class CommandList:
+    """Protocol stand in keeping the command texts, as protocol.commands()."""
+
+    def __init__(self):
+        self.command_texts = []
+
+    def commands(self):
+        return list(self.command_texts)
+
+    def transfer(self, tip=None):
+        if tip is not None:
+            self.command_texts.append('Picking up tip from ' + tip)
+        self.command_texts += ['Transferring 50.0 from A1 of Stock',
+                               'Aspirating 50.0 uL from A1 of Stock',
+                               'Dispensing 50.0 uL into A1 of Plate']
+        if tip is not None:
+            self.command_texts.append('Dropping tip into Trash')
+
+
+def test_tips_picked_up_by_opentrons_are_recorded():
+    protocol = CommandList()
+    transfer_log = TransferLog()
+    tips = ['A1 of Tip Rack on 7', 'B1 of Tip Rack on 7']
+    for sample, tip in enumerate(tips):  # new_tip='always'
+        with transfer_log.step(protocol, Phase='Sample Making',
+                               Sample=sample, Stock='water', Tip=None):
+            protocol.transfer(tip)
+
+    # new_tip='never': the tip given is only picked up by the first event
+    with transfer_log.step(protocol, Phase='Sample Making', Sample=2,
+                           Stock='ethanol', Tip='C1 of Tip Rack on 7'):
+        protocol.transfer('C1 of Tip Rack on 7')
+    with transfer_log.step(protocol, Phase='Sample Making', Sample=3,
+                           Stock='ethanol', Tip='C1 of Tip Rack on 7'):
+        protocol.transfer()
+
+    events_df = transfer_log.to_frame()
+    assert events_df['Tip'].tolist() == tips + ['C1 of Tip Rack on 7']*2
+    assert events_df['Tips'].tolist() == [1, 1, 1, 0]
+    assert events_df['Commands'].tolist() == [5, 5, 5, 3]
+    summary = transfer_log.summary()
+    assert summary.loc['Sample Making', 'Tips'] == 3
+    assert transfer_log.summary(by='Stock')['Tips'].tolist() == [2, 1]
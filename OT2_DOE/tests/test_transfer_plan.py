@@ -0,0 +1,58 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from Plan import CreateSamples
+from Prepare.TransferPlan import TransferPlan
+from Prepare.TransferTables import stock_allocation_order
+
+package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+custom_labware = os.path.join(package_dir, 'Custom Labware')
+
+experiment_dict = {
+    'OT2 Destination Labwares': ['falcon_48_wellplate_1500ul'],
+    'OT2 Destination Labware Slots': ['2'],
+    'OT2 Stock Labwares': ['20mlscintillation_12_wellplate_18000ul'],
+    'OT2 Stock Labware Slots': ['1']}
+
+# 2 wells of water (16.2 mL usable per well), 1 of ethanol and 1 of toluene
+volume_df = pd.DataFrame({'water stock uL': [8000., 8000., 8000.],
+                          'ethanol stock uL': [100., 200., 300.],
+                          'toluene stock uL': [50., 50., 50.]})
+
+
+def stock_wells(transfer_plan):
+    transfers = transfer_plan.transfers
+    return {transfer_plan.stock_names[stock]: sorted(set(wells))
+            for stock, wells in transfers.groupby('Stock')['Source Well']}
+
+
+def test_plan_stock_order():
+    plan = CreateSamples.get_experiment_plan(
+        os.path.join(package_dir, 'Example_Opentrons_Protocol.csv'),
+        os.path.join(package_dir, 'Chemical Database.csv'))
+    stock_order = plan['OT2 Stock Labware Stock Order']
+    assert stock_order == [[1, 2], [3, 4, 5, 6, 7, 8, 9, 10, 11, 12]]
+    np.testing.assert_array_equal(stock_allocation_order(stock_order, 3),
+                                  [0, 1, 2])
+
+    for stock_allocation in ['ranges', 'bin packing']:
+        transfer_plan = TransferPlan.from_volumes(
+            volume_df, experiment_dict, custom_labware,
+            stock_allocation=stock_allocation, stock_order=stock_order)
+        assert stock_wells(transfer_plan) == {
+            'water stock uL': [0, 1], 'ethanol stock uL': [2],
+            'toluene stock uL': [3]}
+
+
+def test_nested_stock_order_positions():
+    # toluene first, then water, ethanol last
+    stock_order = [[2, 3], [1]]
+    np.testing.assert_array_equal(stock_allocation_order(stock_order, 3),
+                                  [2, 0, 1])
+    transfer_plan = TransferPlan.from_volumes(
+        volume_df, experiment_dict, custom_labware, stock_order=stock_order)
+    assert stock_wells(transfer_plan) == {
+        'toluene stock uL': [0], 'water stock uL': [1, 2],
+        'ethanol stock uL': [3]}
@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+from Prepare.TransferTables import schedule_component_wise_transfers, \
+    schedule_summary
+
+
+def interleaved_directions(n_samples=12, n_wells=3, volume=50.):
+    """Sample making table of one stock whose wells alternate by sample."""
+    wells = np.arange(n_samples) % n_wells
+    return pd.DataFrame({
+        'Sample Index': np.arange(n_samples),
+        'Stock Name': 'water stock uL',
+        'Stock Well Index': wells,
+        'Stock Position': ['A' + str(well + 1) + ' of Stock'
+                           for well in wells],
+        'Destination Well Index': np.arange(n_samples),
+        'Destination Well Position': ['well ' + str(i)
+                                      for i in range(n_samples)],
+        'Stock Volume': volume})
+
+
+def test_interleaved_stock_wells_are_batched():
+    directions_df = interleaved_directions()
+    schedule = schedule_component_wise_transfers(directions_df, (20, 300),
+                                                 (100, 1000))
+    # 4 samples of 50 uL per well plus the 20 uL disposal fit in 300 uL
+    assert len(schedule) == 3
+    assert schedule['Stock Position'].tolist() == \
+        ['A1 of Stock', 'A2 of Stock', 'A3 of Stock']
+    position_of = dict(zip(directions_df['Destination Well Position'],
+                           directions_df['Stock Position']))
+    for stock_position, destinations in zip(schedule['Stock Position'],
+                                            schedule['Destination Wells']):
+        assert all(position_of[well] == stock_position
+                   for well in destinations)
+    assert sorted(sum(schedule['Destination Wells'].tolist(), [])) == \
+        sorted(directions_df['Destination Well Position'])
+    assert schedule_summary(schedule)['Small Tips'] == 1
+
+
+def test_unbatched_schedule_keeps_plan_order():
+    directions_df = interleaved_directions()
+    schedule = schedule_component_wise_transfers(
+        directions_df, (20, 300), (100, 1000), batch=False)
+    assert sum(schedule['Destination Wells'].tolist(), []) == \
+        directions_df['Destination Well Position'].tolist()